@@ -0,0 +1,111 @@
+"""
+Parse cost and peak memory of one webhook body, old parsing against alertbot.ingestion.
+
+Usage (from the repository root):
+    python benchmarks/bench_ingestion.py [--sizes 10,200,2000] [--repeat 5]
+
+"legacy" is what the endpoints did before: the Prometheus body went through json.loads
+and was then validated from the dict (FastAPI's generic body handling), the Splunk body
+was decoded to a str for json.loads. Peak memory is measured with tracemalloc and covers
+everything allocated while parsing, the result included.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from alertbot.schemas import AlertRequestPrometheus
+from alertbot.ingestion import parse_prometheus, parse_splunk
+
+
+def legacy_prometheus(body: bytes) -> AlertRequestPrometheus:
+    return AlertRequestPrometheus.model_validate(json.loads(body))
+
+
+def legacy_splunk(body: bytes):
+    try:
+        return json.loads(body.decode('utf-8')) if body else {}
+    except json.JSONDecodeError:
+        return {"raw_body": body.decode('utf-8') if body else 'Empty body'}
+
+
+def prometheus_body(sample: dict, size: int) -> bytes:
+    body = copy.deepcopy(sample)
+    template = body["alerts"][0]
+    alerts = []
+    for index in range(size):
+        alert = copy.deepcopy(template)
+        alert["labels"]["instance"] = f"node-{index}:9100"
+        alert["annotations"]["description"] = f"Node node-{index} is not reachable from the scraper."
+        alert["fingerprint"] = f"{index:016x}"
+        alerts.append(alert)
+    body["alerts"] = alerts
+    return json.dumps(body).encode()
+
+
+def splunk_body(size: int) -> bytes:
+    # Shaped like a splunk alert action with `size` result rows
+    return json.dumps({
+        "sid": "scheduler__admin__search__RMD5_at_1714550400_42",
+        "search_name": "Failed logins",
+        "app": "search",
+        "owner": "admin",
+        "results_link": "https://splunk.example.com/app/search/@go?sid=42",
+        "result": {"host": "web-1", "count": str(size)},
+        "results": [{"host": f"web-{index}", "user": f"user-{index}", "count": str(index),
+                     "message": "Login failed for user from 10.0.0.1"} for index in range(size)],
+    }).encode()
+
+
+def best_of(repeat: int, function, *args) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(function, *args) -> int:
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argument_parser.add_argument("--sizes", default="10,200,2000", help="alerts (or splunk results) per body, comma separated")
+    argument_parser.add_argument("--repeat", type=int, default=5)
+    args = argument_parser.parse_args()
+
+    with open(os.path.join(ROOT, "samples", "prometheus-alert-firing.json")) as file:
+        sample = json.load(file)
+
+    print(f"{'source':<11} {'items':>6} {'body KiB':>9} {'legacy ms':>10} {'new ms':>8} {'speedup':>8} "
+          f"{'legacy KiB':>11} {'new KiB':>8}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        for name, body, legacy, new in (
+            ("prometheus", prometheus_body(sample, size), legacy_prometheus, parse_prometheus),
+            ("splunk", splunk_body(size), legacy_splunk, parse_splunk),
+        ):
+            assert new(body) == legacy(body), f"{name} parsing differs from the legacy one"
+            legacy_time = best_of(args.repeat, legacy, body)
+            new_time = best_of(args.repeat, new, body)
+            print(f"{name:<11} {size:>6} {len(body) / 1024:>9.1f} {legacy_time * 1000:>10.2f} "
+                  f"{new_time * 1000:>8.2f} {legacy_time / new_time:>7.1f}x "
+                  f"{peak_memory(legacy, body) / 1024:>11.1f} {peak_memory(new, body) / 1024:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Peak memory and time to the first Telegram chunk for a large alert group, buffered
+against streaming handling.
+
+Usage (from the repository root):
+    python benchmarks/bench_streaming.py [--sizes 200,2000,10000] [--receive-chunk 65536]
+
+"buffered" is the path used for small webhooks: the whole body is read, parsed, rendered
+into one string and then split. "streaming" feeds the body to AlertStreamParser as it
+would be received and sends the chunks of TelegramTemplater.iter_parts() as they fill up.
+In both, every alert of the group is parsed before the first one is rendered, streaming
+saves the copies of the body and of the whole message text.
+The body the chunks are cut from is allocated before measuring, peak memory (tracemalloc)
+covers everything else the request needs. Each chunk is handed to a no-op sender.
+"""
+import argparse
+import codecs
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from alertbot.constants import TELEGRAM_MAX_MESSAGE_LENGTH
+from alertbot.ingestion import parse_prometheus, AlertStreamParser
+from handlers.telegram_handler.message_splitter import split_message, iter_chunks
+from templaters.telegram_templater import TelegramTemplater
+
+
+def group_body(sample: dict, size: int) -> bytes:
+    body = copy.deepcopy(sample)
+    template = body["alerts"][0]
+    alerts = []
+    for index in range(size):
+        alert = copy.deepcopy(template)
+        alert["labels"]["instance"] = f"node-{index}:9100"
+        alert["annotations"]["description"] = f"Node node-{index} is not reachable from the scraper."
+        alert["annotations"]["runbook_url"] = f"https://runbooks.example.com/node/{index}"
+        alert["fingerprint"] = f"{index:016x}"
+        alerts.append(alert)
+    body["alerts"] = alerts
+    body["commonLabels"].setdefault("severity", "critical")
+    return json.dumps(body).encode()
+
+
+def buffered(body: bytes, receive_chunk: int, send):
+    received = b"".join(body[start:start + receive_chunk] for start in range(0, len(body), receive_chunk))
+    group = parse_prometheus(received)
+    for chunk in split_message(TelegramTemplater(group).get_message(), TELEGRAM_MAX_MESSAGE_LENGTH):
+        send(chunk)
+
+
+def streaming(body: bytes, receive_chunk: int, send):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = AlertStreamParser()
+    for start in range(0, len(body), receive_chunk):
+        parser.feed(decoder.decode(body[start:start + receive_chunk]))
+    parser.feed(decoder.decode(b"", final=True), final=True)
+    for chunk in iter_chunks(TelegramTemplater(parser.result()).iter_parts(), TELEGRAM_MAX_MESSAGE_LENGTH):
+        send(chunk)
+
+
+def measure(function, body: bytes, receive_chunk: int):
+    """Returns (seconds until the first chunk, total seconds, peak bytes, chunks)"""
+    first = []
+    chunks = []
+
+    def send(chunk):
+        if not first:
+            first.append(time.perf_counter())
+        chunks.append(len(chunk))
+
+    start = time.perf_counter()
+    function(body, receive_chunk, send)
+    total = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        function(body, receive_chunk, lambda chunk: None)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return first[0] - start, total, peak, chunks
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argument_parser.add_argument("--sizes", default="200,2000,10000", help="alerts per group, comma separated")
+    argument_parser.add_argument("--receive-chunk", type=int, default=65536, help="bytes received at a time")
+    args = argument_parser.parse_args()
+
+    with open(os.path.join(ROOT, "samples", "prometheus-alert-firing.json")) as file:
+        sample = json.load(file)
+
+    print(f"{'alerts':>7} {'body KiB':>9} {'mode':<10} {'first ms':>9} {'total ms':>9} {'peak KiB':>9} {'chunks':>7}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        body = group_body(sample, size)
+        for name, function in (("buffered", buffered), ("streaming", streaming)):
+            first, total, peak, chunks = measure(function, body, args.receive_chunk)
+            print(f"{size:>7} {len(body) / 1024:>9.1f} {name:<10} {first * 1000:>9.2f} {total * 1000:>9.2f} "
+                  f"{peak / 1024:>9.1f} {len(chunks):>7}")
+
+
+if __name__ == "__main__":
+    main()
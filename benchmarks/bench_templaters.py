@@ -0,0 +1,165 @@
+"""
+Compares the compiled templaters with the previous str.replace based rendering.
+
+Usage (from the repository root):
+    python benchmarks/bench_templaters.py [--sizes 1,10,50,200,2000] [--repeat 20]
+
+The legacy functions below are kept verbatim from the old templaters, metrics included,
+the benchmark fails if the outputs are not identical.
+
+The old telegram rendering was quadratic, every alert rescanned the whole message, but
+for a single alert it did a little less work: it is still about 20% faster there (a
+microsecond). The compiled one is about 2x faster at 10 alerts and the gap grows with the
+group. The sms templater is faster at every size, mostly from its cached date conversion.
+"""
+from datetime import datetime
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+# The legacy sms templater converted to the system timezone, alertbot uses TZ
+os.environ.setdefault("TZ", "Asia/Tehran")
+time.tzset()
+
+from dateutil import parser as date_parser, tz
+from alertbot.schemas import AlertRequestPrometheus
+from templaters.telegram_templater import TelegramTemplater
+from templaters.telegram_templater.templates import SIGNS, UNKNOWN_SIGN, \
+    FIRING_HEADERS_TEMPLATES, FIRING_BODY_TEMPLATE, \
+    RESOLVED_HEADERS_TEMPLATES, RESOLVED_BODY_TEMPLATE
+from templaters.sms_templater import SMSTemplater
+from templaters.sms_templater.templates import SMS_ALERT_TEMPLATES
+from utils.metrics import alertbot_templater_telegram_alert_counter, alertbot_templater_sms_alert_counter
+
+
+def legacy_telegram_message(alert_group):
+    severity = alert_group.commonLabels["severity"].lower()
+    cluster = alert_group.commonLabels.get("cluster", "No Cluster!")
+    message = ""
+    if "firing" in alert_group.status.lower():
+        message += SIGNS.get(severity, UNKNOWN_SIGN)
+        message += FIRING_HEADERS_TEMPLATES[0]
+    else:
+        message += SIGNS.get("resolved", UNKNOWN_SIGN)
+        message += RESOLVED_HEADERS_TEMPLATES[0]
+    message = message.replace("##ALERTNAME##",
+            alert_group.commonLabels.get("alertname", "No alertname has been added for this alert!"))
+    message = message.replace("##CLUSTER##", cluster)
+    message = message.replace("##SUMMARY##",
+            alert_group.commonAnnotations.get("summary", "No summary has been added for this alert!"))
+    for alert in alert_group.alerts:
+        if "firing" in alert.status.lower():
+            message += FIRING_BODY_TEMPLATE[0]
+        else:
+            message += RESOLVED_BODY_TEMPLATE[0]
+        message = message.replace("##DESCRIPTION##",
+                alert.annotations.get("description", "NO DESCRIPTION!"))
+        runbook_url = alert.annotations.get("runbook_url", None)
+        if runbook_url != None:
+            message = message.replace("##RUNBOOK_URL##",
+            f"\n<a href=\"{alert.annotations.get('runbook_url')}\">Document</a>")
+        else:
+            message = message.replace("##RUNBOOK_URL##", "")
+        alertbot_templater_telegram_alert_counter.labels(
+            status=alert_group.status.lower(),
+            alertname=alert_group.commonLabels.get("alertname","unknown").lower(),
+            severity=alert_group.commonLabels.get("severity", "unknown").lower(),
+            cluster=alert_group.commonLabels.get("cluster", "unknown").lower()
+        ).inc()
+    return message
+
+
+def legacy_sms_messages(alert_group):
+    messages = []
+    for alert in alert_group.alerts:
+        alertbot_templater_sms_alert_counter.labels(
+            status=alert_group.status,
+            alertname=alert.labels.get("alertname", "No Alertname"),
+            severity=alert_group.commonLabels.get("severity", "unknown").lower(),
+            cluster=alert_group.commonLabels.get("cluster", "unknown").lower()
+        ).inc()
+        message = SMS_ALERT_TEMPLATES[0]
+        message = message.replace("##STATUS##", alert_group.status.capitalize())
+        message = message.replace("##ALERTNAME##", alert.labels.get("alertname", "No Alertname"))
+        message = message.replace("##CLUSTER##", alert.labels.get("cluster", "No Clustername"))
+        message = message.replace("##DESCRIPTION##",
+                alert.annotations.get("description", "NO DESCRIPTION!"))
+        if "firing" in alert.status.lower():
+            utc = date_parser.parse(alert.startsAt).strftime("%Y-%m-%d %H:%M:%S")
+            prefix = "Started"
+        elif "resolved" in alert.status.lower():
+            utc = date_parser.parse(alert.endsAt).strftime("%Y-%m-%d %H:%M:%S")
+            prefix = "Resolved"
+        else:
+            messages.append(message)
+            continue
+        correct_date = datetime.strptime(utc, '%Y-%m-%d %H:%M:%S') \
+            .replace(tzinfo=tz.tzutc()).astimezone(tz.tzlocal())
+        messages.append(message.replace("##DATETIME##", f"{prefix}: {correct_date}"))
+    return messages
+
+
+def build_group(sample: dict, size: int) -> AlertRequestPrometheus:
+    body = copy.deepcopy(sample)
+    template = body["alerts"][0]
+    alerts = []
+    for index in range(size):
+        alert = copy.deepcopy(template)
+        alert["labels"]["instance"] = f"node-{index}:9100"
+        alert["annotations"]["description"] = f"Node node-{index} is not reachable from the scraper."
+        if index % 3 == 0:
+            alert["annotations"]["runbook_url"] = f"https://runbooks.example.com/node/{index}"
+        else:
+            alert["annotations"].pop("runbook_url", None)
+        alert["fingerprint"] = f"{index:016x}"
+        alert["startsAt"] = f"2024-05-01T{index // 3600 % 24:02d}:{index // 60 % 60:02d}:{index % 60:02d}.{index:09d}Z"
+        alerts.append(alert)
+    body["alerts"] = alerts
+    body["commonLabels"].setdefault("severity", "critical")
+    return AlertRequestPrometheus.model_validate(body)
+
+
+def best_of(repeat: int, function, *args) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argument_parser.add_argument("--sizes", default="1,10,50,200,2000", help="alerts per group, comma separated")
+    argument_parser.add_argument("--repeat", type=int, default=20)
+    args = argument_parser.parse_args()
+
+    with open(os.path.join(ROOT, "samples", "prometheus-alert-firing.json")) as file:
+        sample = json.load(file)
+
+    print(f"{'templater':<10} {'alerts':>7} {'legacy ms':>11} {'compiled ms':>12} {'speedup':>8}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        group = build_group(sample, size)
+
+        assert TelegramTemplater(group).get_message() == legacy_telegram_message(group), \
+            "telegram output differs from the legacy templater"
+        assert SMSTemplater(group).get_messages() == legacy_sms_messages(group), \
+            "sms output differs from the legacy templater"
+
+        for name, legacy, compiled in (
+            ("telegram", legacy_telegram_message, lambda group: TelegramTemplater(group).get_message()),
+            ("sms", legacy_sms_messages, lambda group: SMSTemplater(group).get_messages()),
+        ):
+            legacy_time = best_of(args.repeat, legacy, group)
+            compiled_time = best_of(args.repeat, compiled, group)
+            print(f"{name:<10} {size:>7} {legacy_time * 1000:>11.2f} {compiled_time * 1000:>12.2f} "
+                  f"{legacy_time / compiled_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
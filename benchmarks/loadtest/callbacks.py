@@ -0,0 +1,194 @@
+"""
+Silence button latency in BOT mode with the Telegram webhook, against the fakes in fakes.py.
+
+Alertbot runs with TG_WEBHOOK_URL pointing at its own /api/v2/telegram/webhook and with the
+fake Alertmanager as ALERTMANAGER_URL. The script checks that alertbot registered the webhook
+with its secret and that updates without the secret are refused. It then sends alert groups
+to a receiver with the silence button and presses every button `--presses-per-button` times,
+posting the callback queries the way Telegram would. It measures the delay between a press
+and the fake receiving the edited message (button-press latency), and counts the silences
+created in the fake Alertmanager: one per button, whatever the number of presses.
+
+Usage (from the repository root):
+    python benchmarks/loadtest/callbacks.py [--buttons 100] [--presses-per-button 2] [--concurrency 20]
+
+Everything runs on 127.0.0.1, no network access is needed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from run import HERE, ROOT, TELEGRAM_RECEIVER, build_alert_groups, free_port, replay, summary, wait_until_up
+
+SECRET = "loadtest-secret"
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+CHAT_ID = -100200300
+
+
+def write_configs(directory: str):
+    configs = os.path.join(directory, "configs")
+    os.makedirs(configs, exist_ok=True)
+    with open(os.path.join(configs, "alertbot-config.json"), "w") as file:
+        json.dump({"destinations": [
+            {"receiver": TELEGRAM_RECEIVER, "severity": "warning",
+             "types": [{"type": "telegram", "telegram_group_id": str(CHAT_ID), "silencer": True}]},
+        ]}, file)
+    with open(os.path.join(configs, "alertbot-splunk-config.json"), "w") as file:
+        json.dump({"destinations": []}, file)
+
+
+def alert_groups(count: int) -> list:
+    """Telegram alert groups whose common labels differ, so every button silences its own group"""
+    groups = []
+    for tag, channel, body in build_alert_groups(count, 1, sms_share=0, seed=1):
+        body = json.loads(body)
+        body["commonLabels"]["loadtest_group"] = tag
+        groups.append((tag, channel, json.dumps(body).encode()))
+    return groups
+
+
+def callback_update(update_id: int, tag: str, callback_data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": 1, "is_bot": False, "first_name": "loadtest", "username": "loadtest"},
+            "chat_instance": "loadtest",
+            "data": callback_data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": CHAT_ID, "type": "supergroup", "title": "loadtest"},
+                "text": f"[lt-{tag}-] Node is down",
+            },
+        },
+    }
+
+
+async def press_buttons(webhook_url: str, buttons: dict, presses_per_button: int, concurrency: int) -> list:
+    """Returns (tag, sent_at, status) per press, the presses of a button are made at the same time"""
+    results = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=60) as client:
+        async def press(update_id: int, tag: str, callback_data: str):
+            async with semaphore:
+                sent_at = time.time()
+                response = await client.post(webhook_url, json=callback_update(update_id, tag, callback_data),
+                                             headers={SECRET_TOKEN_HEADER: SECRET})
+                results.append((tag, sent_at, response.status_code))
+
+        presses = [(tag, callback_data) for tag, callback_data in buttons.items()
+                   for _ in range(presses_per_button)]
+        await asyncio.gather(*(press(index, tag, callback_data)
+                               for index, (tag, callback_data) in enumerate(presses)))
+    return results
+
+
+async def wait_for(fakes_url: str, path: str, done, timeout: float):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            result = (await client.get(f"{fakes_url}{path}")).json()
+            if done(result) or time.monotonic() > deadline:
+                return result
+            await asyncio.sleep(0.1)
+
+
+async def main(arguments):
+    workdir = tempfile.mkdtemp(prefix="alertbot-callbacks-")
+    write_configs(workdir)
+    fakes_port, alertbot_port = free_port(), free_port()
+    fakes_url = f"http://127.0.0.1:{fakes_port}"
+    alertbot_url = f"http://127.0.0.1:{alertbot_port}"
+    webhook_url = f"{alertbot_url}/api/v2/telegram/webhook"
+
+    environment = dict(os.environ)
+    environment.update({
+        "PYTHONPATH": os.path.join(ROOT, "src"),
+        "ENVIRONMENT": "PROD",
+        "LOG_LEVEL": "WARNING",
+        "TELEGRAM_MODE": "BOT",
+        "TG_BOT_TOKEN": "123456:loadtest",
+        "TG_API_BASE_URL": fakes_url,
+        "TG_WEBHOOK_URL": webhook_url,
+        "TG_WEBHOOK_SECRET": SECRET,
+        "ALERTMANAGER_URL": fakes_url,
+        "ACTIVE_SMS": "false",
+        "CONFIG_WATCHER_ENABLED": "false",
+        # Measure alertbot itself, not the rate Telegram would allow one group
+        "TG_GLOBAL_RATE_LIMIT": "1000000",
+        "TG_GROUP_RATE_LIMIT_PER_MINUTE": "60000000",
+    })
+
+    log_path = os.path.join(workdir, "alertbot.log")
+    fakes = subprocess.Popen([sys.executable, os.path.join(HERE, "fakes.py"), "--port", str(fakes_port),
+                              "--tg-latency-ms", str(arguments.tg_latency_ms),
+                              "--am-latency-ms", str(arguments.am_latency_ms)])
+    with open(log_path, "w") as log:
+        alertbot = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(alertbot_port), "--log-level", "warning"],
+            cwd=workdir, env=environment, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        await wait_until_up(f"{fakes_url}/stats", fakes)
+        await wait_until_up(f"{alertbot_url}/", alertbot)
+
+        registered = await wait_for(fakes_url, "/webhook", lambda webhook: webhook, timeout=10)
+        print(f"registered webhook: {registered.get('url')}, "
+              f"secret {'ok' if registered.get('secret_token') == SECRET else 'MISSING'}")
+        async with httpx.AsyncClient() as client:
+            refused = await client.post(webhook_url, json=callback_update(0, "0", "alert_confirm"),
+                                        headers={SECRET_TOKEN_HEADER: "wrong"})
+        print(f"update with a wrong secret: {refused.status_code}")
+
+        print(f"Sending {arguments.buttons} alert groups with a silence button (logs in {log_path})")
+        await replay(f"{alertbot_url}/api/v2/alerts/prom/", alert_groups(arguments.buttons),
+                     rate=arguments.buttons, max_in_flight=arguments.concurrency)
+        buttons = await wait_for(fakes_url, "/buttons", lambda buttons: len(buttons) >= arguments.buttons,
+                                 timeout=arguments.drain_timeout)
+
+        print(f"Pressing {len(buttons)} buttons {arguments.presses_per_button} times each")
+        results = await press_buttons(webhook_url, buttons, arguments.presses_per_button, arguments.concurrency)
+        stats = await wait_for(fakes_url, "/stats",
+                               lambda stats: len(stats.get("telegram_edits", {}).get("first_seen", {})) >= len(buttons),
+                               timeout=arguments.drain_timeout)
+
+        edited = stats.get("telegram_edits", {}).get("first_seen", {})
+        statuses = {}
+        for _, _, status in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        latency = summary([edited[tag] - sent_at for tag, sent_at, _ in results if tag in edited])
+        print(f"statuses: {statuses}")
+        print(f"{'':22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        print(f"{'button-press latency':22}{latency['count']:>8}" +
+              "".join(f"{latency[key] * 1000:>10.1f}" for key in ("p50", "p95", "p99", "max")) +
+              f"   ({len(buttons) - len(edited)} of {len(buttons)} messages not edited)")
+        print(f"silences created: {stats.get('alertmanager', {}).get('messages', 0)} for {len(buttons)} buttons, "
+              f"alertmanager requests: {stats.get('alertmanager', {}).get('requests', 0)}")
+    finally:
+        for process in (alertbot, fakes):
+            process.terminate()
+        for process in (alertbot, fakes):
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buttons", type=int, default=100, help="alert groups sent with a silence button")
+    parser.add_argument("--presses-per-button", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=20, help="requests posted at the same time")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for messages and edits")
+    parser.add_argument("--tg-latency-ms", dest="tg_latency_ms", type=float, default=50)
+    parser.add_argument("--am-latency-ms", dest="am_latency_ms", type=float, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,250 @@
+"""
+Local stand-ins for the services alertbot talks to, used by the load test.
+
+- Telegram Bot API: POST /bot{token}/sendMessage, and for the silence button setWebhook,
+  answerCallbackQuery and editMessageText
+- Kavenegar: POST /v1/{api_key}/sms/send.json and sms/sendarray.json
+- Phone sync: GET /api/numbers
+- Alertmanager: POST and GET /api/v2/silences
+
+Every upstream has a latency and an error rate, Telegram can also answer 429 with a
+retry_after. Messages carrying a load test tag ("lt-<number>-") are recorded with the
+time they arrived, GET /stats returns them so the load test can compute delivery lag.
+
+Usage (from the repository root):
+    python benchmarks/loadtest/fakes.py --port 9100 [--tg-latency-ms 50] [--tg-429-rate 0.05] ...
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from urllib.parse import parse_qs
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+import uvicorn
+
+TAG = re.compile(r"lt-(\d+)-")
+
+settings = {
+    "tg_latency_ms": 50.0,
+    "tg_error_rate": 0.0,
+    "tg_429_rate": 0.0,
+    "tg_retry_after": 1,
+    "sms_latency_ms": 100.0,
+    "sms_error_rate": 0.0,
+    "phone_latency_ms": 20.0,
+    "phone_numbers": 3,
+    "am_latency_ms": 20.0,
+}
+
+app = FastAPI(title="Alertbot load test fakes")
+
+# The last setWebhook call, GET /webhook returns it
+webhook = {}
+# Load test tag -> callback data of the button of its message, GET /buttons returns them
+buttons = {}
+# Silences created in the fake Alertmanager
+silences = []
+# channel -> {"requests": int, "errors": int, "throttled": int, "first_seen": {tag: unix time}, "messages": int}
+stats = {}
+message_ids = itertools.count(1)
+
+
+def _channel_stats(channel: str) -> dict:
+    return stats.setdefault(channel, {"requests": 0, "errors": 0, "throttled": 0,
+                                      "messages": 0, "first_seen": {}})
+
+
+async def _latency(milliseconds: float):
+    if milliseconds > 0:
+        await asyncio.sleep(milliseconds * random.uniform(0.5, 1.5) / 1000)
+
+
+async def _parameters(request: Request) -> dict:
+    """Telegram and Kavenegar accept both form encoded and JSON bodies"""
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body or b"{}")
+    return {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+
+
+def _record(channel: str, text: str):
+    entry = _channel_stats(channel)
+    entry["messages"] += 1
+    now = time.time()
+    for tag in set(TAG.findall(text or "")):
+        entry["first_seen"].setdefault(tag, now)
+
+
+@app.post("/bot{token}/sendMessage")
+async def telegram_send_message(token: str, request: Request):
+    entry = _channel_stats("telegram")
+    entry["requests"] += 1
+    parameters = await _parameters(request)
+    await _latency(settings["tg_latency_ms"])
+    roll = random.random()
+    if roll < settings["tg_429_rate"]:
+        entry["throttled"] += 1
+        retry_after = settings["tg_retry_after"]
+        return JSONResponse(status_code=429, content={
+            "ok": False, "error_code": 429,
+            "description": f"Too Many Requests: retry after {retry_after}",
+            "parameters": {"retry_after": retry_after}})
+    if roll < settings["tg_429_rate"] + settings["tg_error_rate"]:
+        entry["errors"] += 1
+        return JSONResponse(status_code=500, content={
+            "ok": False, "error_code": 500, "description": "Internal Server Error"})
+
+    _record("telegram", parameters.get("text", ""))
+    _record_buttons(parameters)
+    return {"ok": True, "result": _telegram_message({**parameters, "message_id": 0})}
+
+
+def _telegram_message(parameters: dict) -> dict:
+    return {"message_id": int(parameters.get("message_id", 0) or 0) or next(message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(parameters.get("chat_id", 0) or 0), "type": "supergroup", "title": "loadtest"},
+            "text": parameters.get("text", "")}
+
+
+def _record_buttons(parameters: dict):
+    markup = parameters.get("reply_markup")
+    if not markup:
+        return
+    markup = json.loads(markup) if isinstance(markup, str) else markup
+    for row in markup.get("inline_keyboard", []):
+        for button in row:
+            for tag in set(TAG.findall(parameters.get("text", ""))):
+                buttons[tag] = button.get("callback_data")
+
+
+@app.post("/bot{token}/setWebhook")
+async def telegram_set_webhook(token: str, request: Request):
+    webhook.clear()
+    webhook.update(await _parameters(request))
+    return {"ok": True, "result": True, "description": "Webhook was set"}
+
+
+@app.post("/bot{token}/answerCallbackQuery")
+async def telegram_answer_callback_query(token: str, request: Request):
+    _channel_stats("telegram_callbacks")["requests"] += 1
+    await _parameters(request)
+    await _latency(settings["tg_latency_ms"])
+    return {"ok": True, "result": True}
+
+
+@app.post("/bot{token}/editMessageText")
+async def telegram_edit_message_text(token: str, request: Request):
+    _channel_stats("telegram_edits")["requests"] += 1
+    parameters = await _parameters(request)
+    await _latency(settings["tg_latency_ms"])
+    _record("telegram_edits", parameters.get("text", ""))
+    return {"ok": True, "result": _telegram_message(parameters)}
+
+
+async def _kavenegar(request: Request, messages: list, receptors: list) -> dict:
+    entry = _channel_stats("sms")
+    entry["requests"] += 1
+    await _latency(settings["sms_latency_ms"])
+    if random.random() < settings["sms_error_rate"]:
+        entry["errors"] += 1
+        return {"return": {"status": 500, "message": "Internal Server Error"}, "entries": None}
+    for message in messages:
+        _record("sms", message)
+    return {"return": {"status": 200, "message": "تایید شد"}, "entries": [
+        {"messageid": next(message_ids), "message": messages[0] if messages else "",
+         "status": 5, "statustext": "ارسال به مخابرات", "sender": "10004346",
+         "receptor": receptor, "date": int(time.time()), "cost": 120}
+        for receptor in receptors]}
+
+
+@app.post("/v1/{api_key}/sms/send.json")
+async def kavenegar_send(api_key: str, request: Request):
+    parameters = await _parameters(request)
+    receptors = [receptor for receptor in str(parameters.get("receptor", "")).split(",") if receptor]
+    return await _kavenegar(request, [parameters.get("message", "")], receptors)
+
+
+@app.post("/v1/{api_key}/sms/sendarray.json")
+async def kavenegar_send_array(api_key: str, request: Request):
+    parameters = await _parameters(request)
+    messages = parameters.get("message", "[]")
+    receptors = parameters.get("receptor", "[]")
+    messages = json.loads(messages) if isinstance(messages, str) else messages
+    receptors = json.loads(receptors) if isinstance(receptors, str) else receptors
+    return await _kavenegar(request, messages, receptors)
+
+
+@app.get("/api/numbers")
+async def phone_numbers(request: Request):
+    entry = _channel_stats("phone_sync")
+    entry["requests"] += 1
+    receivers = (await _parameters(request)).get("receivers", [])
+    await _latency(settings["phone_latency_ms"])
+    return {
+        receiver: ",".join(f"0912{index:03d}{sum(map(ord, receiver)) % 10000:04d}"
+                           for index in range(settings["phone_numbers"]))
+        for receiver in receivers
+    }
+
+
+@app.post("/api/v2/silences")
+async def alertmanager_create_silence(request: Request):
+    entry = _channel_stats("alertmanager")
+    entry["requests"] += 1
+    silence = await request.json()
+    await _latency(settings["am_latency_ms"])
+    silence["id"] = f"silence-{next(message_ids)}"
+    silence["status"] = {"state": "active"}
+    silences.append(silence)
+    entry["messages"] += 1
+    return {"silenceID": silence["id"]}
+
+
+@app.get("/api/v2/silences")
+async def alertmanager_get_silences():
+    _channel_stats("alertmanager")["requests"] += 1
+    await _latency(settings["am_latency_ms"])
+    return silences
+
+
+@app.get("/buttons")
+async def get_buttons():
+    return buttons
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+@app.get("/webhook")
+async def get_webhook():
+    return webhook
+
+
+@app.post("/reset")
+async def reset():
+    stats.clear()
+    buttons.clear()
+    silences.clear()
+    return {"ok": True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for name, value in settings.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(value), default=value)
+    arguments = parser.parse_args()
+    for name in settings:
+        settings[name] = getattr(arguments, name)
+    uvicorn.run(app, host=arguments.host, port=arguments.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+End-to-end load test: replays prometheus webhooks against alertbot at a target rate,
+with the fakes in fakes.py standing in for Telegram, Kavenegar and the phone sync API.
+
+Alertbot runs as `uvicorn main:app` in a subprocess with a generated config that routes
+"loadtest-telegram" to a telegram group and "loadtest-sms" to an SMS group. Alert groups
+are built from samples/prometheus-alert-firing.json and prometheus-alert-resolved.json,
+each one tagged so the fakes can tell when it was delivered.
+
+Usage (from the repository root):
+    python benchmarks/loadtest/run.py [--rate 50] [--duration 30] [--sms-share 0.2] \\
+        [--alerts-per-group 1] [--tg-latency-ms 50] [--tg-429-rate 0] [--sms-error-rate 0] \\
+        [--env ASYNC_DELIVERY=false] [--json results.json]
+
+Reports the accepted throughput, p50/p95/p99 webhook latency and, per channel, the delay
+between sending a webhook and the first message of it reaching the fake (delivery lag).
+Everything runs on 127.0.0.1, no network access is needed.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(HERE))
+SAMPLES = os.path.join(ROOT, "samples")
+
+TELEGRAM_RECEIVER = "loadtest-telegram"
+SMS_RECEIVER = "loadtest-sms"
+SMS_GROUP = "loadtest-oncall"
+
+FAKE_OPTIONS = ["tg_latency_ms", "tg_error_rate", "tg_429_rate", "tg_retry_after",
+                "sms_latency_ms", "sms_error_rate", "phone_latency_ms", "phone_numbers"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile, NaN for no values"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def summary(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else float("nan"),
+    }
+
+
+def write_configs(directory: str):
+    configs = os.path.join(directory, "configs")
+    os.makedirs(configs, exist_ok=True)
+    with open(os.path.join(configs, "alertbot-config.json"), "w") as file:
+        json.dump({"destinations": [
+            {"receiver": TELEGRAM_RECEIVER, "severity": "warning",
+             "types": [{"type": "telegram", "telegram_group_id": "-100200300"}]},
+            {"receiver": SMS_RECEIVER, "severity": "critical",
+             "types": [{"type": "sms", "keycloak_group_name": SMS_GROUP, "sender": "10004346"}]},
+        ]}, file)
+    with open(os.path.join(configs, "alertbot-splunk-config.json"), "w") as file:
+        json.dump({"destinations": []}, file)
+
+
+def build_alert_groups(count: int, alerts_per_group: int, sms_share: float, seed: int, first: int = 0) -> list:
+    """
+    Returns (tag, channel, body) tuples numbered from `first`. Firing and resolved notifications
+    alternate, every group has its own labels and fingerprints so none of them is a duplicate.
+    """
+    with open(os.path.join(SAMPLES, "prometheus-alert-firing.json")) as file:
+        firing = json.load(file)
+    with open(os.path.join(SAMPLES, "prometheus-alert-resolved.json")) as file:
+        resolved = json.load(file)
+
+    randomizer = random.Random(seed)
+    groups = []
+    for index in range(first, first + count):
+        channel = "sms" if randomizer.random() < sms_share else "telegram"
+        receiver, severity = (SMS_RECEIVER, "critical") if channel == "sms" else (TELEGRAM_RECEIVER, "warning")
+        body = copy.deepcopy(firing if index % 2 == 0 else resolved)
+        tag = f"lt-{index}-"
+        sample_alerts = body["alerts"]
+        alerts = []
+        for number in range(alerts_per_group):
+            alert = copy.deepcopy(sample_alerts[number % len(sample_alerts)])
+            alert["labels"]["severity"] = severity
+            alert["labels"]["instance"] = f"{tag}{number}"
+            alert["annotations"]["description"] = f"[{tag}] {alert['annotations'].get('description', '')}"
+            alert["fingerprint"] = f"{index:010x}{number:06x}"
+            alerts.append(alert)
+        body["alerts"] = alerts
+        body["receiver"] = receiver
+        body["commonLabels"]["severity"] = severity
+        body["commonAnnotations"]["summary"] = f"[{tag}] {body['commonAnnotations'].get('summary', '')}"
+        body["groupKey"] = f"{{}}:{{alertname=\"loadtest\", group=\"{tag}\"}}"
+        groups.append((str(index), channel, json.dumps(body).encode()))
+    return groups
+
+
+async def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                await client.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up in {timeout} seconds")
+
+
+async def replay(url: str, groups: list, rate: float, max_in_flight: int) -> list:
+    """Open-loop replay: webhooks are sent on schedule even when earlier ones are still pending"""
+    results = []
+    in_flight = asyncio.Semaphore(max_in_flight)
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def send(tag: str, channel: str, body: bytes):
+            async with in_flight:
+                sent_at = time.time()
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, content=body, headers={"Content-Type": "application/json"})
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                results.append({"tag": tag, "channel": channel, "sent_at": sent_at,
+                                "latency": time.perf_counter() - start, "status": status})
+
+        tasks = []
+        start = time.perf_counter()
+        for index, (tag, channel, body) in enumerate(groups):
+            delay = start + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(tag, channel, body)))
+        await asyncio.gather(*tasks)
+    return results
+
+
+async def wait_for_deliveries(fakes_url: str, expected: dict, timeout: float) -> dict:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            stats = (await client.get(f"{fakes_url}/stats")).json()
+            done = all(
+                expected_tags <= set(stats.get(channel, {}).get("first_seen", {}))
+                for channel, expected_tags in expected.items())
+            if done or time.monotonic() > deadline:
+                return stats
+            await asyncio.sleep(0.25)
+
+
+def report(arguments, results: list, stats: dict, elapsed: float) -> dict:
+    statuses = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    accepted = [result for result in results if result["status"] == 204]
+
+    lags = {}
+    for channel in ("telegram", "sms"):
+        first_seen = stats.get(channel, {}).get("first_seen", {})
+        sent = [result for result in accepted if result["channel"] == channel]
+        values = [first_seen[result["tag"]] - result["sent_at"] for result in sent if result["tag"] in first_seen]
+        lags[channel] = dict(summary(values), accepted=len(sent))
+
+    latencies = [result["latency"] for result in results]
+    output = {
+        "target_rate": arguments.rate,
+        "sent": len(results),
+        "elapsed_seconds": elapsed,
+        "achieved_rate": len(results) / elapsed if elapsed else 0,
+        "accepted_rate": len(accepted) / elapsed if elapsed else 0,
+        "statuses": statuses,
+        "webhook_latency_seconds": summary(latencies),
+        "delivery_lag_seconds": lags,
+        "upstreams": {channel: {key: value for key, value in entry.items() if key != "first_seen"}
+                      for channel, entry in stats.items()},
+    }
+
+    print(f"\nwebhooks: {len(results)} sent in {elapsed:.1f}s, target {arguments.rate:.1f}/s, "
+          f"achieved {output['achieved_rate']:.1f}/s, accepted {output['accepted_rate']:.1f}/s")
+    print(f"statuses: {statuses}")
+    latency = output["webhook_latency_seconds"]
+    print(f"{'':22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    print(f"{'webhook latency':22}{latency['count']:>8}" +
+          "".join(f"{latency[key] * 1000:>10.1f}" for key in ("p50", "p95", "p99", "max")))
+    for channel, lag in lags.items():
+        if not lag["accepted"]:
+            continue
+        print(f"{channel + ' delivery lag':22}{lag['count']:>8}" +
+              "".join(f"{lag[key] * 1000:>10.1f}" for key in ("p50", "p95", "p99", "max")) +
+              f"   ({lag['accepted'] - lag['count']} of {lag['accepted']} not delivered)")
+    for channel, entry in output["upstreams"].items():
+        print(f"{channel}: {entry}")
+    return output
+
+
+async def main(arguments):
+    workdir = tempfile.mkdtemp(prefix="alertbot-loadtest-")
+    write_configs(workdir)
+    fakes_port, alertbot_port = free_port(), free_port()
+    fakes_url = f"http://127.0.0.1:{fakes_port}"
+    alertbot_url = f"http://127.0.0.1:{alertbot_port}"
+
+    fake_command = [sys.executable, os.path.join(HERE, "fakes.py"), "--port", str(fakes_port)]
+    for option in FAKE_OPTIONS:
+        fake_command += ["--" + option.replace("_", "-"), str(getattr(arguments, option))]
+
+    environment = dict(os.environ)
+    environment.update({
+        "PYTHONPATH": os.path.join(ROOT, "src"),
+        "ENVIRONMENT": "PROD",
+        "LOG_LEVEL": "WARNING",
+        "TELEGRAM_MODE": "API",
+        "TG_BOT_TOKEN": "123456:loadtest",
+        "TG_API_BASE_URL": fakes_url,
+        "TG_SEND_RETRY_DELAY": "1",
+        "KAVENEGAR_API_KEY": "loadtest",
+        "KAVENEGAR_API_URL": fakes_url,
+        "PHONE_SYNC_API_URL": fakes_url,
+        "CONFIG_WATCHER_ENABLED": "false",
+    })
+    if not arguments.telegram_limits:
+        # Measure alertbot itself, not the rate Telegram would allow one group
+        environment.update({"TG_GLOBAL_RATE_LIMIT": "1000000",
+                            "TG_GROUP_RATE_LIMIT_PER_MINUTE": "60000000",
+                            "TG_PRIVATE_RATE_LIMIT": "1000000"})
+    for assignment in arguments.env:
+        key, _, value = assignment.partition("=")
+        environment[key] = value
+
+    log_path = os.path.join(workdir, "alertbot.log")
+    fakes = subprocess.Popen(fake_command)
+    with open(log_path, "w") as log:
+        alertbot = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(alertbot_port), "--log-level", "warning"],
+            cwd=workdir, env=environment, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        await wait_until_up(f"{fakes_url}/stats", fakes)
+        await wait_until_up(f"{alertbot_url}/", alertbot)
+
+        count = max(1, int(arguments.rate * arguments.duration))
+        # Warmup groups are numbered after the measured ones, so deduplication doesn't drop either
+        groups = build_alert_groups(count, arguments.alerts_per_group, arguments.sms_share, arguments.seed)
+        if arguments.warmup:
+            await replay(f"{alertbot_url}/api/v2/alerts/prom/",
+                         build_alert_groups(arguments.warmup, 1, arguments.sms_share, arguments.seed, first=count),
+                         rate=arguments.warmup, max_in_flight=arguments.max_in_flight)
+            await asyncio.sleep(1)
+            async with httpx.AsyncClient() as client:
+                await client.post(f"{fakes_url}/reset")
+
+        print(f"Replaying {count} alert groups at {arguments.rate}/s against {alertbot_url} (logs in {log_path})")
+        start = time.perf_counter()
+        results = await replay(f"{alertbot_url}/api/v2/alerts/prom/", groups,
+                               rate=arguments.rate, max_in_flight=arguments.max_in_flight)
+        elapsed = time.perf_counter() - start
+
+        expected = {}
+        for result in results:
+            if result["status"] == 204:
+                expected.setdefault(result["channel"], set()).add(result["tag"])
+        stats = await wait_for_deliveries(fakes_url, expected, arguments.drain_timeout)
+        output = report(arguments, results, stats, elapsed)
+        if arguments.json:
+            with open(arguments.json, "w") as file:
+                json.dump(output, file, indent=2)
+    finally:
+        for process in (alertbot, fakes):
+            process.terminate()
+        for process in (alertbot, fakes):
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50, help="webhooks per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--alerts-per-group", type=int, default=1)
+    parser.add_argument("--sms-share", type=float, default=0.2, help="fraction of groups routed to SMS")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="concurrent webhooks at most")
+    parser.add_argument("--warmup", type=int, default=20, help="webhooks sent before measuring")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="seconds to wait for deliveries")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="keep alertbot's Telegram rate limits instead of lifting them")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for alertbot, can be repeated")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--tg-latency-ms", dest="tg_latency_ms", type=float, default=50)
+    parser.add_argument("--tg-error-rate", dest="tg_error_rate", type=float, default=0.0)
+    parser.add_argument("--tg-429-rate", dest="tg_429_rate", type=float, default=0.0)
+    parser.add_argument("--tg-retry-after", dest="tg_retry_after", type=int, default=1)
+    parser.add_argument("--sms-latency-ms", dest="sms_latency_ms", type=float, default=100)
+    parser.add_argument("--sms-error-rate", dest="sms_error_rate", type=float, default=0.0)
+    parser.add_argument("--phone-latency-ms", dest="phone_latency_ms", type=float, default=20)
+    parser.add_argument("--phone-numbers", dest="phone_numbers", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
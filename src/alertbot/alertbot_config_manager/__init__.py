@@ -1 +1,5 @@
-from alertbot.alertbot_config_manager.alertbot_config_manager import ConfigManager
\ No newline at end of file
+from alertbot.alertbot_config_manager.alertbot_config_manager import ConfigManager
+from alertbot.alertbot_config_manager.routing_index import RoutingIndex
+from alertbot.alertbot_config_manager.config_snapshot import ConfigSnapshot
+from alertbot.alertbot_config_manager.config_watcher import ConfigWatcher
+from alertbot.alertbot_config_manager.shared_snapshot import SharedSnapshot
@@ -1,39 +1,118 @@
 from alertbot.env import CONFIG_JSON_FILE, CONFIG_SPLUNK_JSON_FILE
 from alertbot.constants import CONFIG_DESTINATIONS_KEYWORD, \
-    TELEGRAM_CONFIG_WORD
+    TELEGRAM_CONFIG_WORD, TELEGRAM_MAX_BATCH_WINDOW_MS
 from .exceptions import BadJsonConfigFile, \
-    KeyWordNotFound
+    KeyWordNotFound, BadConfigValue
+from .routing_index import RoutingIndex
+from .config_snapshot import ConfigSnapshot
+from collections import namedtuple
+import hashlib
 import json
 import logging
+import os
+
+# `stat` is (mtime_ns, size, inode) and is compared first, the content hash is only
+# computed when it changes. Inode catches kubernetes ConfigMap symlink swaps.
+FileFingerprint = namedtuple("FileFingerprint", ["stat", "digest"])
 
 class ConfigManager:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.alertbot_config = None
         self.alertbot_splunk_config = {}
+        self.routing_index = RoutingIndex()
+        self.fingerprints = {}
+        self.snapshot = None
     
-    def read_alertbot_configs(self):
-        with open(CONFIG_JSON_FILE, 'r') as file:
-            try:
-                self.alertbot_config = json.load(file)
-                self.logger.info(f"Successfully parsed {CONFIG_JSON_FILE}")
-            except json.JSONDecodeError as json_err:
-                self.logger.error(f"Error decoding {CONFIG_JSON_FILE}, error: {json_err}")
-                raise BadJsonConfigFile(f"Error at reading json config file {json_err}")  
-            else:
-                self.validate_alertbot_configs() # we validate the main configs that are for prometheus
+    def read_alertbot_configs(self, raw: bytes = None):
+        if raw is None:
+            raw = self._read_file(CONFIG_JSON_FILE)
+        try:
+            config = json.loads(raw)
+            self.logger.info(f"Successfully parsed {CONFIG_JSON_FILE}")
+        except json.JSONDecodeError as json_err:
+            self.logger.error(f"Error decoding {CONFIG_JSON_FILE}, error: {json_err}")
+            raise BadJsonConfigFile(f"Error at reading json config file {json_err}")  
+        # we validate the main configs that are for prometheus, a bad reload keeps the previous ones
+        self.validate_alertbot_configs(config)
+        routing_index = RoutingIndex(config[CONFIG_DESTINATIONS_KEYWORD])
+        self.alertbot_config = config
+        self.routing_index = routing_index
                 
-    def read_alertbot_splunk_configs(self):
-        with open(CONFIG_SPLUNK_JSON_FILE, 'r') as file:
-            try:
-                self.alertbot_splunk_config = json.load(file)
-                self.logger.info(f"Successfully parsed {CONFIG_SPLUNK_JSON_FILE}")
-            except json.JSONDecodeError as json_err:
-                self.logger.error(f"Error decoding {CONFIG_SPLUNK_JSON_FILE}, error: {json_err}")
-                self.logger.error(f"No splunk config were added.") # No validation for splunk configs
+    def read_alertbot_splunk_configs(self, raw: bytes = None):
+        if raw is None:
+            raw = self._read_file(CONFIG_SPLUNK_JSON_FILE)
+        try:
+            self.alertbot_splunk_config = json.loads(raw)
+            self.logger.info(f"Successfully parsed {CONFIG_SPLUNK_JSON_FILE}")
+        except json.JSONDecodeError as json_err:
+            self.logger.error(f"Error decoding {CONFIG_SPLUNK_JSON_FILE}, error: {json_err}")
+            self.logger.error(f"No splunk config were added.") # No validation for splunk configs
+
+    def reload_if_changed(self) -> bool:
+        """
+        Re-read the config files only if their mtime, size or inode changed and their
+        content hash differs from the last successful load.
+
+        Returns:
+            bool: True if a new snapshot was built, False if nothing changed.
+        Raises:
+            BadJsonConfigFile, KeyWordNotFound: If the changed main config is invalid.
+                The previous snapshot is kept and the file is checked again next time.
+        """
+        main_change = self._detect_change(CONFIG_JSON_FILE)
+        splunk_change = self._detect_change(CONFIG_SPLUNK_JSON_FILE)
+        if self.snapshot is not None and main_change is None and splunk_change is None:
+            return False
+
+        if main_change is not None or self.alertbot_config is None:
+            self.read_alertbot_configs(main_change[0] if main_change else None)
+        if splunk_change is not None or self.snapshot is None:
+            self.read_alertbot_splunk_configs(splunk_change[0] if splunk_change else None)
+
+        # Only remember the new fingerprints once the files were loaded successfully
+        for path, change in ((CONFIG_JSON_FILE, main_change), (CONFIG_SPLUNK_JSON_FILE, splunk_change)):
+            if change is not None:
+                self.fingerprints[path] = change[1]
+
+        version = hashlib.sha256("".join(
+            self.fingerprints[path].digest if path in self.fingerprints else ""
+            for path in (CONFIG_JSON_FILE, CONFIG_SPLUNK_JSON_FILE)
+        ).encode()).hexdigest()[:12]
+        self.snapshot = ConfigSnapshot(
+            configs=self.alertbot_config,
+            splunk_configs=self.alertbot_splunk_config,
+            routing_index=self.routing_index,
+            version=version
+        )
+        return True
 
-    def validate_alertbot_configs(self):
-        destinations = self.alertbot_config.get(CONFIG_DESTINATIONS_KEYWORD, None)
+    def _detect_change(self, path: str):
+        """Returns (raw content, FileFingerprint) if the file changed since the last load, otherwise None"""
+        st = os.stat(path)
+        stat = (st.st_mtime_ns, st.st_size, st.st_ino)
+        previous = self.fingerprints.get(path)
+        if previous is not None and previous.stat == stat:
+            return None
+
+        raw = self._read_file(path)
+        digest = hashlib.sha256(raw).hexdigest()
+        if previous is not None and previous.digest == digest:
+            # Touched or re-linked with the same content, skip parsing it next time too
+            self.fingerprints[path] = FileFingerprint(stat, digest)
+            return None
+        return raw, FileFingerprint(stat, digest)
+
+    def _read_file(self, path: str) -> bytes:
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def validate_alertbot_configs(self, config: dict = None):
+        if config is None:
+            config = self.alertbot_config
+        if not isinstance(config, dict):
+            raise BadJsonConfigFile(f"{CONFIG_JSON_FILE} must hold a json object!")
+        destinations = config.get(CONFIG_DESTINATIONS_KEYWORD, None)
         if destinations == None:
             raise KeyWordNotFound(f"{CONFIG_DESTINATIONS_KEYWORD} not found in json config!")
         for index,dest in enumerate(destinations):
@@ -56,9 +135,20 @@ class ConfigManager:
     def validate_telegram_type(self, type: dict):
         if type.get("telegram_group_id") == None:
             raise KeyWordNotFound(f"telegram_group_id not found for type telegram in alertbot config!")
+        batch_window_ms = type.get("batch_window_ms", 0)
+        if not isinstance(batch_window_ms, int) or isinstance(batch_window_ms, bool) or \
+           not 0 <= batch_window_ms <= TELEGRAM_MAX_BATCH_WINDOW_MS:
+            raise BadConfigValue(f"batch_window_ms of telegram group {type.get('telegram_group_id')} " +
+                                 f"must be an integer between 0 and {TELEGRAM_MAX_BATCH_WINDOW_MS}!")
 
     def get_alertbot_config(self):
         return self.alertbot_config
 
     def get_alertbot_splunk_config(self):
-        return self.alertbot_splunk_config
\ No newline at end of file
+        return self.alertbot_splunk_config
+
+    def get_routing_index(self):
+        return self.routing_index
+
+    def get_snapshot(self) -> ConfigSnapshot:
+        return self.snapshot
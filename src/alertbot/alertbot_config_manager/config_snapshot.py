@@ -0,0 +1,14 @@
+from dataclasses import dataclass, field
+from .routing_index import RoutingIndex
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    Everything that is read from the config files, swapped into `alertbot.globals` as one object
+    so a request never mixes the prometheus and splunk configs of two different reloads.
+    """
+    configs: dict = field(default_factory=dict)
+    splunk_configs: dict = field(default_factory=dict)
+    routing_index: RoutingIndex = field(default_factory=RoutingIndex)
+    version: str = ""
@@ -0,0 +1,128 @@
+from typing import Callable, List
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class ConfigWatcher:
+    """
+    Calls `callback` a few milliseconds after anything changes in the directories of the given files.
+
+    Directories are watched instead of the files themselves, so editors that replace files
+    and kubernetes ConfigMap updates (which swap the `..data` symlink) are both noticed.
+    The callback is expected to find out by itself whether the content really changed.
+    """
+
+    def __init__(self, paths: List[str], callback: Callable[[], None], debounce_ms: int = 20):
+        self.logger = logging.getLogger(__name__)
+        self.directories = sorted({os.path.dirname(os.path.abspath(path)) for path in paths})
+        self.callback = callback
+        self.debounce = debounce_ms / 1000
+        self._fd = None
+        self._watches = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> bool:
+        """
+        Returns:
+            bool: False if inotify is not available on this platform.
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self._libc = libc
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            self.logger.warning(f"inotify is not available, config watcher is disabled: {e}")
+            return False
+        if fd < 0:
+            self.logger.warning(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+            return False
+        self._fd = fd
+        for directory in self.directories:
+            self._add_watch(directory)
+
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Watching {self.directories} for config changes")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _add_watch(self, directory: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            self.logger.error(f"Can not watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return
+        self._watches[wd] = directory
+
+    def _drain(self) -> bool:
+        """Read every pending event, returns True if there was at least one"""
+        seen = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return seen
+            if not data:
+                return seen
+            seen = True
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size + name_length
+                if mask & IN_IGNORED and wd in self._watches:
+                    # The directory itself went away, watch it again once it is back
+                    self._watches.pop(wd)
+
+    def _run(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 1.0)
+            if not readable:
+                self._rewatch_missing()
+                continue
+            self._drain()
+            # Coalesce the burst of events a single save or symlink swap produces
+            deadline = time.monotonic() + self.debounce
+            while (remaining := deadline - time.monotonic()) > 0:
+                if select.select([self._fd], [], [], remaining)[0]:
+                    self._drain()
+            self._rewatch_missing()
+            try:
+                self.callback()
+            except Exception as e:
+                self.logger.error(f"Config reload triggered by watcher failed: {e}")
+
+    def _rewatch_missing(self):
+        for directory in self.directories:
+            if directory not in self._watches.values() and os.path.isdir(directory):
+                self._add_watch(directory)
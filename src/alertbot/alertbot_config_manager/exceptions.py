@@ -12,3 +12,10 @@ class KeyWordNotFound(CustomError):
         logger.error(message)
         self.message = message
         super().__init__(self.message)
+
+class BadConfigValue(CustomError):
+    def __init__(self, message):
+        logger = logging.getLogger(__name__)
+        logger.error(message)
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,59 @@
+from types import MappingProxyType
+from typing import Optional
+
+
+class RoutingIndex:
+    """
+    Immutable lookup table from (receiver, severity) to a destination of the alertbot config.
+
+    It gives the same answer as scanning `destinations` in order and returning the first
+    entry whose lowercased receiver equals the alert receiver and whose severity is a
+    substring of the alert severity, without walking the whole list on every alert.
+    """
+    __slots__ = ("_receivers",)
+
+    def __init__(self, destinations: list = ()):
+        receivers = {}
+        for dest in destinations:
+            receivers.setdefault(dest["receiver"].lower(), []).append(dest)
+
+        index = {}
+        for receiver, dests in receivers.items():
+            ordered = tuple((dest["severity"], dest) for dest in dests)
+            by_severity = {}
+            for severity, _ in ordered:
+                if severity not in by_severity:
+                    # An alert with exactly this severity matches the first entry whose
+                    # severity is a substring of it, which is not always this entry.
+                    by_severity[severity] = next(dest for sev, dest in ordered if sev in severity)
+            index[receiver] = (MappingProxyType(by_severity), ordered)
+        self._receivers = MappingProxyType(index)
+
+    def lookup(self, receiver: str, severity: str) -> Optional[dict]:
+        """
+        Args:
+            receiver (str): Receiver of the alert group, compared as is.
+            severity (str): Lowercased severity label of the alert.
+        Returns:
+            dict: The matching destination, or None.
+        """
+        entry = self._receivers.get(receiver)
+        if entry is None:
+            return None
+        by_severity, ordered = entry
+        dest = by_severity.get(severity)
+        if dest is not None:
+            return dest
+        # Alert severities that are not configured as is, e.g. "critical-db" for "critical"
+        for sev, dest in ordered:
+            if sev in severity:
+                return dest
+        return None
+
+    def targets(self, receiver: str, severity: str) -> tuple:
+        """Returns the destination types configured for the receiver and severity"""
+        dest = self.lookup(receiver, severity)
+        return tuple(dest["types"]) if dest is not None else ()
+
+    def __len__(self):
+        return len(self._receivers)
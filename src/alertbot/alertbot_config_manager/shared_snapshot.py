@@ -0,0 +1,55 @@
+from typing import Optional
+from alertbot.constants import CONFIG_DESTINATIONS_KEYWORD
+from .config_snapshot import ConfigSnapshot
+from .routing_index import RoutingIndex
+import json
+import logging
+import os
+
+class SharedSnapshot:
+    """
+    A config snapshot published in a file by the leader worker. The other workers load it
+    instead of reading the config files on their own schedule, so all of them route with
+    the same version.
+    """
+
+    def __init__(self, path: str):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self._stat = None
+
+    def write(self, snapshot: ConfigSnapshot):
+        """Replace the file atomically, readers never see half of it"""
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump({
+                "version": snapshot.version,
+                "configs": snapshot.configs,
+                "splunk_configs": snapshot.splunk_configs
+            }, file)
+        os.replace(temporary, self.path)
+        self.logger.info(f"Shared config version {snapshot.version} with the other workers")
+
+    def read_if_changed(self) -> Optional[ConfigSnapshot]:
+        """
+        Returns:
+            ConfigSnapshot: The published snapshot if the file changed since the last call,
+                otherwise (or if there is none yet) None.
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        stat = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if stat == self._stat:
+            return None
+        with open(self.path) as file:
+            data = json.load(file)
+        self._stat = stat
+        configs = data["configs"]
+        return ConfigSnapshot(
+            configs=configs,
+            splunk_configs=data["splunk_configs"],
+            routing_index=RoutingIndex(configs.get(CONFIG_DESTINATIONS_KEYWORD, [])),
+            version=data["version"]
+        )
@@ -12,5 +12,9 @@ CONFIGS_DIRECTORY = "configs/"
 CONFIG_DESTINATIONS_KEYWORD = "destinations"
 TELEGRAM_CONFIG_WORD = "telegram"
 TELEGRAM_MAX_MESSAGE_LENGTH = 4000
+TELEGRAM_MAX_BATCH_WINDOW_MS = 10000
 SMS_CONFIG_WORD = "sms" 
-SMS_LIMIT_ERROR_MESSAGE = "There are ##NUMBER## more messages related to alertname ##ALERTNAME## skipped for your convenience."
\ No newline at end of file
+SMS_LIMIT_ERROR_MESSAGE = "There are ##NUMBER## more messages related to alertname ##ALERTNAME## skipped for your convenience."
+
+PROMETHEUS_SOURCE = "prometheus"
+SPLUNK_SOURCE = "splunk"
@@ -0,0 +1,2 @@
+from alertbot.delivery.delivery_queue import DeliveryQueue, DeliveryJob, deliver, deliver_all
+from alertbot.delivery.outbox import Outbox
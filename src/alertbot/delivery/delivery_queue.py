@@ -0,0 +1,320 @@
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+from alertbot.constants import TELEGRAM_CONFIG_WORD, SMS_CONFIG_WORD, \
+    PROMETHEUS_SOURCE, SPLUNK_SOURCE
+from alertbot.prometheus_endpoint.prom_telegram_functions import generate_send_telegram_alert
+from alertbot.prometheus_endpoint.prom_sms_functions import generate_send_sms_alert
+from alertbot.prometheus_endpoint.prom_dedup import forget
+from alertbot.splunk_endpoint.splunk_functions import (
+    generate_telegram_splunk_body,
+    generate_sms_splunk_body,
+    send_telegram_splunk_message,
+    send_sms_splunk_message
+)
+from alertbot.env import DEFAULT_SENDER, FANOUT_CONCURRENCY
+from alertbot.schemas import AlertRequestPrometheus
+from utils.metrics import (
+    alertbot_delivery_queue_depth,
+    alertbot_delivery_queue_wait_seconds,
+    alertbot_delivery_workers,
+    alertbot_delivery_workers_busy,
+    alertbot_delivery_jobs_counter,
+    alertbot_delivery_rejected_counter,
+    alertbot_outbox_replayed_counter
+)
+from utils.pipeline_timing import set_pipeline_labels, reset_pipeline_labels
+from .exceptions import DeliveryQueueFull, DeliveryQueueNotStarted, DeliveryFailed
+from .outbox import Outbox
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeliveryJob:
+    """
+    A single rendering and sending task for one target of a destination.
+
+    Args:
+        source (str): Where the alert came from, `PROMETHEUS_SOURCE` or `SPLUNK_SOURCE`.
+        channel (str): `TELEGRAM_CONFIG_WORD` or `SMS_CONFIG_WORD`.
+        target (dict): The destination type entry from the alertbot config.
+        payload (Any): `AlertRequestPrometheus` for prometheus jobs, and a dict with
+            "keys", "body" and "route_path" for splunk jobs.
+        receiver (str): Receiver or splunk route the job belongs to, used for logging.
+        outbox_id (Optional[int]): Row of the job in the outbox, when the outbox is enabled.
+        dedup_key (Optional[str]): Dedup key of the webhook the job came from, released when
+            the job fails so the next copy of the notification is not dropped.
+    """
+    source: str
+    channel: str
+    target: dict
+    payload: Any
+    receiver: str = ""
+    enqueued_at: float = field(default_factory=time.monotonic)
+    outbox_id: Optional[int] = None
+    dedup_key: Optional[str] = None
+
+    def dumps(self) -> str:
+        """Serialize the job to be stored in the outbox"""
+        payload = self.payload
+        if isinstance(payload, AlertRequestPrometheus):
+            payload = payload.model_dump()
+        return json.dumps({
+            "source": self.source,
+            "channel": self.channel,
+            "target": self.target,
+            "payload": payload,
+            "receiver": self.receiver,
+            "dedup_key": self.dedup_key
+        })
+
+    @classmethod
+    def loads(cls, raw: str, outbox_id: Optional[int] = None) -> "DeliveryJob":
+        data = json.loads(raw)
+        if data["source"] == PROMETHEUS_SOURCE:
+            data["payload"] = AlertRequestPrometheus.model_validate(data["payload"])
+        return cls(outbox_id=outbox_id, **data)
+
+
+async def deliver(job: DeliveryJob):
+    """
+    Render and send one delivery job. Errors are raised to the caller.
+    """
+    token = set_pipeline_labels(job.channel, job.source)
+    try:
+        await _deliver(job)
+    finally:
+        reset_pipeline_labels(token)
+
+async def deliver_all(jobs: List[DeliveryJob], concurrency: int = FANOUT_CONCURRENCY):
+    """
+    Deliver the targets of one alert concurrently, at most `concurrency` at a time.
+    A failing target doesn't stop the others, the failures are raised together
+    once every target is done.
+
+    Raises:
+        DeliveryFailed: If at least one of the jobs failed.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(job: DeliveryJob):
+        async with semaphore:
+            logger.info(f"Generating {job.channel} alert...")
+            await deliver(job)
+
+    results = await asyncio.gather(*(run(job) for job in jobs), return_exceptions=True)
+    failures = []
+    for job, result in zip(jobs, results):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, Exception):
+            logger.error(f"Failed to deliver {job.channel} alert for {job.receiver}: {result}")
+            failures.append((job, result))
+    if failures:
+        raise DeliveryFailed(failures)
+
+async def _deliver(job: DeliveryJob):
+    if job.source == PROMETHEUS_SOURCE:
+        if job.channel == TELEGRAM_CONFIG_WORD:
+            await generate_send_telegram_alert(alert=job.payload, target=job.target)
+        elif job.channel == SMS_CONFIG_WORD:
+            await generate_send_sms_alert(alert_group=job.payload, target=job.target)
+
+    elif job.source == SPLUNK_SOURCE:
+        keys = job.payload["keys"]
+        body = job.payload["body"]
+        if job.channel == TELEGRAM_CONFIG_WORD:
+            message = generate_telegram_splunk_body(keys, body)
+            logger.debug(f"Generated Telegram message: {message}")
+            await send_telegram_splunk_message(
+                message,
+                job.target["telegram_group_id"],
+                job.target.get("telegram_topic_id", None),
+                job.payload["route_path"]
+            )
+        elif job.channel == SMS_CONFIG_WORD:
+            message = generate_sms_splunk_body(keys, body)
+            logger.info(f"Generated SMS message: {message}")
+            await send_sms_splunk_message(
+                message,
+                job.target["keycloak_group_name"],
+                job.target.get("sender", DEFAULT_SENDER)
+            )
+    else:
+        logger.error(f"Unknown delivery source {job.source}, dropping the job!")
+
+
+class DeliveryQueue:
+    """
+    A Singleton in-process queue that lets the webhook endpoints return as soon as
+    an alert is routed, while a pool of async workers renders and sends it.
+    """
+    _instance = None
+
+    def __new__(cls, workers: int = 8, max_size: int = 10000, outbox: Outbox = None):
+        if cls._instance is None:
+            cls._instance = super(DeliveryQueue, cls).__new__(cls)
+
+            instance = cls._instance
+            instance.workers = int(workers)
+            instance.max_size = int(max_size)
+            instance.outbox = outbox
+            instance._queue = None
+            instance._tasks = []
+            instance._maintenance = None
+            instance._accepting = False
+
+        return cls._instance
+
+    def __init__(self, workers: int = 8, max_size: int = 10000, outbox: Outbox = None):
+        # No initialization here, it's all handled in __new__
+        # Arguments should be same as __new__ method
+        pass
+
+    def start(self):
+        """Create the queue and start the workers on the running event loop"""
+        if self._tasks:
+            logger.info("Delivery workers already started")
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(index), name=f"delivery-worker-{index}")
+            for index in range(self.workers)
+        ]
+        self._accepting = True
+        if self.outbox is not None:
+            self._maintenance = asyncio.create_task(self._maintain_outbox(), name="delivery-outbox")
+        alertbot_delivery_workers.set(self.workers)
+        logger.info(f"Started {self.workers} delivery workers (queue size {self.max_size})")
+
+    async def enqueue(self, jobs: List[DeliveryJob]):
+        """
+        Put all the given jobs on the queue, or none of them.
+        With an outbox, the jobs are on disk by the time this returns.
+
+        Raises:
+            DeliveryQueueNotStarted: If `start` has not been called.
+            DeliveryQueueFull: If there is no room for every job.
+        """
+        if not self._accepting:
+            raise DeliveryQueueNotStarted("Delivery queue is not accepting jobs")
+        self._check_room(jobs)
+        if self.outbox is not None:
+            ids = await self.outbox.append([job.dumps() for job in jobs])
+            for job, outbox_id in zip(jobs, ids):
+                job.outbox_id = outbox_id
+            try:
+                # Other requests may have taken the room while waiting for the commit
+                self._check_room(jobs)
+            except DeliveryQueueFull:
+                for outbox_id in ids:
+                    self.outbox.ack(outbox_id)
+                raise
+        for job in jobs:
+            self._queue.put_nowait(job)
+        alertbot_delivery_queue_depth.set(self._queue.qsize())
+
+    def _check_room(self, jobs: List[DeliveryJob]):
+        if self._queue.maxsize - self._queue.qsize() < len(jobs):
+            for job in jobs:
+                alertbot_delivery_rejected_counter.labels(source=job.source).inc()
+            raise DeliveryQueueFull(f"Delivery queue is full ({self._queue.qsize()} jobs waiting)")
+
+    async def replay(self):
+        """
+        Queue the deliveries a previous run or a dead worker accepted but did not finish. Waits for room
+        in the queue instead of rejecting, so it is meant to run as a background task.
+        """
+        if self.outbox is None:
+            return
+        rows = await self.outbox.pending()
+        if not rows:
+            return
+        logger.warning(f"Replaying {len(rows)} deliveries left in the outbox by a previous run or worker")
+        for outbox_id, raw in rows:
+            try:
+                job = DeliveryJob.loads(raw, outbox_id=outbox_id)
+            except Exception as e:
+                logger.error(f"Dropping unreadable outbox row {outbox_id}: {e}")
+                self.outbox.ack(outbox_id)
+                continue
+            await self._queue.put(job)
+            alertbot_outbox_replayed_counter.inc()
+        alertbot_delivery_queue_depth.set(self._queue.qsize())
+
+    async def _maintain_outbox(self):
+        try:
+            await self.replay()
+        except Exception as e:
+            logger.error(f"Replaying the delivery outbox failed: {e}")
+        while True:
+            await asyncio.sleep(self.outbox.compact_interval)
+            try:
+                await self.outbox.compact()
+                # Adopt what a worker process that died left behind
+                await self.replay()
+            except Exception as e:
+                logger.error(f"Maintaining the delivery outbox failed: {e}")
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            alertbot_delivery_queue_depth.set(self._queue.qsize())
+            alertbot_delivery_queue_wait_seconds.labels(
+                source=job.source, channel=job.channel
+            ).observe(time.monotonic() - job.enqueued_at)
+            alertbot_delivery_workers_busy.inc()
+            result = "success"
+            try:
+                await deliver(job)
+            except asyncio.CancelledError:
+                result = "cancelled"
+                raise
+            except Exception as e:
+                result = "failed"
+                logger.error(f"Delivery worker {index} failed to deliver {job.channel} " +
+                             f"alert for {job.receiver}: {e}")
+                if job.dedup_key is not None:
+                    # Let the retry of this notification through
+                    await forget(job.dedup_key)
+            finally:
+                alertbot_delivery_workers_busy.dec()
+                alertbot_delivery_jobs_counter.labels(
+                    source=job.source, channel=job.channel, result=result
+                ).inc()
+                # A failed job already went through its retries, only an interrupted one is replayed
+                if self.outbox is not None and job.outbox_id is not None and result != "cancelled":
+                    self.outbox.ack(job.outbox_id)
+                self._queue.task_done()
+
+    async def stop(self, timeout: float = 30):
+        """Stop accepting jobs, wait up to `timeout` seconds for the queue to drain and stop the workers"""
+        if not self._tasks:
+            return
+        self._accepting = False
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+            await asyncio.gather(self._maintenance, return_exceptions=True)
+            self._maintenance = None
+        logger.info(f"Draining delivery queue ({self._queue.qsize()} jobs waiting)...")
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            if self.outbox is not None:
+                logger.error(f"Delivery queue was not drained after {timeout} seconds, " +
+                             f"{self._queue.qsize()} jobs are left in the outbox for the next start")
+            else:
+                logger.error(f"Delivery queue was not drained after {timeout} seconds, " +
+                             f"{self._queue.qsize()} jobs are dropped!")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.outbox is not None:
+            await self.outbox.close()
+        alertbot_delivery_workers.set(0)
+        alertbot_delivery_workers_busy.set(0)
@@ -0,0 +1,18 @@
+class DeliveryError(Exception):
+    """Base exception for delivery queue related errors"""
+    pass
+
+class DeliveryQueueFull(DeliveryError):
+    """Raised when the delivery queue has no room for new jobs"""
+    pass
+
+class DeliveryQueueNotStarted(DeliveryError):
+    """Raised when jobs are enqueued before the workers are started"""
+    pass
+
+class DeliveryFailed(DeliveryError):
+    """Raised when some targets of an alert could not be delivered"""
+
+    def __init__(self, failures: list):
+        self.failures = failures  # (DeliveryJob, Exception)
+        super().__init__(", ".join(f"{job.channel} for {job.receiver}: {e}" for job, e in failures))
@@ -0,0 +1,285 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from utils.metrics import (
+    alertbot_outbox_rows,
+    alertbot_outbox_commit_seconds,
+    alertbot_outbox_commit_batch_size,
+    alertbot_outbox_dropped_counter
+)
+import asyncio
+import fcntl
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    replays INTEGER NOT NULL DEFAULT 0,
+    job TEXT NOT NULL,
+    owner TEXT
+)
+"""
+
+
+class Outbox:
+    """
+    A crash-safe log of accepted deliveries kept in SQLite (WAL mode).
+
+    Appends from concurrent requests that arrive within `commit_interval_ms` are written in
+    one transaction (group commit), acknowledgements are batched the same way. Rows are
+    deleted once acknowledged, and `compact` bounds what is left by age and count.
+    All database access happens on one dedicated thread.
+
+    Several processes (workers) can share the file. Every row belongs to the process that
+    wrote it, which holds an flock on `<path>.owners/<owner>.lock` while it runs, and is
+    only replayed by another process once that lock is gone.
+    """
+
+    def __init__(self, path: str,
+                 commit_interval_ms: float = 5,
+                 retention_seconds: float = 86400,
+                 max_rows: int = 100000,
+                 max_replays: int = 3,
+                 compact_interval: float = 300):
+        self.path = path
+        self.commit_interval = commit_interval_ms / 1000
+        self.retention_seconds = retention_seconds
+        self.max_rows = max_rows
+        self.max_replays = max_replays
+        self.compact_interval = compact_interval
+        self._executor = None
+        self._connection = None
+        self._appends = []  # (serialized job, future)
+        self._acks = []
+        self._flush_task = None
+        # The pid alone could be reused by the next run, e.g. as pid 1 in a container
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.owners_directory = f"{path}.owners"
+        self._owner_lock = None
+        self._rows = 0
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        await self._run(self._open)
+        logger.info(f"Opened delivery outbox {self.path}")
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # NORMAL keeps committed rows across a process crash, only a power loss can lose
+        # the last transactions, and it avoids an fsync on every commit
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # Other workers may be writing, wait for them instead of failing
+        self._connection.execute("PRAGMA busy_timeout=5000")
+        self._connection.execute(SCHEMA)
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(deliveries)")]
+        if "owner" not in columns:
+            # Outboxes created before rows had owners, their rows are replayed as orphans
+            self._connection.execute("ALTER TABLE deliveries ADD COLUMN owner TEXT")
+        os.makedirs(self.owners_directory, exist_ok=True)
+        self._owner_lock = open(os.path.join(self.owners_directory, f"{self.owner}.lock"), "w")
+        fcntl.flock(self._owner_lock, fcntl.LOCK_EX)
+        self._set_rows(self._count())
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def append(self, jobs: List[str]) -> List[int]:
+        """
+        Durably store serialized jobs.
+
+        Returns:
+            List[int]: The outbox ids of the jobs, in order.
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for job in jobs:
+            future = loop.create_future()
+            self._appends.append((job, future))
+            futures.append(future)
+        self._schedule_flush()
+        return list(await asyncio.gather(*futures))
+
+    def ack(self, outbox_id: int):
+        """Forget a delivery that was handled, written with the next group commit"""
+        self._acks.append(outbox_id)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        await asyncio.sleep(self.commit_interval)
+        while self._appends or self._acks:
+            appends, self._appends = self._appends, []
+            acks, self._acks = self._acks, []
+            start = time.perf_counter()
+            try:
+                ids = await self._run(self._write, [job for job, _ in appends], acks)
+            except Exception as e:
+                logger.error(f"Writing {len(appends)} deliveries and {len(acks)} acknowledgements " +
+                             f"to the outbox failed: {e}")
+                for _, future in appends:
+                    if not future.done():
+                        future.set_exception(e)
+                # Keep the acks for the next flush, else their deliveries would be replayed
+                self._acks = acks + self._acks
+                if not self._appends:
+                    break
+                continue
+            alertbot_outbox_commit_seconds.observe(time.perf_counter() - start)
+            alertbot_outbox_commit_batch_size.observe(len(appends) + len(acks))
+            for (_, future), outbox_id in zip(appends, ids):
+                if not future.done():
+                    future.set_result(outbox_id)
+
+    def _write(self, jobs: List[str], acks: List[int]) -> List[int]:
+        ids = []
+        now = time.time()
+        cursor = self._connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for job in jobs:
+                cursor.execute("INSERT INTO deliveries (created_at, job, owner) VALUES (?, ?, ?)",
+                               (now, job, self.owner))
+                ids.append(cursor.lastrowid)
+            deleted = 0
+            if acks:
+                deleted = cursor.executemany("DELETE FROM deliveries WHERE id = ?", ((ack,) for ack in acks)).rowcount
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        self._set_rows(self._rows + len(jobs) - deleted)
+        return ids
+
+    async def pending(self) -> List[tuple]:
+        """
+        Claims the deliveries left unacknowledged by processes that are gone, a previous run
+        or a worker that died, and returns their (id, serialized job). Deliveries that were
+        already replayed `max_replays` times are dropped, so a job that crashes the process
+        can not do it forever.
+        """
+        return await self._run(self._pending)
+
+    def _pending(self) -> List[tuple]:
+        owners = [row[0] for row in self._connection.execute(
+            "SELECT DISTINCT owner FROM deliveries WHERE owner IS NULL OR owner != ?", (self.owner,))]
+        rows = []
+        for owner in owners:
+            lock = self._lock_if_gone(owner)
+            if lock is False:
+                continue
+            try:
+                rows.extend(self._claim(owner))
+            finally:
+                self._forget_owner(owner, lock)
+        rows.sort()
+        if owners:
+            self._set_rows(self._count())
+        return rows
+
+    def _lock_if_gone(self, owner: str):
+        """
+        Returns False while `owner` is running. Otherwise the lock file of the owner, locked
+        so no other process claims the same rows, or None if there is no lock file.
+        """
+        if owner is None:
+            return None
+        try:
+            lock = open(os.path.join(self.owners_directory, f"{owner}.lock"), "r")
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        return lock
+
+    def _claim(self, owner: str) -> List[tuple]:
+        cursor = self._connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            dropped = cursor.execute("DELETE FROM deliveries WHERE owner IS ? AND replays >= ?",
+                                     (owner, self.max_replays)).rowcount
+            rows = cursor.execute("SELECT id, job FROM deliveries WHERE owner IS ? ORDER BY id",
+                                  (owner,)).fetchall()
+            cursor.execute("UPDATE deliveries SET owner = ?, replays = replays + 1 WHERE owner IS ?",
+                           (self.owner, owner))
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        if dropped:
+            logger.error(f"Dropped {dropped} deliveries from the outbox after {self.max_replays} replays")
+            alertbot_outbox_dropped_counter.labels(reason="replays").inc(dropped)
+        return rows
+
+    def _forget_owner(self, owner: str, lock):
+        if lock is None:
+            return
+        # Removed while still locked, so the next process to look finds no file
+        os.remove(lock.name)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    async def compact(self):
+        """Drop expired rows, keep at most `max_rows` and give the freed pages back to the disk"""
+        await self._run(self._compact)
+
+    def _compact(self):
+        expired = self._connection.execute(
+            "DELETE FROM deliveries WHERE created_at < ?", (time.time() - self.retention_seconds,)).rowcount
+        overflow = self._connection.execute(
+            "DELETE FROM deliveries WHERE id NOT IN (SELECT id FROM deliveries ORDER BY id DESC LIMIT ?)",
+            (self.max_rows,)).rowcount
+        if expired:
+            logger.error(f"Dropped {expired} deliveries older than {self.retention_seconds}s from the outbox")
+            alertbot_outbox_dropped_counter.labels(reason="retention").inc(expired)
+        if overflow:
+            logger.error(f"Dropped {overflow} deliveries from the outbox to keep it under {self.max_rows} rows")
+            alertbot_outbox_dropped_counter.labels(reason="max_rows").inc(overflow)
+        for name in os.listdir(self.owners_directory):
+            owner = name[:-len(".lock")]
+            if owner != self.owner:
+                # Owners that are gone and had nothing left to replay
+                lock = self._lock_if_gone(owner)
+                if lock:
+                    self._forget_owner(owner, lock)
+        self._connection.execute("PRAGMA incremental_vacuum")
+        self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._set_rows(self._count())
+
+    def _set_rows(self, rows: int):
+        # Counted per process, the other workers' writes show up with the next compaction
+        self._rows = rows
+        alertbot_outbox_rows.set(rows)
+
+    def _count(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+
+    async def close(self):
+        """Write the pending appends and acknowledgements and close the database"""
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._appends or self._acks:
+            self._schedule_flush()
+            await self._flush_task
+        await self._run(self._connection.close)
+        self._executor.shutdown(wait=True)
+        # What is left can be replayed by the other workers or the next run right away
+        self._forget_owner(self.owner, self._owner_lock)
+        self._owner_lock = None
+        logger.info("Closed delivery outbox")
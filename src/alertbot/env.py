@@ -11,26 +11,111 @@ TIMEZONE = os.environ.get("TZ", "Asia/Tehran")
 CONFIG_JSON_FILE = CONFIGS_DIRECTORY + os.environ.get("CONFIG_JSON_FILE", "alertbot-config.json")
 CONFIG_SPLUNK_JSON_FILE = CONFIGS_DIRECTORY + os.environ.get("CONFIG_SPLUNK_JSON_FILE", "alertbot-splunk-config.json")
 CONFIG_RELOADER_INTERVAL = int(os.environ.get("CONFIG_RELOADER_INTERVAL", "60"))
+CONFIG_WATCHER_ENABLED = False
+if "true" in os.environ.get("CONFIG_WATCHER_ENABLED", "false").lower():
+    CONFIG_WATCHER_ENABLED = True
+CONFIG_WATCHER_DEBOUNCE_MS = int(os.environ.get("CONFIG_WATCHER_DEBOUNCE_MS", "20"))
+
+WORKERS = int(os.environ.get("WORKERS", "1")) # processes serving the webhooks, each one uses a core
+RUNTIME_DIR = os.environ.get("RUNTIME_DIR", "data/run") # shared by the workers: leader lock, config snapshot and metrics
+CONFIG_SNAPSHOT_WAIT = float(os.environ.get("CONFIG_SNAPSHOT_WAIT", "10")) # seconds a worker waits for the leader's config
+UVICORN_LOOP = os.environ.get("UVICORN_LOOP", "auto") # auto uses uvloop when it is installed
+UVICORN_HTTP = os.environ.get("UVICORN_HTTP", "auto") # auto uses httptools when it is installed
 
 TG_BOT_TOKEN = os.environ.get("TG_BOT_TOKEN")
+TG_API_BASE_URL = os.environ.get("TG_API_BASE_URL", "https://api.telegram.org").rstrip("/")
 TG_SEND_RETRIES = os.environ.get("TG_SEND_RETRIES", "3")
 TG_SEND_RETRY_DELAY = os.environ.get("TG_SEND_RETRY_DELAY", "5")
 TG_GROUP_TEST_ID = os.environ.get("TG_GROUP_TEST", "")
+TG_GLOBAL_RATE_LIMIT = float(os.environ.get("TG_GLOBAL_RATE_LIMIT", "30")) # messages per second for the whole bot
+TG_GROUP_RATE_LIMIT_PER_MINUTE = float(os.environ.get("TG_GROUP_RATE_LIMIT_PER_MINUTE", "20"))
+TG_PRIVATE_RATE_LIMIT = float(os.environ.get("TG_PRIVATE_RATE_LIMIT", "1")) # messages per second for private chats
+TG_MAX_THROTTLED_RETRIES = int(os.environ.get("TG_MAX_THROTTLED_RETRIES", "5"))
 ACTIVE_TELEGRAM=False
 TELEGRAM_MODE = os.environ.get("TELEGRAM_MODE", "API") # it is either API or BOT
 ENABLE_POLLING = False
 if "true" in os.environ.get("ENABLE_POLLING", "true").lower():
     ENABLE_POLLING = True
+TG_WEBHOOK_URL = os.environ.get("TG_WEBHOOK_URL", "") # public URL of /api/v2/telegram/webhook, BOT mode receives updates there instead of polling
+TG_WEBHOOK_SECRET = os.environ.get("TG_WEBHOOK_SECRET", "") # sent back by Telegram in X-Telegram-Bot-Api-Secret-Token, required with TG_WEBHOOK_URL
+ALERTMANAGER_URL = os.environ.get("ALERTMANAGER_URL", "") # silences are created there, with ALERTMANAGER_USERNAME/PASSWORD
+ALERTMANAGER_ALLOWED_URLS = os.environ.get("ALERTMANAGER_ALLOWED_URLS", "") # comma separated, without ALERTMANAGER_URL the externalURLs of webhooks that can be silenced (no credentials are sent)
+ALERTMANAGER_USERNAME = os.environ.get("ALERTMANAGER_USERNAME", "")
+ALERTMANAGER_PASSWORD = os.environ.get("ALERTMANAGER_PASSWORD", "")
+SILENCE_DURATION_SECONDS = float(os.environ.get("SILENCE_DURATION_SECONDS", "3600")) # how long the silence button silences an alert group
+SILENCE_CALLBACK_TTL = float(os.environ.get("SILENCE_CALLBACK_TTL", "604800")) # seconds a silence button keeps working after it was sent
+SILENCE_BATCH_WINDOW_MS = float(os.environ.get("SILENCE_BATCH_WINDOW_MS", "50")) # presses of this window are sent to alertmanager together
+SILENCE_INDEX_REFRESH_SECONDS = float(os.environ.get("SILENCE_INDEX_REFRESH_SECONDS", "30"))
 if "true" in os.environ.get("ACTIVE_TELEGRAM", "true").lower():
     ACTIVE_TELEGRAM = True
 
 
 KAVENEGAR_API_KEY = os.environ.get("KAVENEGAR_API_KEY", "")
+KAVENEGAR_API_URL = os.environ.get("KAVENEGAR_API_URL", "https://api.kavenegar.com").rstrip("/")
+KAVENEGAR_MAX_RECEPTORS = int(os.environ.get("KAVENEGAR_MAX_RECEPTORS", "200")) # recipients per request
 PHONE_SYNC_API_URL = os.environ.get("PHONE_SYNC_API_URL", "http://localhost:8001")
 PHONE_SYNC_API_ROUTE = os.environ.get("PHONE_SYNC_API_ROUTE", "/api/numbers")
+PHONE_CACHE_TTL = float(os.environ.get("PHONE_CACHE_TTL", "60"))
+PHONE_CACHE_STALE_TTL = float(os.environ.get("PHONE_CACHE_STALE_TTL", "300"))
 DEFAULT_SENDER = os.environ.get("DEFAULT_SENDER", "100008700")
 LIMIT_SMS_NUMBER_PER_ALERT_GROUP = int(os.environ.get("LIMIT_SMS_NUMBER_PER_ALERT_GROUP", 2))
 ACTIVE_SMS=False
 if "true" in os.environ.get("ACTIVE_SMS", "true").lower():
     ACTIVE_SMS = True
 
+ASYNC_DELIVERY = False
+if "true" in os.environ.get("ASYNC_DELIVERY", "true").lower():
+    ASYNC_DELIVERY = True
+DELIVERY_WORKERS = int(os.environ.get("DELIVERY_WORKERS", "8"))
+DELIVERY_QUEUE_SIZE = int(os.environ.get("DELIVERY_QUEUE_SIZE", "10000"))
+DELIVERY_SHUTDOWN_TIMEOUT = float(os.environ.get("DELIVERY_SHUTDOWN_TIMEOUT", "30"))
+FANOUT_CONCURRENCY = int(os.environ.get("FANOUT_CONCURRENCY", "8")) # targets of one alert sent at the same time when ASYNC_DELIVERY is off
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "10"))
+HTTP_TOTAL_TIMEOUT = float(os.environ.get("HTTP_TOTAL_TIMEOUT", "30"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", str(8 * 1024 * 1024))) # larger webhooks are refused with 413
+STREAMING_MIN_BODY_BYTES = int(os.environ.get("STREAMING_MIN_BODY_BYTES", str(1024 * 1024))) # larger prometheus webhooks are parsed while received
+
+DEDUP_ENABLED = False
+if "true" in os.environ.get("DEDUP_ENABLED", "true").lower():
+    DEDUP_ENABLED = True
+DEDUP_WINDOW_SECONDS = float(os.environ.get("DEDUP_WINDOW_SECONDS", "120"))
+DEDUP_MAX_ENTRIES = int(os.environ.get("DEDUP_MAX_ENTRIES", "10000"))
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory").lower() # memory or redis, where dedup keys and shared limits are kept
+STATE_MAX_ENTRIES = int(os.environ.get("STATE_MAX_ENTRIES", str(DEDUP_MAX_ENTRIES))) # per namespace (dedup, silence...), only used by the memory backend
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+REDIS_TIMEOUT = float(os.environ.get("REDIS_TIMEOUT", "0.5"))
+STATE_KEY_PREFIX = os.environ.get("STATE_KEY_PREFIX", "alertbot:")
+
+OUTBOX_ENABLED = False
+if "true" in os.environ.get("OUTBOX_ENABLED", "false").lower():
+    OUTBOX_ENABLED = True
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", "data/alertbot-outbox.db")
+OUTBOX_COMMIT_INTERVAL_MS = float(os.environ.get("OUTBOX_COMMIT_INTERVAL_MS", "5"))
+OUTBOX_RETENTION_SECONDS = float(os.environ.get("OUTBOX_RETENTION_SECONDS", "86400"))
+OUTBOX_MAX_ROWS = int(os.environ.get("OUTBOX_MAX_ROWS", "100000"))
+OUTBOX_MAX_REPLAYS = int(os.environ.get("OUTBOX_MAX_REPLAYS", "3"))
+OUTBOX_COMPACT_INTERVAL = float(os.environ.get("OUTBOX_COMPACT_INTERVAL", "300"))
+
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.2")) # retries allowed per first attempt
+RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get("RETRY_BUDGET_MIN_PER_SECOND", "5"))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "30"))
+HTTP_RETRY_DEADLINE = float(os.environ.get("HTTP_RETRY_DEADLINE", "60"))
+
+CIRCUIT_BREAKER_ENABLED = False
+if "true" in os.environ.get("CIRCUIT_BREAKER_ENABLED", "true").lower():
+    CIRCUIT_BREAKER_ENABLED = True
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "5"))
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = float(os.environ.get("CIRCUIT_BREAKER_RECOVERY_TIMEOUT", "30"))
+CIRCUIT_BREAKER_HALF_OPEN_CALLS = int(os.environ.get("CIRCUIT_BREAKER_HALF_OPEN_CALLS", "1"))
+
+METRICS_MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", "1000")) # label sets per metric before folding into an overflow series
+SMS_NUMBER_METRIC_MODE = os.environ.get("SMS_NUMBER_METRIC_MODE", "raw").lower() # raw, hashed, bucketed or disabled
+SMS_NUMBER_METRIC_BUCKETS = int(os.environ.get("SMS_NUMBER_METRIC_BUCKETS", "32"))
@@ -1,2 +1,4 @@
-configs = {}
-splunk_configs = {}
\ No newline at end of file
+from alertbot.alertbot_config_manager.config_snapshot import ConfigSnapshot
+
+# Replaced as a whole by startup.refresh_config, read it once per request
+snapshot = ConfigSnapshot()
@@ -0,0 +1,317 @@
+"""
+Reading and parsing of the webhook bodies, shared by the endpoints.
+
+Bodies are read once as bytes, refused past MAX_BODY_BYTES, and parsed straight from the
+bytes by orjson. Prometheus webhooks are then validated from the parsed dict: with their
+untyped label and annotation dicts, that is faster than pydantic's `model_validate_json`
+(see benchmarks/bench_ingestion.py).
+
+Prometheus bodies larger than STREAMING_MIN_BODY_BYTES (or sent without a Content-Length)
+are parsed while they are received instead, one alert at a time, see AlertStreamParser.
+That bounds the memory of receiving and decoding the body, not the number of alerts kept:
+the group is routed once it is complete, since the severity used for routing comes from
+commonLabels, which Alertmanager sends after the alerts, and dedup, the delivery queue and
+the outbox work on whole groups.
+"""
+from typing import AsyncIterator, Optional
+from fastapi import HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from alertbot.schemas import AlertRequestPrometheus, AlertPrometheus
+from alertbot.env import MAX_BODY_BYTES, STREAMING_MIN_BODY_BYTES
+import codecs
+import json
+import orjson
+
+BODY_TOO_LARGE_DETAIL = f"The request body is larger than {MAX_BODY_BYTES} bytes!"
+
+def _content_length(request: Request) -> Optional[int]:
+    length = request.headers.get("content-length")
+    return int(length) if length is not None and length.isdigit() else None
+
+async def _receive(request: Request, max_bytes: int) -> AsyncIterator[bytes]:
+    """
+    Yields the body as it is received.
+
+    Raises:
+        HTTPException: 413 if the body is larger than `max_bytes`. Checked on the
+            Content-Length first, then while the body is received for chunked requests.
+    """
+    length = _content_length(request)
+    if length is not None and length > max_bytes:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=BODY_TOO_LARGE_DETAIL)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=BODY_TOO_LARGE_DETAIL)
+        yield chunk
+
+async def read_body(request: Request, max_bytes: int = MAX_BODY_BYTES) -> bytes:
+    """
+    Returns:
+        bytes: The request body.
+    Raises:
+        HTTPException: 413 if the body is larger than `max_bytes`.
+    """
+    chunks = [chunk async for chunk in _receive(request, max_bytes)]
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+def should_stream(request: Request) -> bool:
+    """True if the body is large enough, or of unknown size, to be parsed while it is received"""
+    length = _content_length(request)
+    return length is None or length > STREAMING_MIN_BODY_BYTES
+
+def _json_invalid(position: int, message: str) -> RequestValidationError:
+    return RequestValidationError([{"type": "json_invalid", "loc": ("body", position),
+                                    "msg": "JSON decode error", "input": {}, "ctx": {"error": message}}])
+
+def parse_prometheus(body: bytes) -> AlertRequestPrometheus:
+    """
+    Raises:
+        RequestValidationError: With the same errors FastAPI returns for a typed body (422).
+    """
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise _json_invalid(e.pos, e.msg)
+    try:
+        return AlertRequestPrometheus.model_validate(data)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])}
+                                      for error in e.errors(include_url=False)])
+
+def parse_splunk(body: bytes):
+    """
+    Splunk sends whatever its alert action was configured with, so anything that is not
+    JSON is kept as text under `raw_body` instead of being refused.
+    """
+    if not body:
+        return {}
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return {"raw_body": body.decode("utf-8", errors="replace")}
+
+
+# Not a JSON value yet, the rest of it has not been received
+_INCOMPLETE = object()
+# Longer strings (descriptions, URLs...) are rarely repeated, not worth looking up
+SHARED_STRING_LENGTH = 64
+
+class AlertStreamParser:
+    """
+    Incremental parser of a Prometheus webhook. The text is fed as it is received, the
+    members of the top level object are decoded one by one and every element of `alerts`
+    is validated as soon as it is complete, so only the alert being received is kept as
+    text and never a second copy of the whole body.
+
+    Label names and short values repeat in every alert of a group, they are decoded once
+    and shared by all the alerts (`_shared_strings`).
+
+    Returns the same group as `parse_prometheus` once the whole body was fed, the validated
+    alerts are kept until then. Malformed bodies are refused with 422 as well, but not always
+    with the same error: an invalid alert is reported before the JSON that follows it is
+    read, and positions are counted in characters instead of bytes.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder(object_pairs_hook=self._shared_strings)
+        self._strings = {}
+        self.buffer = ""
+        self.position = 0
+        self.offset = 0  # characters dropped from the buffer so far, for error positions
+        self.state = self._start
+        self.key = None
+        self.fields = {}
+        self.alerts = None  # set once an `alerts` array starts
+
+    def feed(self, text: str, final: bool = False):
+        self.buffer = self.buffer[self.position:] + text
+        self.offset += self.position
+        self.position = 0
+        while self.state is not None and self.state(final):
+            pass
+        if final and self.state is not None:
+            raise _json_invalid(self.offset + self.position, "Unexpected end of the body")
+
+    def result(self) -> AlertRequestPrometheus:
+        try:
+            data = self.fields
+            if self.alerts is not None:
+                # The alerts are validated already, pydantic keeps model instances as they are
+                data = {**data, "alerts": self.alerts}
+            return AlertRequestPrometheus.model_validate(data)
+        except ValidationError as e:
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])}
+                                          for error in e.errors(include_url=False)])
+
+    def _shared_strings(self, pairs: list) -> dict:
+        share = self._strings.setdefault
+        return {share(key, key): (share(value, value) if type(value) is str and len(value) <= SHARED_STRING_LENGTH
+                                  else value)
+                for key, value in pairs}
+
+    # Every state returns True when it moved on, False when it needs more text
+
+    def _next_char(self) -> Optional[str]:
+        """The next non whitespace character, not consumed"""
+        buffer = self.buffer
+        position = self.position
+        while position < len(buffer) and buffer[position] in " \t\n\r":
+            position += 1
+        self.position = position
+        return buffer[position] if position < len(buffer) else None
+
+    def _expect(self, characters: str) -> Optional[str]:
+        char = self._next_char()
+        if char is None:
+            return None
+        if char not in characters:
+            raise _json_invalid(self.offset + self.position, f"Expecting one of {characters!r}")
+        self.position += 1
+        return char
+
+    def _value(self, final: bool):
+        self._next_char()
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, self.position)
+        except json.JSONDecodeError as e:
+            if not final:
+                return _INCOMPLETE
+            raise _json_invalid(self.offset + e.pos, e.msg)
+        if end == len(self.buffer) and not final:
+            # A number may go on in the next chunk
+            return _INCOMPLETE
+        self.position = end
+        return value
+
+    def _start(self, final: bool) -> bool:
+        char = self._next_char()
+        if char is None:
+            return False
+        if char != "{":
+            # Not a group, keep it all for parse_prometheus to report the error
+            self.state = self._not_an_object
+            return True
+        self.position += 1
+        self.state = self._first_key
+        return True
+
+    def _not_an_object(self, final: bool) -> bool:
+        if not final:
+            return False
+        parse_prometheus(self.buffer.encode())
+
+    def _first_key(self, final: bool) -> bool:
+        char = self._next_char()
+        if char is None:
+            return False
+        if char == "}":
+            self.position += 1
+            self.state = self._end
+        else:
+            self.state = self._key
+        return True
+
+    def _key(self, final: bool) -> bool:
+        if self._next_char() is None:
+            return False
+        if self.buffer[self.position] != '"':
+            raise _json_invalid(self.offset + self.position, "Expecting property name enclosed in double quotes")
+        key = self._value(final)
+        if key is _INCOMPLETE:
+            return False
+        self.key = key
+        self.state = self._colon
+        return True
+
+    def _colon(self, final: bool) -> bool:
+        if self._expect(":") is None:
+            return False
+        self.state = self._member
+        return True
+
+    def _member(self, final: bool) -> bool:
+        char = self._next_char()
+        if char is None:
+            return False
+        if self.key == "alerts" and char == "[":
+            self.position += 1
+            self.fields.pop("alerts", None)
+            self.alerts = []
+            self.state = self._first_alert
+            return True
+        value = self._value(final)
+        if value is _INCOMPLETE:
+            return False
+        self.fields[self.key] = value
+        if self.key == "alerts":
+            self.alerts = None
+        self.state = self._after_member
+        return True
+
+    def _after_member(self, final: bool) -> bool:
+        char = self._expect(",}")
+        if char is None:
+            return False
+        self.state = self._key if char == "," else self._end
+        return True
+
+    def _first_alert(self, final: bool) -> bool:
+        char = self._next_char()
+        if char is None:
+            return False
+        if char == "]":
+            self.position += 1
+            self.state = self._after_member
+        else:
+            self.state = self._alert
+        return True
+
+    def _alert(self, final: bool) -> bool:
+        value = self._value(final)
+        if value is _INCOMPLETE:
+            return False
+        try:
+            self.alerts.append(AlertPrometheus.model_validate(value))
+        except ValidationError as e:
+            index = len(self.alerts)
+            raise RequestValidationError([{**error, "loc": ("body", "alerts", index, *error["loc"])}
+                                          for error in e.errors(include_url=False)])
+        self.state = self._after_alert
+        return True
+
+    def _after_alert(self, final: bool) -> bool:
+        char = self._expect(",]")
+        if char is None:
+            return False
+        self.state = self._alert if char == "," else self._after_member
+        return True
+
+    def _end(self, final: bool) -> bool:
+        if self._next_char() is not None:
+            raise _json_invalid(self.offset + self.position, "Extra data")
+        if not final:
+            return False
+        self.state = None
+        return True
+
+
+async def parse_prometheus_stream(request: Request, max_bytes: int = MAX_BODY_BYTES) -> AlertRequestPrometheus:
+    """
+    Like `parse_prometheus(await read_body(request))`, but parses the body while it is received.
+
+    Raises:
+        HTTPException: 413 if the body is larger than `max_bytes`.
+        RequestValidationError: If the body is not a valid Prometheus webhook.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = AlertStreamParser()
+    try:
+        async for chunk in _receive(request, max_bytes):
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b"", final=True), final=True)
+    except UnicodeDecodeError as e:
+        raise _json_invalid(parser.offset + parser.position, str(e))
+    return parser.result()
@@ -1,10 +1,13 @@
-from fastapi import status, APIRouter, HTTPException
-from alertbot.schemas import AlertRequestPrometheus
-from alertbot.constants import TELEGRAM_CONFIG_WORD, SMS_CONFIG_WORD 
-from alertbot.prometheus_endpoint.prom_telegram_functions import find_alert_receiver, \
-    generate_send_telegram_alert
-from alertbot.env import ACTIVE_TELEGRAM, ACTIVE_SMS
-from alertbot.prometheus_endpoint.prom_sms_functions import generate_send_sms_alert
+from fastapi import status, APIRouter, HTTPException, Request
+from alertbot.ingestion import read_body, parse_prometheus, should_stream, parse_prometheus_stream
+from alertbot.constants import TELEGRAM_CONFIG_WORD, SMS_CONFIG_WORD, PROMETHEUS_SOURCE
+from alertbot.prometheus_endpoint.prom_telegram_functions import find_alert_receiver
+from alertbot.prometheus_endpoint.prom_dedup import dedup_key, accept_once, forget
+from alertbot.env import ACTIVE_TELEGRAM, ACTIVE_SMS, ASYNC_DELIVERY, DEDUP_ENABLED
+from utils.metrics import alertbot_duplicate_webhooks_suppressed_counter
+from utils.pipeline_timing import time_stage, PARSE_STAGE, ROUTING_STAGE
+from alertbot.delivery import DeliveryQueue, DeliveryJob, deliver_all
+from alertbot.delivery.exceptions import DeliveryQueueFull
 import logging
 
 router = APIRouter(
@@ -17,11 +20,21 @@ logger = logging.getLogger()
 
 @router.post("/", status_code=status.HTTP_204_NO_CONTENT)
 async def send_alert(
-    new_alert: AlertRequestPrometheus
+    request: Request
     ):
 
     logger.info("/api/v2/alerts/prom endpoint has been called...")
-    dest = find_alert_receiver(new_alert)
+    if should_stream(request):
+        # Large groups are parsed while they are received, the parse stage includes receiving them
+        with time_stage(PARSE_STAGE, receiver_class=PROMETHEUS_SOURCE):
+            new_alert = await parse_prometheus_stream(request)
+    else:
+        body = await read_body(request)
+        # Validated here instead of by FastAPI so the parse stage can be timed
+        with time_stage(PARSE_STAGE, receiver_class=PROMETHEUS_SOURCE):
+            new_alert = parse_prometheus(body)
+    with time_stage(ROUTING_STAGE, receiver_class=PROMETHEUS_SOURCE):
+        dest = find_alert_receiver(new_alert)
     logger.debug(f"{new_alert}")
     if dest is None:
         logger.error(f"No match found for the given receiver!")
@@ -31,26 +44,52 @@ async def send_alert(
     
     logger.info(f"receiver match found for {new_alert.receiver}")
 
+    jobs = []
     for target in dest["types"]:
         if TELEGRAM_CONFIG_WORD in target["type"].lower():
-            logger.info("Generating telegram alert...")
             if ACTIVE_TELEGRAM:
-                await generate_send_telegram_alert(
-                    alert=new_alert,
-                    target=target)
+                jobs.append(DeliveryJob(source=PROMETHEUS_SOURCE, channel=TELEGRAM_CONFIG_WORD,
+                                        target=target, payload=new_alert, receiver=new_alert.receiver))
             else:
                 logger.error(f"ACTIVE_TELEGRAM env is not set! the alert for " + 
                 f"receiver {new_alert.receiver} will not be sent to telegram!")
 
         elif SMS_CONFIG_WORD in target["type"].lower(): 
-            logger.info("Generating sms alert...")
             if ACTIVE_SMS:
-                generate_send_sms_alert(
-                    alert_group=new_alert,
-                    target=target
-                )   
+                jobs.append(DeliveryJob(source=PROMETHEUS_SOURCE, channel=SMS_CONFIG_WORD,
+                                        target=target, payload=new_alert, receiver=new_alert.receiver))
             else:
                 logger.error(f"ACTIVE_SMS env is not set! the alert for " + 
                 f"receiver {new_alert.receiver} will not be sent to SMS!")
 
-    return 
\ No newline at end of file
+    key = None
+    if DEDUP_ENABLED:
+        key = dedup_key(new_alert)
+        if not await accept_once(key):
+            logger.info(f"Dropping duplicate notification for receiver {new_alert.receiver} ({key})")
+            alertbot_duplicate_webhooks_suppressed_counter.labels(receiver=new_alert.receiver).inc()
+            return
+
+    if not ASYNC_DELIVERY:
+        try:
+            await deliver_all(jobs)
+        except Exception:
+            # Let the retry of this webhook through
+            if key is not None:
+                await forget(key)
+            raise
+        return
+
+    for job in jobs:
+        job.dedup_key = key
+    try:
+        await DeliveryQueue().enqueue(jobs)
+    except DeliveryQueueFull as e:
+        if key is not None:
+            await forget(key)
+        logger.error(f"Rejecting alert for receiver {new_alert.receiver}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Alertbot is overloaded, try again later!")
+    logger.info(f"Queued {len(jobs)} deliveries for receiver {new_alert.receiver}")
+
+    return 
@@ -0,0 +1,51 @@
+from alertbot.schemas import AlertRequestPrometheus
+from alertbot.env import DEDUP_WINDOW_SECONDS
+from utils.state_backend import get_state_backend, StateBackendError
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Keys of the webhooks accepted during the last DEDUP_WINDOW_SECONDS live under this prefix
+# of the state backend, with redis every replica sees them
+DEDUP_KEY_PREFIX = "dedup:"
+
+def dedup_key(alert_group: AlertRequestPrometheus) -> str:
+    """
+    Builds the key two notifications share when they carry the same alerts in the same state,
+    like the copies sent by both Alertmanager replicas of an HA pair or a retried webhook.
+
+    The key is the groupKey, the group status and a hash of the (fingerprint, status) set.
+    Alerts without a fingerprint use their labels instead.
+    """
+    pairs = sorted(
+        (alert.fingerprint or json.dumps(alert.labels, sort_keys=True), alert.status)
+        for alert in alert_group.alerts
+    )
+    digest = hashlib.sha1()
+    for fingerprint, status in pairs:
+        digest.update(f"{fingerprint}\x00{status}\x01".encode())
+    digest.update(str(alert_group.truncatedAlerts).encode())
+    group_key = alert_group.groupKey or alert_group.receiver
+    return f"{group_key}|{alert_group.status}|{digest.hexdigest()}"
+
+async def accept_once(key: str) -> bool:
+    """
+    Returns:
+        bool: False if a notification with the same key was accepted during the last
+            DEDUP_WINDOW_SECONDS. When the state backend is unreachable the notification
+            is accepted, a duplicate is better than a lost alert.
+    """
+    try:
+        return await get_state_backend().set_if_absent(DEDUP_KEY_PREFIX + key, ttl=DEDUP_WINDOW_SECONDS)
+    except StateBackendError as e:
+        logger.warning(f"Could not check for duplicates, accepting the notification: {e}")
+        return True
+
+async def forget(key: str):
+    """Let the next copy of a notification through, used when accepting it failed"""
+    try:
+        await get_state_backend().delete(DEDUP_KEY_PREFIX + key)
+    except StateBackendError as e:
+        logger.warning(f"Could not forget the dedup key {key}: {e}")
@@ -3,16 +3,20 @@ from templaters.sms_templater import SMSTemplater
 from handlers.sms_handler import SMSHandler
 from alertbot.schemas import AlertRequestPrometheus
 from alertbot.env import PHONE_SYNC_API_URL, PHONE_SYNC_API_ROUTE, \
-    LIMIT_SMS_NUMBER_PER_ALERT_GROUP, DEFAULT_SENDER
+    LIMIT_SMS_NUMBER_PER_ALERT_GROUP, DEFAULT_SENDER, \
+    PHONE_CACHE_TTL, PHONE_CACHE_STALE_TTL
 from alertbot.constants import SMS_LIMIT_ERROR_MESSAGE
 from utils.make_api_call import make_api_call
+from utils.async_cache import AsyncTTLCache
+from utils.state_backend import get_state_backend, StateBackendError
 from utils.metrics import alertbot_keycloak_group_members
+from utils.pipeline_timing import time_stage, TEMPLATE_STAGE, GET_NUMBERS_STAGE
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
-def generate_send_sms_alert(
+async def generate_send_sms_alert(
         alert_group: AlertRequestPrometheus,
         target: dict):
     """
@@ -21,7 +25,7 @@ def generate_send_sms_alert(
     This function will:
     1. Look up phone numbers for the given `target["keycloak_group_name"]`.
     2. Build SMS message bodies using `SMSTemplater`.
-    3. Send each message via `SMSHandler`, up to a maximum of `LIMIT_SMS_NUMBER_PER_ALERT_GROUP`.
+    3. Send the messages via `SMSHandler` in one batch, up to a maximum of `LIMIT_SMS_NUMBER_PER_ALERT_GROUP`.
        If there are more messages than the limit, a warning message will be sent indicating how many
        messages were suppressed.
 
@@ -40,45 +44,57 @@ def generate_send_sms_alert(
         None
     """
     group=target["keycloak_group_name"]
-    numbers = get_numbers([group])
+    numbers = await get_numbers([group])
     alertbot_keycloak_group_members.labels(group_name=group).set(len(numbers))
 
     
     logger.info(f"got numbers {numbers} for receiver {[group]}")
 
-    sms_templater = SMSTemplater(alert_group)
+    with time_stage(TEMPLATE_STAGE):
+        sms_templater = SMSTemplater(alert_group)
     
     messages = sms_templater.get_messages()
     cluster = sms_templater.get_cluster_name()
-    limit_reached = False
     logger.info(f"generated messages for sms: {messages}")
-    
-    sms_handler = SMSHandler()
-    for message_count, message in enumerate(messages):
-        if message_count == LIMIT_SMS_NUMBER_PER_ALERT_GROUP:
-            limit_reached = True
-            message = generate_limit_message(int(len(messages) - message_count), 
-                                                    sms_templater.get_alert_name())
-        sms_handler.send_sms(
-            receptors=numbers,
-            message=message,
-            sender=target.get("sender", DEFAULT_SENDER),
-            group=group,
-            cluster=cluster
-        )
-        if limit_reached:
-            break
-
-
-def get_numbers(receivers):
+
+    if len(messages) > LIMIT_SMS_NUMBER_PER_ALERT_GROUP:
+        messages = messages[:LIMIT_SMS_NUMBER_PER_ALERT_GROUP] + [
+            generate_limit_message(len(messages) - LIMIT_SMS_NUMBER_PER_ALERT_GROUP,
+                                   sms_templater.get_alert_name())]
+
+    await SMSHandler().send_messages(
+        receptors=numbers,
+        messages=messages,
+        sender=target.get("sender", DEFAULT_SENDER),
+        group=group,
+        cluster=cluster
+    )
+
+async def get_numbers(receivers):
     """
-    Fetches phone numbers from the phone synchronization API for the given receivers.
+    Returns the phone numbers of the given receivers, served from `phone_numbers_cache`.
     Args:
         receivers (list): A list of receiver identifiers for which phone numbers are to be fetched.
     Returns:
-        dict: A dictionary containing the fetched phone numbers or an error message if the request fails.
+        list: The phone numbers of all the receivers.
     Raises:
-        requests.exceptions.RequestException: If an error occurs while making the request to the phone synchronization API.
+        httpx.HTTPStatusError: If the numbers are not cached and the phone synchronization API
+            responds with a 4xx or 5xx status code.
+    """
+    with time_stage(GET_NUMBERS_STAGE):
+        # Copy it, the cached list is shared between callers
+        return list(await phone_numbers_cache.get(tuple(sorted(receivers))))
+
+
+async def fetch_numbers(receivers):
+    """
+    Fetches phone numbers from the phone synchronization API for the given receivers.
+    Args:
+        receivers (tuple): Receiver identifiers for which phone numbers are to be fetched.
+    Returns:
+        list: The valid phone numbers of all the receivers.
+    Raises:
+        httpx.HTTPStatusError: If the phone synchronization API responds with a 4xx or 5xx status code.
     """
     result = []
     headers = {
@@ -86,10 +102,10 @@ def get_numbers(receivers):
             'Content-Type': 'application/json'
     }
     body = json.dumps({
-        "receivers": receivers
+        "receivers": list(receivers)
     })
     logger.info(f"Calling Phone Sync API for receivers {receivers}")
-    response = make_api_call(
+    response = await make_api_call(
         method="GET",
         url=PHONE_SYNC_API_URL + PHONE_SYNC_API_ROUTE,
         headers=headers,
@@ -100,14 +116,50 @@ def get_numbers(receivers):
     # Raise an Error for 4xx and 5xx
     response.raise_for_status()
     
+    response_json = response.json()
     logger.info(f"Calling Phone Sync API Done {response.status_code}")
-    logger.debug(f"Respone body is as followed: {response.json()}")
+    logger.debug(f"Respone body is as followed: {response_json}")
 
-    result = create_numbers_list(response.json())
+    result = create_numbers_list(response_json)
 
     #Removing all the invalid numbers with length less than 10
     result_filtered = [number for number in result if len(number)>=10]
     return result_filtered
+
+
+async def load_numbers(receivers):
+    """
+    Loader of `phone_numbers_cache`: with a shared state backend, the numbers another replica
+    fetched during the last PHONE_CACHE_TTL seconds are used instead of calling the phone
+    synchronization API again. Falls back to `fetch_numbers` if the backend is unreachable.
+    """
+    backend = get_state_backend()
+    if not backend.shared:
+        return await fetch_numbers(receivers)
+    key = "phones:" + json.dumps(list(receivers))
+    try:
+        cached = await backend.get(key)
+    except StateBackendError as e:
+        logger.warning(f"Shared phone number cache unavailable: {e}")
+        return await fetch_numbers(receivers)
+    if cached is not None:
+        return json.loads(cached)
+    numbers = await fetch_numbers(receivers)
+    try:
+        await backend.set(key, json.dumps(numbers), ttl=PHONE_CACHE_TTL)
+    except StateBackendError as e:
+        logger.warning(f"Could not share the phone numbers of {receivers}: {e}")
+    return numbers
+
+
+# Keycloak groups -> numbers. During an incident the same few on-call groups are looked up
+# over and over, so serve them from memory and refresh in the background.
+phone_numbers_cache = AsyncTTLCache(
+    name="phone_numbers",
+    loader=load_numbers,
+    ttl=PHONE_CACHE_TTL,
+    stale_ttl=PHONE_CACHE_STALE_TTL
+)
     
 
 def create_numbers_list(response_json: dict = {}):
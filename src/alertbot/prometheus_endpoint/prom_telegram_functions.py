@@ -1,19 +1,34 @@
 from templaters.telegram_templater import TelegramTemplater
-from handlers.telegram_handler import TelegramHandler, TelegramHandlerAPI
+from handlers.telegram_handler import TelegramHandler, TelegramHandlerAPI, TelegramBatcher
+from handlers.telegram_handler.rate_limiter import priority_for_severity
 from alertbot.schemas import AlertRequestPrometheus
 from .. import globals as globs
 from alertbot.env import TELEGRAM_MODE
+from services.alertmanager import silence_alertmanager_url
+from utils.pipeline_timing import time_stage, TEMPLATE_STAGE
 import logging
 
 
 logger = logging.getLogger()
 
+def silence_target(alert: AlertRequestPrometheus):
+    """
+    The labels the silence button of an alert group silences and the Alertmanager to ask,
+    (None, None) if the group can't be silenced: no labels, or neither ALERTMANAGER_URL nor
+    an externalURL listed in ALERTMANAGER_ALLOWED_URLS.
+    """
+    alertmanager_url = silence_alertmanager_url(alert.externalURL)
+    labels = alert.commonLabels or alert.groupLabels
+    if not labels or alertmanager_url is None:
+        return None, None
+    return labels, alertmanager_url
+
 def find_alert_receiver(alert: AlertRequestPrometheus):
     logger.debug(f"Looking for a match for receiver {alert.receiver}")
-    for dest in globs.configs["destinations"]:
-        if dest["receiver"].lower() ==  alert.receiver and \
-           dest["severity"] in alert.alerts[0].labels["severity"].lower():
-            return dest
+    dest = globs.snapshot.routing_index.lookup(alert.receiver,
+                                               alert.alerts[0].labels["severity"].lower())
+    if dest is not None:
+        return dest
     logger.error(f"No receiver match found for receiver {alert.receiver}!")
     return None
 
@@ -34,11 +49,21 @@ async def generate_send_telegram_alert(
             Configuration for where and how to send:
               - "telegram_group_id" (str): Telegram chat ID to deliver the alert.
               - "silencer" (bool, optional): If True, include a silencer button via `send_alert_message`.
+                                         It silences the common labels of the group in
+                                         ALERTMANAGER_URL (or the externalURL of the webhook if
+                                         it is in ALERTMANAGER_ALLOWED_URLS), the message is sent
+                                         without a button when there is no such Alertmanager.
                                          Defaults to False.
+              - "batch_window_ms" (int, optional): If set, hold the message that long and send it
+                                         together with other alert groups for the same chat and topic.
+                                         Only used in API mode. The message is held as one
+                                         rendered text for the window, and the delivery waits
+                                         until the batch was sent.
     Returns:
         None
     """
-    telegram_templater = TelegramTemplater(alert_group = alert)
+    with time_stage(TEMPLATE_STAGE):
+        telegram_templater = TelegramTemplater(alert_group = alert)
     silencer_active = target.get("silencer", False)
     telegram_metrics_labels = {
         "receiver": alert.receiver,
@@ -47,20 +72,47 @@ async def generate_send_telegram_alert(
     }
     logger.info("generated alert message for telegram successfully!")
 
-    logger.debug(telegram_templater.get_message())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(telegram_templater.get_message())
     if TELEGRAM_MODE.lower() == "bot" and silencer_active:
+        silence_labels, alertmanager_url = silence_target(alert)
+        if silence_labels is None:
+            # A button that can't silence anything would only mislead
+            logger.warning(f"Sending alert telegram for {alert.receiver} without silencer button, " +
+                           "no configured Alertmanager can silence it")
+            await TelegramHandler().\
+                send_message(chat_id=target["telegram_group_id"],
+                             parts=telegram_templater.iter_parts(),
+                             message_thread_id=target.get("telegram_topic_id", None),
+                             priority=priority_for_severity(telegram_templater.get_severity()))
+            return
         logger.info(f"Sending alert telegram for {alert.receiver} with silencer button...")
         await TelegramHandler().\
             send_alert_message(chat_id=target["telegram_group_id"], 
-                                text=telegram_templater.get_message(),
-                                message_thread_id=target.get("telegram_topic_id", None))
+                                # Split between alerts, and rendered while it is sent
+                                parts=telegram_templater.iter_parts(),
+                                message_thread_id=target.get("telegram_topic_id", None),
+                                priority=priority_for_severity(telegram_templater.get_severity()),
+                                silence_labels=silence_labels,
+                                alertmanager_url=alertmanager_url)
             
     elif TELEGRAM_MODE.lower() != "bot":
         if silencer_active:
             logger.warning(f"Sending alert telegram for {alert.receiver} is being sent via API because TELEGRAM_MODE is not 'bot'")
+        batch_window_ms = target.get("batch_window_ms", 0)
+        if batch_window_ms:
+            logger.info(f"Batching alert telegram for {alert.receiver} for {batch_window_ms}ms...")
+            # Delivered once the batch is sent, so its failures are handled like any other
+            await TelegramBatcher().add(chat_id=target["telegram_group_id"],
+                                        text=telegram_templater.get_message(),
+                                        window_ms=batch_window_ms,
+                                        message_thread_id=target.get("telegram_topic_id", None),
+                                        telegram_metrics_labels=telegram_metrics_labels)
+            return
         logger.info(f"Sending alert telegram for {alert.receiver} without silencer button...")
-        TelegramHandlerAPI().\
-            send_message(chat_id=target["telegram_group_id"],
-                        text=telegram_templater.get_message(),
-                        message_thread_id=target.get("telegram_topic_id", None),
-                        telegram_metrics_labels=telegram_metrics_labels)
\ No newline at end of file
+        # Rendered while it is sent, a large group never exists as one string
+        await TelegramHandlerAPI().\
+            send_parts(chat_id=target["telegram_group_id"],
+                       parts=telegram_templater.iter_parts(),
+                       message_thread_id=target.get("telegram_topic_id", None),
+                       telegram_metrics_labels=telegram_metrics_labels)
\ No newline at end of file
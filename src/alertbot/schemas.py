@@ -15,5 +15,9 @@ class AlertRequestPrometheus(BaseModel):
     receiver: str = "Default"
     status: str = "firing default"
     alerts: List[AlertPrometheus] = []
+    groupLabels: dict = {}
     commonLabels: dict = {}
-    commonAnnotations: dict = {}
\ No newline at end of file
+    commonAnnotations: dict = {}
+    externalURL: str = ""
+    groupKey: str = ""
+    truncatedAlerts: int = 0
\ No newline at end of file
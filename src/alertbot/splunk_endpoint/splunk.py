@@ -1,15 +1,12 @@
 from fastapi import status, APIRouter, HTTPException, Request
-from alertbot.constants import TELEGRAM_CONFIG_WORD, SMS_CONFIG_WORD 
-from alertbot.env import ACTIVE_TELEGRAM, ACTIVE_SMS, DEFAULT_SENDER
+from alertbot.constants import TELEGRAM_CONFIG_WORD, SMS_CONFIG_WORD, SPLUNK_SOURCE
+from alertbot.env import ACTIVE_TELEGRAM, ACTIVE_SMS, ASYNC_DELIVERY
+from alertbot.delivery import DeliveryQueue, DeliveryJob, deliver_all
+from alertbot.delivery.exceptions import DeliveryQueueFull
+from alertbot.ingestion import read_body, parse_splunk
+from utils.pipeline_timing import time_stage, PARSE_STAGE, ROUTING_STAGE
 from .. import globals as globs
-from .splunk_functions import (
-    generate_telegram_splunk_body,
-    generate_sms_splunk_body,
-    send_telegram_splunk_message,
-    send_sms_splunk_message
-)
 import logging
-import json
 
 router = APIRouter(
     prefix="/api/v2/alerts/splunk",
@@ -21,7 +18,7 @@ logger = logging.getLogger()
 def find_alert_subtroute(subroute: str):
     if subroute == "":
         return None
-    dests = globs.splunk_configs.get("destinations", [])
+    dests = globs.snapshot.splunk_configs.get("destinations", [])
     logger.debug(f"Looking for a splunk match for subroute {subroute}")
     for dest in dests:
         if dest.get("subroute", "").lower() == subroute:
@@ -36,43 +33,44 @@ async def send_alert(
     ):
     logger.info(f"Received Splunk alert on route: /api/v2/alerts/splunk/{route_path}")
     
-    # Get the body content
-    body = await request.body()
+    body = await read_body(request)
     
-    try:
-        body_dict = json.loads(body.decode('utf-8')) if body else {}
-    except json.JSONDecodeError:
-        body_dict = {"raw_body": body.decode('utf-8') if body else 'Empty body'}
+    with time_stage(PARSE_STAGE, receiver_class=SPLUNK_SOURCE):
+        body_dict = parse_splunk(body)
 
-    dest = find_alert_subtroute(route_path)
+    with time_stage(ROUTING_STAGE, receiver_class=SPLUNK_SOURCE):
+        dest = find_alert_subtroute(route_path)
     if not dest:
         logger.warning(f"Route {route_path} is not configured in Splunk.")
         logger.warning(f"here is the body of the message received for better troubleshooting: ")
         logger.warning(f"{body_dict}")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Route {route_path} not found.")
 
+    jobs = []
+    payload = {"keys": dest["keys"], "body": body_dict, "route_path": route_path}
     for types in dest.get("types", []):
         if types.get("type") == TELEGRAM_CONFIG_WORD:
-            message = generate_telegram_splunk_body(dest["keys"], body_dict)
-            logger.debug(f"Generated Telegram message: {message}")
             if ACTIVE_TELEGRAM:
-                await send_telegram_splunk_message(
-                    message, 
-                    types["telegram_group_id"], 
-                    types.get("telegram_topic_id", None),
-                    route_path
-                    )
+                jobs.append(DeliveryJob(source=SPLUNK_SOURCE, channel=TELEGRAM_CONFIG_WORD,
+                                        target=types, payload=payload, receiver=route_path))
             else:
                 logger.error("Telegram is not active to send telegram alert.")
 
         elif types.get("type") == SMS_CONFIG_WORD:
-            message = generate_sms_splunk_body(dest["keys"], body_dict)
-            logger.info(f"Generated SMS message: {message}")
             if ACTIVE_SMS:
-                send_sms_splunk_message(
-                    message,
-                    types["keycloak_group_name"],
-                    types.get("sender", DEFAULT_SENDER)
-                )
+                jobs.append(DeliveryJob(source=SPLUNK_SOURCE, channel=SMS_CONFIG_WORD,
+                                        target=types, payload=payload, receiver=route_path))
             else:
-                logger.error("SMS is not active to send SMS alert.")
\ No newline at end of file
+                logger.error("SMS is not active to send SMS alert.")
+
+    if not ASYNC_DELIVERY:
+        await deliver_all(jobs)
+        return
+
+    try:
+        await DeliveryQueue().enqueue(jobs)
+    except DeliveryQueueFull as e:
+        logger.error(f"Rejecting splunk alert for route {route_path}: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Alertbot is overloaded, try again later!")
+    logger.info(f"Queued {len(jobs)} deliveries for splunk route {route_path}")
@@ -5,22 +5,92 @@ from alertbot.env import (
     TG_BOT_TOKEN, TG_SEND_RETRIES, 
     TG_SEND_RETRY_DELAY, ACTIVE_TELEGRAM, 
     KAVENEGAR_API_KEY, ACTIVE_SMS, TELEGRAM_MODE,
-    TIMEZONE, CONFIG_RELOADER_INTERVAL)
-from alertbot.alertbot_config_manager import ConfigManager
-from handlers.telegram_handler import TelegramHandler, TelegramHandlerAPI
+    TIMEZONE, CONFIG_RELOADER_INTERVAL, ASYNC_DELIVERY,
+    CONFIG_JSON_FILE, CONFIG_SPLUNK_JSON_FILE,
+    CONFIG_WATCHER_ENABLED, CONFIG_WATCHER_DEBOUNCE_MS,
+    DELIVERY_WORKERS, DELIVERY_QUEUE_SIZE, DELIVERY_SHUTDOWN_TIMEOUT,
+    OUTBOX_ENABLED, OUTBOX_PATH, OUTBOX_COMMIT_INTERVAL_MS, OUTBOX_RETENTION_SECONDS,
+    OUTBOX_MAX_ROWS, OUTBOX_MAX_REPLAYS, OUTBOX_COMPACT_INTERVAL, CONFIG_SNAPSHOT_WAIT)
+from alertbot.alertbot_config_manager import ConfigManager, ConfigWatcher, SharedSnapshot
+from alertbot.workers import multi_worker, leader_lock, mark_worker_dead, CONFIG_SNAPSHOT_FILE
+from handlers.telegram_handler import TelegramHandler, TelegramHandlerAPI, TelegramBatcher
 from handlers.sms_handler import SMSHandler
+from services.silencer import Silencer
+from alertbot.delivery import DeliveryQueue, Outbox
+from utils.make_api_call import close_http_clients
+from utils.state_backend import close_state_backend
+from utils.logger import setup_logging
+import asyncio
 import logging
+import threading
+import time
 import alertbot.globals as globs
 
 logger = logging.getLogger(__name__)
 
+config_manager = ConfigManager()
+config_lock = threading.Lock()
+config_watcher = None
+shared_snapshot = SharedSnapshot(CONFIG_SNAPSHOT_FILE)
+leading = False
+event_loop = None
+
 def refresh_config():
-    "Reload Configuration From File"
-    config_manager = ConfigManager()
-    config_manager.read_alertbot_configs()
-    config_manager.read_alertbot_splunk_configs()
-    globs.configs = config_manager.get_alertbot_config()
-    globs.splunk_configs = config_manager.get_alertbot_splunk_config()
+    "Reload Configuration From File if it has changed"
+    # Both the scheduler and the watcher threads call this
+    with config_lock:
+        if multi_worker() and not leader_lock.try_acquire():
+            follow_leader_config()
+            return
+        if config_manager.reload_if_changed():
+            globs.snapshot = config_manager.get_snapshot()
+            logger.info(f"Loaded config version {globs.snapshot.version}")
+            if multi_worker():
+                shared_snapshot.write(globs.snapshot)
+        else:
+            logger.debug("Config files have not changed, skipping reload")
+        if multi_worker() and not leading:
+            become_leader()
+
+def follow_leader_config():
+    "Load the config snapshot the leader worker published, if it is a new one"
+    snapshot = shared_snapshot.read_if_changed()
+    if snapshot is not None and snapshot.version != globs.snapshot.version:
+        globs.snapshot = snapshot
+        logger.info(f"Loaded config version {snapshot.version} from the leader worker")
+
+def become_leader():
+    "Takes over the duties of the leader worker, when starting up or when the previous leader exited"
+    global leading
+    leading = True
+    shared_snapshot.write(globs.snapshot)
+    if ACTIVE_TELEGRAM and TELEGRAM_MODE.lower() == "bot" and TelegramHandler._instance is not None:
+        # Called from the scheduler thread, polling belongs on the event loop
+        asyncio.run_coroutine_threadsafe(TelegramHandler().setup_updates(), event_loop)
+
+async def wait_for_leader_config(timeout: float = CONFIG_SNAPSHOT_WAIT):
+    "Workers started together with the leader wait for its first snapshot before serving"
+    deadline = time.monotonic() + timeout
+    while not globs.snapshot.version and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        refresh_config()
+    if not globs.snapshot.version:
+        logger.warning(f"No config from the leader worker after {timeout} seconds, reading the config files")
+        with config_lock:
+            config_manager.reload_if_changed()
+            globs.snapshot = config_manager.get_snapshot()
+
+def setup_config_watcher():
+    global config_watcher
+    config_watcher = ConfigWatcher(
+        # Workers that are not the leader only need the shared snapshot, but any of them may become it
+        paths=[CONFIG_JSON_FILE, CONFIG_SPLUNK_JSON_FILE] + ([CONFIG_SNAPSHOT_FILE] if multi_worker() else []),
+        callback=refresh_config,
+        debounce_ms=CONFIG_WATCHER_DEBOUNCE_MS
+    )
+    if not config_watcher.start():
+        logger.warning(f"Config changes are only picked up every {CONFIG_RELOADER_INTERVAL} seconds")
+        config_watcher = None
 
 def setup_job_config_reloader():
     logger.info("Setting up auto-reloader...")
@@ -43,7 +113,12 @@ async def setup_telegram_bot(logger):
     try:
         logger.info("Starting telegram bot")
         bot = TelegramHandler(TG_BOT_TOKEN, retries=TG_SEND_RETRIES, delay=TG_SEND_RETRY_DELAY)
-        await bot.setup_polling()
+        if multi_worker() and not leading:
+            # Telegram only lets one client poll the updates of a bot, with a webhook every
+            # worker handles them but one is enough to register it
+            logger.info("Telegram polling or webhook registration is left to the leader worker")
+            return
+        await bot.setup_updates()
     except Exception as e:
         logger.error("Failed to setup Telegram bot")
         logger.error("Error: ", e)
@@ -55,15 +130,38 @@ def setup_telegram_api(logger):
         logger.error("Failed to setup Telegram api")
         logger.error("Error: ", e)
 
+async def setup_outbox(logger):
+    logger.info(f"Opening delivery outbox {OUTBOX_PATH}")
+    outbox = Outbox(
+        path=OUTBOX_PATH,
+        commit_interval_ms=OUTBOX_COMMIT_INTERVAL_MS,
+        retention_seconds=OUTBOX_RETENTION_SECONDS,
+        max_rows=OUTBOX_MAX_ROWS,
+        max_replays=OUTBOX_MAX_REPLAYS,
+        compact_interval=OUTBOX_COMPACT_INTERVAL
+    )
+    await outbox.open()
+    return outbox
+
 @asynccontextmanager
 async def lifespan(app):
     # Starting up code
+    global event_loop
+    if multi_worker():
+        # Worker processes import main.py as a module, its logging setup is not run
+        setup_logging()
     logger.info("Application's logger started, Starting application...")
+    event_loop = asyncio.get_running_loop()
     setup_job_config_reloader()
+    if multi_worker() and not leading:
+        await wait_for_leader_config()
+    if CONFIG_WATCHER_ENABLED:
+        setup_config_watcher()
     
     if ACTIVE_TELEGRAM:
         if TELEGRAM_MODE.lower() == "bot":
             await setup_telegram_bot(logger=logger)
+            Silencer().start()
         elif TELEGRAM_MODE.lower() == "api":
             setup_telegram_api(logger=logger)
         else:
@@ -74,6 +172,24 @@ async def lifespan(app):
         SMSHandler(api_key=KAVENEGAR_API_KEY)
     else:
         logger.warning("ACTIVE_SMS env is not set. no alerts will be sent by SMS!")
+    if ASYNC_DELIVERY:
+        outbox = await setup_outbox(logger=logger) if OUTBOX_ENABLED else None
+        DeliveryQueue(workers=DELIVERY_WORKERS, max_size=DELIVERY_QUEUE_SIZE, outbox=outbox).start()
+    else:
+        logger.warning("ASYNC_DELIVERY env is not set. alerts will be sent inside the webhook request!")
+        if OUTBOX_ENABLED:
+            logger.warning("OUTBOX_ENABLED only applies to ASYNC_DELIVERY, the outbox is not used!")
     yield  
     # finishing code
-    logger.info("Finishing application...")
\ No newline at end of file
+    logger.info("Finishing application...")
+    if ASYNC_DELIVERY:
+        await DeliveryQueue().stop(timeout=DELIVERY_SHUTDOWN_TIMEOUT)
+    await TelegramBatcher().flush_all()
+    await Silencer().stop()
+    await close_http_clients()
+    await close_state_backend()
+    if config_watcher is not None:
+        config_watcher.stop()
+    if multi_worker():
+        leader_lock.release()
+        mark_worker_dead()
\ No newline at end of file
@@ -0,0 +1,38 @@
+from fastapi import status, APIRouter, HTTPException, Request
+from alertbot.env import TG_WEBHOOK_SECRET
+from alertbot.ingestion import read_body
+from handlers.telegram_handler.telegram_handler import TelegramHandler
+import hmac
+import logging
+import orjson
+
+# Telegram posts the updates of the bot here when TG_WEBHOOK_URL is set, see TelegramHandler.setup_webhook
+router = APIRouter(
+    prefix="/api/v2/telegram",
+    tags=["Telegram"]
+)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+logger = logging.getLogger()
+
+@router.post("/webhook", status_code=status.HTTP_204_NO_CONTENT)
+async def receive_update(request: Request):
+    secret = request.headers.get(SECRET_TOKEN_HEADER, "")
+    if not TG_WEBHOOK_SECRET or not hmac.compare_digest(secret.encode(), TG_WEBHOOK_SECRET.encode()):
+        logger.warning("Refusing a telegram update without the webhook secret token")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid secret token!")
+
+    body = await read_body(request)
+    try:
+        update = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        update = None
+    if not isinstance(update, dict):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The update is not a JSON object!")
+
+    try:
+        await TelegramHandler().process_update(update)
+    except Exception as e:
+        # Telegram would post the update again, but the button press can't be answered any better
+        logger.error(f"Failed to process telegram update {update.get('update_id')}: {e}")
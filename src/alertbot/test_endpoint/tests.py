@@ -27,7 +27,7 @@ async def root():
 async def test_sms_bulk():
     try:
         sms_sender = SMSHandler(api_key=env.KAVENEGAR_API_KEY)
-        sms_sender.send_sms(
+        await sms_sender.send_sms(
             sender="2000008700",
             receptors=["NUMBER1", "NUMBER2"], 
             message="Hello World From Alertbot Bulk",
@@ -0,0 +1,89 @@
+"""
+Support for running alertbot in several worker processes (WORKERS > 1).
+
+The workers of one host share RUNTIME_DIR: one of them holds the leader lock, reloads the
+config files and publishes the snapshot the others load, and owns the Telegram polling.
+Metrics of all workers are aggregated by prometheus_client's multiprocess mode.
+"""
+from alertbot.env import WORKERS, RUNTIME_DIR, STATE_BACKEND
+import fcntl
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+LEADER_LOCK_FILE = os.path.join(RUNTIME_DIR, "leader.lock")
+CONFIG_SNAPSHOT_FILE = os.path.join(RUNTIME_DIR, "config-snapshot.json")
+PROMETHEUS_DIRECTORY = os.path.join(RUNTIME_DIR, "prometheus")
+
+def multi_worker() -> bool:
+    return WORKERS > 1
+
+def worker_share(limit: float) -> float:
+    """
+    The part of a host wide limit (e.g. Telegram's rate limits) one worker may use. With the
+    redis state backend the limit is counted there for everyone, so each worker gets all of it.
+    """
+    if STATE_BACKEND == "redis":
+        return limit
+    return limit / max(1, WORKERS)
+
+def prepare_runtime_dir():
+    """
+    Called by the parent process before the workers are started. Clears what a previous
+    run left behind and points prometheus_client at a directory shared by the workers,
+    the workers inherit the environment.
+    """
+    os.makedirs(RUNTIME_DIR, exist_ok=True)
+    if os.path.exists(CONFIG_SNAPSHOT_FILE):
+        os.remove(CONFIG_SNAPSHOT_FILE)
+    directory = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", PROMETHEUS_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            os.remove(os.path.join(directory, name))
+    logger.info(f"Starting {WORKERS} workers, metrics are collected in {directory}")
+
+def mark_worker_dead():
+    """Drop the live gauges of this worker from the shared metrics, used on shutdown"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class LeaderLock:
+    """
+    An flock on a file in RUNTIME_DIR. The kernel releases it when the holder exits,
+    so another worker takes over the next time it tries.
+    """
+
+    def __init__(self, path: str = LEADER_LOCK_FILE):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        """Returns True if this process is the leader, never blocks"""
+        if self._file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        file = open(self.path, "a")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        self._file = file
+        logger.info(f"Worker {os.getpid()} is the leader")
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+leader_lock = LeaderLock()
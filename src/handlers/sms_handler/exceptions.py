@@ -8,5 +8,7 @@ class SMSValidationError(SMSError):
     pass
 
 class SMSSendError(SMSError):
-    """Raised when SMS sending fails"""
-    pass
+    """Raised when SMS sending fails, `retriable` is False when Kavenegar rejected the request"""
+    def __init__(self, message: str = "", retriable: bool = True):
+        super().__init__(message)
+        self.retriable = retriable
@@ -0,0 +1,145 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+from utils.make_api_call import make_api_call
+from utils.pipeline_timing import time_stage, SEND_ATTEMPT_STAGE
+from alertbot.env import KAVENEGAR_API_URL, KAVENEGAR_MAX_RECEPTORS, DEFAULT_SENDER
+from .exceptions import SMSSendError
+from urllib.parse import urlsplit
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+API_VERSION = "v1"
+
+@dataclass
+class Chunk:
+    """
+    One request worth of SMS: `messages[i]` is sent from `senders[i]` to `receptors[i]`.
+    A chunk with a single message for every receptor is sent with sms/send.json,
+    anything else with sms/sendarray.json.
+    """
+    receptors: List[str]
+    messages: List[str]
+    senders: List[Optional[str]]
+    sent: bool = False
+    error: Optional[Exception] = field(default=None, repr=False)
+
+    @property
+    def retriable(self) -> bool:
+        """False once Kavenegar rejected the chunk or its circuit is open, sending it again won't help"""
+        return self.error is None or getattr(self.error, "retriable", True)
+
+    @property
+    def single_message(self) -> bool:
+        return len(set(self.messages)) == 1 and len(set(self.senders)) == 1
+
+def _receptor_groups(chunks: List[Chunk]) -> List[List[Chunk]]:
+    """The chunks split into groups that share no receptor, each group keeping the order of `chunks`"""
+    groups = []     # group index -> chunks, None once merged into another group
+    by_receptor = {}  # receptor -> group index
+    for chunk in chunks:
+        found = sorted({by_receptor[receptor] for receptor in chunk.receptors if receptor in by_receptor})
+        if not found:
+            index = len(groups)
+            groups.append([])
+        else:
+            index = found[0]
+            for other in found[1:]:
+                groups[index].extend(groups[other])
+                for receptor in {receptor for merged in groups[other] for receptor in merged.receptors}:
+                    by_receptor[receptor] = index
+                groups[other] = None
+        groups[index].append(chunk)
+        for receptor in chunk.receptors:
+            by_receptor[receptor] = index
+    return [group for group in groups if group is not None]
+
+class KavenegarClient:
+    """
+    Async Kavenegar client on top of the shared HTTP client of `make_api_call`.
+
+    Recipient lists are split into chunks of at most `max_receptors` (the per request
+    limit of Kavenegar). Chunks that share a receptor are sent one after the other so every
+    receptor gets its messages in order, chunks for other receptors are sent concurrently.
+    Every chunk reports whether it was sent so a retry only repeats the chunks that failed.
+    """
+
+    def __init__(self, api_key: str,
+                 base_url: str = KAVENEGAR_API_URL,
+                 max_receptors: int = KAVENEGAR_MAX_RECEPTORS):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.host = urlsplit(self.base_url).netloc
+        self.max_receptors = max(1, int(max_receptors))
+
+    def chunks(self, receptors: List[str], messages: List[str], sender: Optional[str] = None) -> List[Chunk]:
+        """Every message to every receptor, packed into requests of at most `max_receptors` SMS"""
+        pairs = [(receptor, message) for message in messages for receptor in receptors]
+        return [Chunk(receptors=[receptor for receptor, _ in part],
+                      messages=[message for _, message in part],
+                      senders=[sender] * len(part))
+                for part in (pairs[start:start + self.max_receptors]
+                             for start in range(0, len(pairs), self.max_receptors))]
+
+    async def send(self, chunks: List[Chunk]) -> List[Chunk]:
+        """
+        Send the chunks that are neither sent nor rejected yet, in order for every receptor.
+        Never raises for a failed chunk, check `Chunk.sent` and `Chunk.error` instead.
+        """
+        pending = [chunk for chunk in chunks if not chunk.sent and chunk.retriable]
+        await asyncio.gather(*(self._send_in_order(group) for group in _receptor_groups(pending)))
+        return chunks
+
+    async def _send_in_order(self, chunks: List[Chunk]):
+        for chunk in chunks:
+            await self._send_chunk(chunk)
+            if not chunk.sent and chunk.retriable:
+                # The next chunks wait for the retry of this one, not to arrive before it
+                break
+
+    async def _send_chunk(self, chunk: Chunk):
+        try:
+            if chunk.single_message:
+                params = {"receptor": ",".join(chunk.receptors), "message": chunk.messages[0]}
+                if chunk.senders[0]:
+                    params["sender"] = chunk.senders[0]
+                await self._call("sms", "send", params)
+            else:
+                params = {"receptor": json.dumps(chunk.receptors),
+                          "message": json.dumps(chunk.messages, ensure_ascii=False)}
+                senders = [sender or DEFAULT_SENDER for sender in chunk.senders]
+                if all(senders):
+                    params["sender"] = json.dumps(senders)
+                await self._call("sms", "sendarray", params)
+        except Exception as e:
+            chunk.error = e
+            logger.error(f"Kavenegar failed to send {len(chunk.receptors)} SMS: {e}")
+        else:
+            chunk.sent = True
+            chunk.error = None
+
+    async def _call(self, action: str, method: str, params: dict) -> list:
+        """
+        Returns the `entries` of the answer.
+
+        Raises:
+            SMSSendError: If the request failed, not retriable when Kavenegar rejected it (4xx).
+            CircuitOpenError: If the circuit of the Kavenegar host is open.
+        """
+        url = f"{self.base_url}/{API_VERSION}/{self.api_key}/{action}/{method}.json"
+        with time_stage(SEND_ATTEMPT_STAGE):
+            # Retries are made per chunk by the caller
+            response = await make_api_call(method="POST", url=url, payload=params, retry_count=1)
+        if response is None:
+            raise SMSSendError(f"No response was received from {self.host}")
+        try:
+            result = response.json()
+            status, message = result["return"]["status"], result["return"]["message"]
+        except (ValueError, KeyError, TypeError):
+            raise SMSSendError(f"Unexpected answer from {self.host} with status code {response.status_code}")
+        if status != 200:
+            # Kavenegar answers bad requests (invalid receptor, sender, credit...) with 4xx statuses
+            raise SMSSendError(f"APIException[{status}] {message}", retriable=not 400 <= status < 500)
+        return result.get("entries") or []
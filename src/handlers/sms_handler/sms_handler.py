@@ -1,12 +1,13 @@
-from kavenegar import KavenegarAPI
 from typing import Optional, List
 import logging
 from utils.retry import retry_on_failure
+from utils.metric_labels import sms_number_label, sms_number_metric_enabled
 from utils.metrics import (
     alertbot_sent_sms_per_cluster_counter, 
     alertbot_failed_sent_sms_per_cluster_counter, 
     alertbot_sent_sms_per_number_counter)
 from .exceptions import SMSValidationError, SMSSendError
+from .kavenegar_client import KavenegarClient, Chunk
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +26,7 @@ class SMSHandler:
                 raise SMSValidationError("API key cannot be empty")
             cls._instance = super(SMSHandler, cls).__new__(cls)
             instance = cls._instance
-            instance.api = KavenegarAPI(api_key)
+            instance.api = KavenegarClient(api_key)
 
         return cls._instance
     
@@ -43,8 +44,7 @@ class SMSHandler:
         return bool(message and len(message.strip()) > 0)
 
 
-    @retry_on_failure()
-    def send_sms(self, 
+    async def send_sms(self, 
                 receptors: List[str], 
                 message: str, 
                 sender: Optional[str] = None,
@@ -65,37 +65,73 @@ class SMSHandler:
             SMSValidationError: If input validation fails
             SMSSendError: If sending fails
         """
+        return await self.send_messages(receptors=receptors, messages=[message],
+                                        sender=sender, group=group, cluster=cluster)
+
+    async def send_messages(self,
+                receptors: List[str],
+                messages: List[str],
+                sender: Optional[str] = None,
+                group: Optional[str] = None,
+                cluster: Optional[str] = None) -> bool:
+        """
+        Send every message to every recipient. Recipients are split into requests of at most
+        KAVENEGAR_MAX_RECEPTORS SMS that are sent concurrently, several messages are sent
+        together with Kavenegar's sendarray.
+        
+        Args:
+            receptors (List[str]): List of recipient phone numbers
+            messages (List[str]): Messages content, in the order they should arrive
+            sender (str, optional): Sender number
+        
+        Returns:
+            bool: True if every SMS was sent successfully
+        
+        Raises:
+            SMSValidationError: If input validation fails
+            SMSSendError: If sending some of the requests failed after the retries
+        """
         
         alertbot_sent_sms_per_cluster_counter.labels(
             group_name=group,
-            cluster=cluster).inc()
+            cluster=cluster).inc(len(messages))
         if not receptors:
             raise SMSValidationError("Receptors list cannot be empty")
 
+        count_numbers = sms_number_metric_enabled()
         for receptor in receptors:
-            alertbot_sent_sms_per_number_counter.labels(
-                number=receptor,
-                group_name=group,
-                cluster=cluster
-            ).inc()
+            if count_numbers:
+                alertbot_sent_sms_per_number_counter.labels(
+                    number=sms_number_label(receptor),
+                    group_name=group,
+                    cluster=cluster
+                ).inc(len(messages))
             if not self._validate_phone_number(receptor):
                 raise SMSValidationError(f"Invalid phone number: {receptor}")
 
-        if not self._validate_message(message):
+        if not messages or not all(self._validate_message(message) for message in messages):
             raise SMSValidationError("Message cannot be empty")
 
+        chunks = self.api.chunks(receptors, messages, sender)
         try:
-            self.api.sms_send({
-                'receptor': ','.join(receptors),
-                'message': message,
-                'sender': sender
-            })
-            logger.info(f"Bulk SMS sent successfully to {len(receptors)} recipients")
-            return True
+            await self._send_chunks(chunks)
         except Exception as e:
             alertbot_failed_sent_sms_per_cluster_counter.labels(
                 group_name=group,
                 cluster=cluster).inc()
-            logger.error(f"error happened during sending to sms for message: \n {message}")
+            logger.error(f"error happened during sending to sms for messages: \n {messages}")
             logger.error(f"Error sending bulk SMS: {str(e)}")
-            raise SMSSendError(f"Failed to send bulk SMS: {str(e)}")
\ No newline at end of file
+            raise
+        logger.info(f"Bulk SMS sent successfully to {len(receptors)} recipients " +
+                    f"({len(messages)} messages in {len(chunks)} requests)")
+        return True
+
+    @retry_on_failure(name="kavenegar", non_retriable=(SMSValidationError,))
+    async def _send_chunks(self, chunks: List[Chunk]):
+        """Send the chunks that were not sent yet, every retry only repeats the failed ones"""
+        await self.api.send(chunks)
+        failed = [chunk for chunk in chunks if not chunk.sent]
+        if failed:
+            raise SMSSendError(
+                f"Failed to send bulk SMS, {len(failed)} of {len(chunks)} requests failed: {failed[0].error}",
+                retriable=any(chunk.retriable for chunk in failed))
@@ -1,2 +1,3 @@
 from handlers.telegram_handler.telegram_handler import TelegramHandler
-from handlers.telegram_handler.telegram_handler_api import TelegramHandlerAPI
\ No newline at end of file
+from handlers.telegram_handler.telegram_handler_api import TelegramHandlerAPI
+from handlers.telegram_handler.telegram_batcher import TelegramBatcher
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""
+Splits Telegram messages (HTML parse mode) into chunks of at most TELEGRAM_MAX_MESSAGE_LENGTH.
+
+Chunks are cut between alerts when possible, else at a newline, a space or, for a word
+longer than a chunk, anywhere in it. Tags and entities are never cut: the tags open at a
+cut are closed at the end of the chunk and opened again at the start of the next one, so
+every chunk is valid HTML for Telegram.
+
+The text is read once. The tail after a cut is read again for the next chunk, but a cut
+only goes back to a better break point if that keeps the chunk at least half full, so
+this stays linear in the size of the message.
+"""
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
+import re
+
+# Tags, entities, newlines and runs of text. Runs are bounded so cutting one stays cheap,
+# a `<` or `&` that starts neither a tag nor an entity is taken as text on its own.
+TOKEN_PATTERN = re.compile(r"<[^<>]*>|&#?\w+;|\n|[^<&\n]{1,512}|.", re.DOTALL)
+TAG_NAME_PATTERN = re.compile(r"</?([a-zA-Z][\w-]*)")
+
+TAG, ENTITY, NEWLINE, TEXT, PART_END = range(5)
+
+# Break points, a higher one is preferred
+ALERT_BREAK = 3
+LINE_BREAK = 2
+SPACE_BREAK = 1
+_BREAKS = (ALERT_BREAK, LINE_BREAK, SPACE_BREAK)
+
+
+def _tokens(parts: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    for part in parts:
+        for token in TOKEN_PATTERN.findall(part):
+            first = token[0]
+            if first == "<" and len(token) > 1 and TAG_NAME_PATTERN.match(token):
+                yield TAG, token
+            elif first == "&" and len(token) > 1:
+                yield ENTITY, token
+            elif token == "\n":
+                yield NEWLINE, token
+            else:
+                yield TEXT, token
+        yield PART_END, ""
+
+
+def _closing_tags(stack: tuple) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+
+def _opening_tags(stack: tuple) -> str:
+    return "".join(tag for _, tag in stack)
+
+
+def _apply_tag(stack: tuple, tag: str):
+    """The tags open after `tag`, None for a closing tag that closes nothing"""
+    name = TAG_NAME_PATTERN.match(tag).group(1).lower()
+    if tag.startswith("</"):
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index][0] == name:
+                return stack[:index]
+        return None
+    if tag.endswith("/>"):
+        return stack
+    return stack + ((name, tag),)
+
+
+class _Chunk:
+    """The chunk being filled and the best place found so far to cut it, per kind of break"""
+
+    def __init__(self, stack: tuple):
+        self.prefix = _opening_tags(stack)
+        self.stack = stack
+        self.closing_length = len(_closing_tags(stack))
+        self.tokens = []
+        self.length = len(self.prefix)
+        self.visible = False
+        self.breaks = {}  # kind -> (number of tokens, length, stack, visible)
+
+    def add(self, kind: int, token: str, stack: tuple, closing_length: int):
+        self.tokens.append((kind, token))
+        self.length += len(token)
+        self.stack = stack
+        self.closing_length = closing_length
+        self.visible = self.visible or kind in (TEXT, ENTITY)
+
+    def mark(self, kind: int):
+        if self.tokens:
+            self.breaks[kind] = (len(self.tokens), self.length, self.stack, self.visible)
+
+    def cut(self, max_length: int):
+        """
+        Cut at the best break that keeps the chunk at least half full, or after the last token.
+        Returns the text of the chunk (None if it has nothing to show), the tokens after the
+        cut and the tags open at the cut.
+        """
+        count, stack, visible = len(self.tokens), self.stack, self.visible
+        for kind in _BREAKS:
+            if kind in self.breaks and self.breaks[kind][1] >= max_length // 2:
+                count, _, stack, visible = self.breaks[kind]
+                break
+        text = None
+        if visible:
+            text = self.prefix + "".join(token for _, token in self.tokens[:count]) + _closing_tags(stack)
+        return text, self.tokens[count:], stack
+
+    def text(self):
+        """The whole chunk, None if it has nothing to show"""
+        if self.visible:
+            return self.prefix + "".join(token for _, token in self.tokens) + _closing_tags(self.stack)
+        return None
+
+
+def iter_chunks(parts: Iterable[str], max_length: int) -> Iterator[str]:
+    """
+    Pack rendered parts (e.g. the header and then every alert of a group) into messages of
+    at most `max_length` characters. Chunks are yielded as soon as they are full, so `parts`
+    can be a generator rendering one part at a time and at most one chunk is held in memory.
+    """
+    pending = deque()
+    tokens = _tokens(parts)
+    chunk = _Chunk(())
+    while True:
+        if pending:
+            kind, token = pending.popleft()
+        else:
+            kind, token = next(tokens, (None, None))
+            if kind is None:
+                break
+        if kind == PART_END:
+            chunk.mark(ALERT_BREAK)
+            continue
+        if not chunk.tokens and kind in (NEWLINE, TEXT):
+            # Chunks don't start with the separator they were cut at
+            token = token.lstrip(" \t\n")
+            if not token:
+                continue
+        stack, closing_length = chunk.stack, chunk.closing_length
+        if kind == TAG:
+            stack = _apply_tag(stack, token)
+            if stack is None:
+                # Its opening tag was dropped, see below
+                continue
+            closing_length = len(_closing_tags(stack))
+        room = max_length - chunk.length - closing_length
+        if len(token) <= room:
+            if kind == TEXT:
+                space = token.rfind(" ")
+                if space >= 0:
+                    chunk.add(kind, token[:space + 1], stack, closing_length)
+                    chunk.mark(SPACE_BREAK)
+                    token = token[space + 1:]
+                    if not token:
+                        continue
+            chunk.add(kind, token, stack, closing_length)
+            if kind == NEWLINE:
+                chunk.mark(LINE_BREAK)
+            continue
+        if kind == TEXT and room > 0:
+            # Fill the chunk up to the last space that fits, or with part of a word longer
+            # than a chunk
+            space = token.rfind(" ", 0, room)
+            if space >= 0 or not chunk.tokens:
+                end = space + 1 if space >= 0 else room
+                chunk.add(kind, token[:end], stack, closing_length)
+                chunk.mark(SPACE_BREAK)
+                token = token[end:]
+        if not chunk.tokens:
+            # A tag or an entity can't be cut, nor can anything be added to formatting
+            # this long: send it as it is and let Telegram decide
+            chunk.add(kind, token, stack, closing_length)
+            continue
+        text, rest, stack = chunk.cut(max_length)
+        if text is not None:
+            yield text
+        if len(_opening_tags(stack)) + len(_closing_tags(stack)) > max_length // 2:
+            # Carrying formatting this long would leave no room for the text
+            stack = ()
+        chunk = _Chunk(stack)
+        if token:
+            pending.appendleft((kind, token))
+        pending.extendleft(reversed(rest))
+    text = chunk.text()
+    if text is not None:
+        yield text
+
+
+def split_message(text: str, max_length: int) -> List[str]:
+    """`text` split into messages of at most `max_length` characters"""
+    return list(iter_chunks([text], max_length))
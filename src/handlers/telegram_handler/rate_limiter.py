@@ -0,0 +1,242 @@
+from utils.state_backend import get_state_backend, StateBackendError
+from utils.metrics import (
+    alertbot_telegram_rate_limit_wait_seconds,
+    alertbot_telegram_rate_limit_waiters,
+    alertbot_telegram_throttled_counter
+)
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+# Lower value is served first when several messages are waiting
+SEVERITY_PRIORITIES = {
+    "disaster": 0,
+    "critical": 1,
+    "warning": 2,
+    "info": 3,
+}
+DEFAULT_PRIORITY = 2
+
+def priority_for_severity(severity: str = None) -> int:
+    return SEVERITY_PRIORITIES.get((severity or "").lower(), DEFAULT_PRIORITY)
+
+
+class TokenBucket:
+    """A token bucket refilled continuously with `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available, 0 if there is one already"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def drain(self, now: float, until: float):
+        """Leave exactly one token available at `until` and nothing more"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - (until - now) * self.rate)
+
+
+class SharedRateLimit:
+    """
+    The same limits counted in the shared state backend, so every replica of the bot
+    together stays under them. Uses fixed windows (a second for the bot and private chats,
+    a minute for groups) and wall clock time, the replicas don't share a monotonic clock.
+    """
+
+    def __init__(self, backend, global_rate: float, group_rate_per_minute: float, private_rate: float):
+        self.backend = backend
+        self.global_rate = global_rate
+        self.group_rate_per_minute = group_rate_per_minute
+        self.private_rate = private_rate
+
+    def _chat_window(self, chat_id: str, now: float):
+        """Returns the key, limit and end of the current window of `chat_id`"""
+        if chat_id.startswith("-"):
+            window = int(now // 60)
+            return f"tg:rate:chat:{chat_id}:{window}", self.group_rate_per_minute, (window + 1) * 60
+        window = int(now)
+        return f"tg:rate:chat:{chat_id}:{window}", self.private_rate, window + 1
+
+    async def _take(self, key: str, limit: float, window_end: float, now: float) -> float:
+        """Count one message in the window, returns how long to wait if it is full"""
+        count = await self.backend.incr(key, ttl=window_end - now + 1)
+        return 0.0 if count <= limit else window_end - now
+
+    async def acquire(self, chat_id: str):
+        """
+        Raises:
+            StateBackendError: If the backend can not be reached.
+        """
+        while True:
+            now = time.time()
+            blocked_until = await self.backend.get(f"tg:blocked:{chat_id}")
+            if blocked_until is not None and float(blocked_until) > now:
+                await asyncio.sleep(float(blocked_until) - now)
+                continue
+            wait = await self._take(*self._chat_window(chat_id, now), now)
+            if wait == 0:
+                break
+            await asyncio.sleep(wait)
+        while True:
+            now = time.time()
+            wait = await self._take(f"tg:rate:global:{int(now)}", self.global_rate, int(now) + 1, now)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def backoff(self, chat_id: str, retry_after: float):
+        """Pause `chat_id` on every replica"""
+        await self.backend.set(f"tg:blocked:{chat_id}", str(time.time() + retry_after), ttl=retry_after)
+
+
+class TelegramRateLimiter:
+    """
+    A Singleton scheduler that keeps sends under Telegram's limits: one bucket for the whole bot
+    and one per chat. Waiting messages are released by priority, and a chat that got a 429 is
+    paused for the `retry_after` Telegram asked for.
+
+    When the state backend is shared (redis), a message released here also has to fit in the
+    limits counted there, see SharedRateLimit. If the backend fails, only the local limits apply.
+    """
+    _instance = None
+
+    def __new__(cls, global_rate: float = 30,
+                group_rate_per_minute: float = 20,
+                private_rate: float = 1,
+                logger: logging.Logger = logging.getLogger(__name__)):
+
+        if cls._instance is None:
+            cls._instance = super(TelegramRateLimiter, cls).__new__(cls)
+
+            instance = cls._instance
+            instance.logger = logger
+            # A bucket needs room for one token, rates below 1 happen when the limits are shared by workers
+            instance.global_bucket = TokenBucket(rate=global_rate, capacity=max(1, global_rate))
+            instance.group_rate = group_rate_per_minute / 60
+            instance.group_capacity = max(1, group_rate_per_minute)
+            instance.private_rate = private_rate
+            instance._chat_buckets = {}
+            instance._blocked_until = {}
+            instance._waiters = []
+            instance._sequence = itertools.count()
+            instance._wakeup = asyncio.Event()
+            instance._dispatcher = None
+            backend = get_state_backend()
+            instance.shared = None
+            if backend.shared:
+                instance.shared = SharedRateLimit(backend, global_rate=global_rate,
+                                                  group_rate_per_minute=group_rate_per_minute,
+                                                  private_rate=private_rate)
+
+        return cls._instance
+
+    def __init__(self, global_rate: float = 30,
+                 group_rate_per_minute: float = 20,
+                 private_rate: float = 1,
+                 logger: logging.Logger = logging.getLogger(__name__)):
+        # No initialization here, it's all handled in __new__
+        # Arguments should be same as __new__ method
+        pass
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if str(chat_id).startswith("-"):  # groups, supergroups and channels
+                bucket = TokenBucket(rate=self.group_rate, capacity=self.group_capacity)
+            else:
+                bucket = TokenBucket(rate=self.private_rate, capacity=max(1, self.private_rate))
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _wait_time(self, chat_id: str, now: float) -> float:
+        blocked = self._blocked_until.get(chat_id, 0) - now
+        return max(blocked, self._chat_bucket(chat_id).wait_time(now), self.global_bucket.wait_time(now))
+
+    def _take(self, chat_id: str, now: float):
+        self._chat_bucket(chat_id).consume(now)
+        self.global_bucket.consume(now)
+
+    async def acquire(self, chat_id: str, priority: int = DEFAULT_PRIORITY):
+        """Wait until a message can be sent to `chat_id`"""
+        chat_id = str(chat_id)
+        now = time.monotonic()
+        if not self._waiters and self._wait_time(chat_id, now) == 0:
+            self._take(chat_id, now)
+        else:
+            await self._wait_turn(chat_id, priority)
+        if self.shared is not None:
+            try:
+                await self.shared.acquire(chat_id)
+            except StateBackendError as e:
+                self.logger.warning(f"Shared rate limit unavailable, using the local one only: {e}")
+        alertbot_telegram_rate_limit_wait_seconds.observe(time.monotonic() - now)
+
+    async def _wait_turn(self, chat_id: str, priority: int):
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), chat_id, future))
+        alertbot_telegram_rate_limit_waiters.set(len(self._waiters))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._wakeup.clear()
+            now = time.monotonic()
+            next_wake = None
+            remaining = []
+            for waiter in sorted(self._waiters):
+                _, _, chat_id, future = waiter
+                if future.done():  # the caller was cancelled
+                    continue
+                wait = self._wait_time(chat_id, now)
+                if wait == 0:
+                    self._take(chat_id, now)
+                    future.set_result(None)
+                    continue
+                remaining.append(waiter)
+                next_wake = wait if next_wake is None else min(next_wake, wait)
+            heapq.heapify(remaining)
+            self._waiters = remaining
+            alertbot_telegram_rate_limit_waiters.set(len(self._waiters))
+            if not self._waiters:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_wake)
+            except asyncio.TimeoutError:
+                pass
+
+    async def backoff(self, chat_id: str, retry_after: float):
+        """Pause `chat_id` for `retry_after` seconds, as asked by a 429 from Telegram"""
+        chat_id = str(chat_id)
+        now = time.monotonic()
+        alertbot_telegram_throttled_counter.inc()
+        self.logger.warning(f"Telegram asked to retry chat {chat_id} after {retry_after} seconds")
+        self._blocked_until[chat_id] = max(self._blocked_until.get(chat_id, 0), now + retry_after)
+        # Resume at the steady rate instead of bursting again once the pause is over
+        self._chat_bucket(chat_id).drain(now, self._blocked_until[chat_id])
+        self._wakeup.set()
+        if self.shared is not None:
+            try:
+                await self.shared.backoff(chat_id, retry_after)
+            except StateBackendError as e:
+                self.logger.warning(f"Could not share the pause of chat {chat_id}: {e}")
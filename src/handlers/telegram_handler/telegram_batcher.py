@@ -0,0 +1,118 @@
+from alertbot.constants import TELEGRAM_MAX_MESSAGE_LENGTH
+from utils.metrics import (
+    alertbot_sent_telegram_per_receiver_counter,
+    alertbot_failed_sent_telegram_per_receiver_counter,
+    alertbot_telegram_batch_size
+)
+from .telegram_handler_api import TelegramHandlerAPI
+import asyncio
+import logging
+
+
+class TelegramBatcher:
+    """
+    A Singleton that holds rendered alert groups for a short window per chat and topic,
+    then sends them packed into as few messages as TELEGRAM_MAX_MESSAGE_LENGTH allows.
+
+    Every group gets a future that is resolved once its message was sent, or fails with
+    the error of sending it, so the delivery of a group only ends when it went out.
+    """
+    _instance = None
+
+    def __new__(cls, logger: logging.Logger = logging.getLogger(__name__)):
+        if cls._instance is None:
+            cls._instance = super(TelegramBatcher, cls).__new__(cls)
+
+            instance = cls._instance
+            instance.logger = logger
+            instance._pending = {}  # (chat_id, message_thread_id) -> [(text, labels, future)]
+            instance._timers = {}   # (chat_id, message_thread_id) -> asyncio.Task
+
+        return cls._instance
+
+    def __init__(self, logger: logging.Logger = logging.getLogger(__name__)):
+        # No initialization here, it's all handled in __new__
+        # Arguments should be same as __new__ method
+        pass
+
+    def add(self, chat_id: str,
+            text: str,
+            window_ms: int,
+            message_thread_id: str = None,
+            telegram_metrics_labels: dict = {}) -> asyncio.Future:
+        """
+        Queue `text` for `chat_id`. The first group added to an empty batch opens a window
+        of `window_ms` milliseconds, everything added before it closes is sent together.
+
+        Returns:
+            asyncio.Future: Done once the message holding `text` was sent, with the
+                exception of sending it if that failed.
+        """
+        key = (chat_id, message_thread_id)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(key, []).append((text, telegram_metrics_labels, future))
+        if key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._flush_later(key, window_ms / 1000))
+        return future
+
+    async def _flush_later(self, key: tuple, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush(key)
+
+    async def flush(self, key: tuple):
+        timer = self._timers.pop(key, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        groups = self._pending.pop(key, [])
+        if not groups:
+            return
+        chat_id, message_thread_id = key
+        alertbot_telegram_batch_size.observe(len(groups))
+        self.logger.info(f"Sending {len(groups)} batched alert groups to chat {chat_id}")
+        for batch in self._pack(groups):
+            text = "".join(text for text, _, _ in batch)
+            first_labels = batch[0][1]
+            try:
+                # send_message accounts for the first group, the others are counted here
+                await TelegramHandlerAPI().send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    message_thread_id=message_thread_id,
+                    telegram_metrics_labels=first_labels)
+            except Exception as e:
+                self.logger.error(f"Failed to send batched alerts to chat {chat_id}: {e}")
+                for _, labels, _ in batch[1:]:
+                    alertbot_failed_sent_telegram_per_receiver_counter.labels(**labels).inc()
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                        # The delivery may be gone (e.g. on shutdown), don't let asyncio
+                        # complain it was never retrieved
+                        future.exception()
+            else:
+                for _, labels, _ in batch[1:]:
+                    alertbot_sent_telegram_per_receiver_counter.labels(**labels).inc()
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def flush_all(self):
+        """Send everything that is waiting, used on application shutdown. Chats are flushed concurrently"""
+        await asyncio.gather(*(self.flush(key) for key in list(self._pending)))
+
+    def _pack(self, groups: list) -> list:
+        """Greedily fill messages in arrival order, a group that is too long on its own is sent alone"""
+        batches = []
+        current = []
+        length = 0
+        for group in groups:
+            text = group[0]
+            if current and length + len(text) > TELEGRAM_MAX_MESSAGE_LENGTH:
+                batches.append(current)
+                current = []
+                length = 0
+            current.append(group)
+            length += len(text)
+        if current:
+            batches.append(current)
+        return batches
@@ -1,8 +1,21 @@
-import asyncio, logging
-from typing import Dict, Any
+import html, logging
+from typing import Dict, Any, Iterable
 from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton, Update, error
 from telegram.ext import ApplicationBuilder, CallbackQueryHandler, ContextTypes
-from alertbot.env import ENABLE_POLLING
+from telegram.request import HTTPXRequest
+from alertbot.env import ENABLE_POLLING, TG_GLOBAL_RATE_LIMIT, TG_GROUP_RATE_LIMIT_PER_MINUTE, \
+    TG_PRIVATE_RATE_LIMIT, TG_MAX_THROTTLED_RETRIES, TG_API_BASE_URL, TG_WEBHOOK_URL, TG_WEBHOOK_SECRET, \
+    HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT
+from urllib.parse import urlsplit
+from utils.retry import RetryPolicy
+from utils.circuit_breaker import get_circuit_breaker
+from utils.pipeline_timing import time_stage, SEND_ATTEMPT_STAGE
+from utils.keyed_lock import KeyedLock
+from alertbot.constants import TELEGRAM_MAX_MESSAGE_LENGTH
+from alertbot.workers import worker_share
+from .rate_limiter import TelegramRateLimiter, DEFAULT_PRIORITY
+from .message_splitter import iter_chunks
+from services.silencer import Silencer, SILENCE_CALLBACK_PREFIX
 class TelegramHandler:
     """
     A Singleton class to handle sending messages to Telegram chats,
@@ -25,15 +38,35 @@ class TelegramHandler:
             # Initialize instance (do this only once)
             instance = cls._instance
             instance.token = token
-            instance.bot = Bot(token=token)
-            instance.app = ApplicationBuilder().token(token).build()
+            # The default request of the bot has a single connection, every call would wait for
+            # the previous one (e.g. concurrent button presses coming from the webhook)
+            instance.bot = Bot(token=token, base_url=f"{TG_API_BASE_URL}/bot",
+                               request=HTTPXRequest(connection_pool_size=HTTP_MAX_CONNECTIONS_PER_HOST,
+                                                    connect_timeout=HTTP_CONNECT_TIMEOUT,
+                                                    read_timeout=HTTP_READ_TIMEOUT))
+            instance.app = ApplicationBuilder().token(token).base_url(f"{TG_API_BASE_URL}/bot").build()
             instance._polling_started = False
             instance.logger = logger
             instance.retries = int(retries)
             instance.delay = int(delay)
+            instance.max_throttled_retries = TG_MAX_THROTTLED_RETRIES
+            instance.circuit_breaker = get_circuit_breaker(urlsplit(TG_API_BASE_URL).netloc)
+            instance.retry_policy = RetryPolicy(
+                name="telegram_bot",
+                max_attempts=instance.retries,
+                base_delay=instance.delay,
+                non_retriable=(error.BadRequest, error.Forbidden, error.InvalidToken))
+            # Telegram limits the bot, every worker process gets an equal share
+            instance.rate_limiter = TelegramRateLimiter(
+                global_rate=worker_share(TG_GLOBAL_RATE_LIMIT),
+                group_rate_per_minute=worker_share(TG_GROUP_RATE_LIMIT_PER_MINUTE),
+                private_rate=worker_share(TG_PRIVATE_RATE_LIMIT))
+            # The chunks of a split message hold the lock of their chat so they can't
+            # interleave with another split message
+            instance.chat_locks = KeyedLock()
             
-            if ENABLE_POLLING:
-                # Set up the callback query handler
+            if ENABLE_POLLING and not TG_WEBHOOK_URL:
+                # Set up the callback query handler, webhook updates go to process_update
                 instance.app.add_handler(CallbackQueryHandler(instance._process_callback))
 
 
@@ -50,13 +83,16 @@ class TelegramHandler:
     async def send_message(
         self, 
         chat_id: str, 
-        text: str, 
+        text: str = None, 
         parse_mode: str = "HTML",
         reply_markup: InlineKeyboardMarkup = None,
-        message_thread_id: str = None
+        message_thread_id: str = None,
+        priority: int = DEFAULT_PRIORITY,
+        parts: Iterable[str] = None
     ) -> Dict[str, Any]:
         """
-        Send a message to a specific chat.
+        Send a message to a specific chat, split into as many messages as
+        TELEGRAM_MAX_MESSAGE_LENGTH needs. The reply markup goes with the last one.
         
         Args:
             chat_id: Chat ID to send the message to
@@ -64,53 +100,120 @@ class TelegramHandler:
             parse_mode: Parse mode (HTML, Markdown, etc.)
             reply_markup: Inline keyboard markup for buttons
             message_thread_id: Thread ID for sending to specific topics
+            priority: Rate limiter priority, lower is sent first
+            parts: The rendered parts of the message instead of `text`, e.g. the header and
+                every alert of a group. Messages are cut between parts when possible, and the
+                parts are rendered as the messages are sent.
             
         Returns:
-            The sent message
+            The sent message, the last one for a split message
         """
-        attempt = 0
-        while attempt < self.retries:
-            try:    
-                result = await self.bot.send_message(
-                    chat_id=chat_id, 
-                    text=text, 
-                    parse_mode=parse_mode, 
-                    reply_markup=reply_markup,
-                    message_thread_id=message_thread_id
-                )
-                self.logger.info(f"Successfully sent telegram message after {attempt} retries")
-                return result
-            except Exception as e:
-                attempt += 1
-                self.logger.error(f"Failed to send message: attempt {attempt}, {e}")
-                self.logger.error(f"Retrying in {self.delay} seconds...")
-                await asyncio.sleep(self.delay)
-                
-        raise error.TelegramError(f"Failed to send message after {self.retries} attempts")
+        chunks = iter_chunks([text] if parts is None else parts, TELEGRAM_MAX_MESSAGE_LENGTH)
+        chunk = next(chunks, None)
+        following = next(chunks, None)
+        if following is None:
+            return await self._send_single_message(chat_id, text if parts is None else chunk, parse_mode,
+                                                   reply_markup, message_thread_id, priority)
+
+        self.logger.info(f"Message exceeds {TELEGRAM_MAX_MESSAGE_LENGTH} characters. Splitting message.")
+        async with self.chat_locks((str(chat_id), message_thread_id)):
+            index = 1
+            while chunk is not None:
+                self.logger.info(f"Sending message chunk {index}")
+                last = following is None
+                result = await self._send_single_message(chat_id, chunk, parse_mode,
+                                                         reply_markup if last else None,
+                                                         message_thread_id, priority)
+                chunk, following = following, (None if last else next(chunks, None))
+                index += 1
+        return result
+
+    async def _send_single_message(self, chat_id: str, text: str, parse_mode: str,
+                                   reply_markup: InlineKeyboardMarkup, message_thread_id: str,
+                                   priority: int) -> Dict[str, Any]:
+        """Send a single message to Telegram"""
+        throttled = 0
+
+        async def attempt():
+            nonlocal throttled
+            while True:
+                await self.rate_limiter.acquire(chat_id, priority)
+                self.circuit_breaker.before_call()
+                try:
+                    with time_stage(SEND_ATTEMPT_STAGE):
+                        result = await self.bot.send_message(
+                            chat_id=chat_id, 
+                            text=text, 
+                            parse_mode=parse_mode, 
+                            reply_markup=reply_markup,
+                            message_thread_id=message_thread_id
+                        )
+                    self.circuit_breaker.record_success()
+                    return result
+                except (error.RetryAfter, error.BadRequest, error.Forbidden) as e:
+                    # Telegram answered, so it is up
+                    self.circuit_breaker.record_success()
+                    if not isinstance(e, error.RetryAfter):
+                        self.logger.error(f"Failed to send message: {e}")
+                        raise
+                    if throttled >= self.max_throttled_retries:
+                        raise
+                    # Rate limited, wait as long as telegram asks without using up a retry
+                    throttled += 1
+                    retry_after = e.retry_after
+                    if hasattr(retry_after, "total_seconds"):
+                        retry_after = retry_after.total_seconds()
+                    await self.rate_limiter.backoff(chat_id, retry_after)
+                except Exception as e:
+                    self.circuit_breaker.record_failure()
+                    self.logger.error(f"Failed to send message: {e}")
+                    raise
+
+        try:
+            result = await self.retry_policy.run_async(attempt)
+        except Exception as e:
+            raise error.TelegramError(f"Failed to send message after {self.retries} attempts: {e}") from e
+        self.logger.info("Successfully sent telegram message")
+        return result
     
     async def send_alert_message(
         self, 
         chat_id: str, 
-        text: str, 
+        text: str = None, 
         confirm_button_text: str = "💊 Silence",
         parse_mode: str = "HTML",
-        message_thread_id: str = None
+        message_thread_id: str = None,
+        priority: int = DEFAULT_PRIORITY,
+        silence_labels: Dict[str, str] = None,
+        alertmanager_url: str = None,
+        parts: Iterable[str] = None
     ) -> Dict[str, Any]:
         """
-        Send an alert message with confirm/cancel buttons.
+        Send an alert message with a silence button.
         
         Args:
             chat_id: Chat ID to send the message to
             text: Alert message text
             confirm_button_text: Text for the confirm button
-            cancel_button_text: Text for the cancel button
             parse_mode: Parse mode for the message
+            priority: Rate limiter priority, lower is sent first
+            silence_labels: Labels the button silences in Alertmanager, without them
+                the button only marks the message as silenced
+            alertmanager_url: Alertmanager the silence is created in
+            parts: The rendered parts of the message instead of `text`, see `send_message`
             
         Returns:
             The sent message
         """
         # Create simple callback data
         confirm_callback_data = "alert_confirm"
+        if silence_labels and alertmanager_url:
+            confirm_callback_data = await Silencer().remember(alertmanager_url, silence_labels)
+            if confirm_callback_data is None:
+                # A button that can't silence anything would only mislead
+                return await self.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode,
+                                               message_thread_id=message_thread_id, priority=priority,
+                                               parts=parts)
         
         # Create keyboard with buttons
         keyboard = [
@@ -123,7 +226,8 @@ class TelegramHandler:
         # Send the message
         return await self.send_message(chat_id=chat_id, text=text, 
                         parse_mode=parse_mode, reply_markup=reply_markup, 
-                        message_thread_id=message_thread_id)
+                        message_thread_id=message_thread_id, priority=priority,
+                        parts=parts)
 
     def polling_error_callback(self, error: error.TelegramError):
         """
@@ -139,8 +243,12 @@ class TelegramHandler:
     async def _process_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Process callback queries from button clicks."""
         query = update.callback_query
-        callback_data = query.data
-        
+        callback_data = query.data or ""
+
+        if callback_data.startswith(SILENCE_CALLBACK_PREFIX):
+            await self._process_silence(query)
+            return
+
         # Acknowledge the button click
         await query.answer()
         
@@ -151,6 +259,57 @@ class TelegramHandler:
                 parse_mode="HTML"
             )
 
+    async def _process_silence(self, query):
+        """Create the Alertmanager silence of a silence button and mark the message"""
+        user = query.from_user
+        created_by = f"@{user.username}" if user.username else user.full_name
+        try:
+            silence = await Silencer().silence_callback(query.data, created_by=f"{created_by} (alertbot)")
+        except Exception as e:
+            self.logger.error(f"Failed to silence the alert of button {query.data}: {e!r}")
+            await query.answer("Failed to create the silence, try again", show_alert=True)
+            return
+        if silence is None:
+            await query.answer("This alert can no longer be silenced from here", show_alert=True)
+            return
+
+        until = silence.ends_at.astimezone().strftime("%Y-%m-%d %H:%M")
+        status = "Silenced" if silence.created else "Already silenced"
+        await query.answer(f"{status} until {until}")
+        # Without reply_markup the button is removed
+        await query.edit_message_text(
+            f"{query.message.text_html}\n\n✅ <b>{status}</b> until {until} by {html.escape(created_by)}",
+            parse_mode="HTML"
+        )
+
+    async def process_update(self, data: dict):
+        """Handle an update Telegram posted to the webhook, only callback queries are used"""
+        update = Update.de_json(data, self.bot)
+        if update is None or update.callback_query is None:
+            self.logger.debug(f"Ignoring telegram update {update.update_id if update else None}")
+            return
+        await self._process_callback(update, None)
+
+    async def setup_updates(self):
+        """Receive updates with a webhook if TG_WEBHOOK_URL is set, else by polling"""
+        if TG_WEBHOOK_URL:
+            await self.setup_webhook()
+        else:
+            await self.setup_polling()
+
+    async def setup_webhook(self):
+        """
+        Ask Telegram to post callback queries to TG_WEBHOOK_URL. Any replica behind that URL can
+        handle them, setting the same webhook again is harmless.
+        """
+        if not TG_WEBHOOK_SECRET:
+            self.logger.error("TG_WEBHOOK_SECRET is not set, not registering the telegram webhook!")
+            return
+        self.logger.info(f"Registering telegram webhook {TG_WEBHOOK_URL}")
+        await self.bot.set_webhook(url=TG_WEBHOOK_URL,
+                                   allowed_updates=["callback_query"],
+                                   secret_token=TG_WEBHOOK_SECRET)
+
     async def setup_polling(self):
         """Set up polling if not already running"""
         if self._polling_started:
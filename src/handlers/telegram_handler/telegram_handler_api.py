@@ -1,10 +1,19 @@
 from utils.make_api_call import make_api_call
+from utils.retry import RetryPolicy
+from utils.keyed_lock import KeyedLock
+from utils.pipeline_timing import time_stage, SEND_ATTEMPT_STAGE
 from utils.metrics import (
     alertbot_sent_telegram_per_receiver_counter, 
     alertbot_failed_sent_telegram_per_receiver_counter
 )
 from alertbot.constants import TELEGRAM_MAX_MESSAGE_LENGTH
-from time import sleep
+from alertbot.env import TG_GLOBAL_RATE_LIMIT, TG_GROUP_RATE_LIMIT_PER_MINUTE, \
+    TG_PRIVATE_RATE_LIMIT, TG_MAX_THROTTLED_RETRIES, TG_API_BASE_URL
+from alertbot.workers import worker_share
+from .rate_limiter import TelegramRateLimiter, priority_for_severity
+from .message_splitter import iter_chunks
+from typing import Iterable
+import itertools
 from telegram import error
 import logging
 
@@ -32,6 +41,20 @@ class TelegramHandlerAPI:
             instance.logger = logger
             instance.retries = int(retries)
             instance.delay = int(delay)
+            instance.max_throttled_retries = TG_MAX_THROTTLED_RETRIES
+            instance.retry_policy = RetryPolicy(
+                name="telegram_api",
+                max_attempts=instance.retries,
+                base_delay=instance.delay,
+                non_retriable=(error.BadRequest, error.Forbidden))
+            # Telegram limits the bot, every worker process gets an equal share
+            instance.rate_limiter = TelegramRateLimiter(
+                global_rate=worker_share(TG_GLOBAL_RATE_LIMIT),
+                group_rate_per_minute=worker_share(TG_GROUP_RATE_LIMIT_PER_MINUTE),
+                private_rate=worker_share(TG_PRIVATE_RATE_LIMIT))
+            # Messages go out concurrently, the chunks of a split message hold the lock
+            # of their chat so they can't interleave with another split message
+            instance.chat_locks = KeyedLock()
 
         return cls._instance
     
@@ -44,50 +67,45 @@ class TelegramHandlerAPI:
         pass
 
 
-    def send_message(self, chat_id: str, 
+    async def send_message(self, chat_id: str, 
                      text: str = "Empty Text",
                      parse_mode: str = "HTML",
                      message_thread_id: str = None,
                      telegram_metrics_labels: dict = {}):
         self.logger.debug(f"Message size is: {len(text)}")
-        
-        # Check if message exceeds maximum length and split if necessary
-        if len(text) > TELEGRAM_MAX_MESSAGE_LENGTH:
-            self.logger.info(f"Message size {len(text)} exceeds limit {TELEGRAM_MAX_MESSAGE_LENGTH}. Splitting message.")
-            text_chunks = self._split_message(text, TELEGRAM_MAX_MESSAGE_LENGTH)
-            
-            # Send each chunk as a separate message
-            for i, chunk in enumerate(text_chunks):
-                self.logger.info(f"Sending message chunk {i + 1}/{len(text_chunks)}")
-                self._send_single_message(chat_id, chunk, parse_mode, message_thread_id, telegram_metrics_labels)
-        else:
-            # Send single message
-            self._send_single_message(chat_id, text, parse_mode, message_thread_id, telegram_metrics_labels)
+        await self.send_parts(chat_id, [text], parse_mode, message_thread_id, telegram_metrics_labels)
 
-    def _split_message(self, text: str, max_length: int):
-        """Split a message into chunks that don't exceed max_length"""
-        chunks = []
-        while len(text) > max_length:
-            # Find a good breaking point (newline, space, or period)
-            split_pos = text.rfind('\n', 0, max_length)
-            if split_pos == -1:
-                split_pos = text.rfind(' ', 0, max_length)
-            if split_pos == -1:
-                split_pos = text.rfind('.', 0, max_length)
-            if split_pos == -1:
-                split_pos = max_length
-            
-            chunks.append(text[:split_pos])
-            text = text[split_pos:].lstrip()
-        
-        if text:
-            chunks.append(text)
-        return chunks
+    async def send_parts(self, chat_id: str,
+                         parts: Iterable[str],
+                         parse_mode: str = "HTML",
+                         message_thread_id: str = None,
+                         telegram_metrics_labels: dict = {}):
+        """
+        Send a message given as consecutive parts, split into as many messages as
+        TELEGRAM_MAX_MESSAGE_LENGTH needs. `parts` may be a generator rendering the message
+        (see TelegramTemplater.iter_parts): every chunk is sent as soon as it is full, so the
+        first one goes out before the rest is rendered and the whole text is never built.
+        """
+        chunks = iter_chunks(parts, TELEGRAM_MAX_MESSAGE_LENGTH)
+        first = next(chunks, None)
+        if first is None:
+            return
+        second = next(chunks, None)
+        if second is None:
+            await self._send_single_message(chat_id, first, parse_mode, message_thread_id, telegram_metrics_labels)
+            return
+
+        self.logger.info(f"Message exceeds {TELEGRAM_MAX_MESSAGE_LENGTH} characters. Splitting message.")
+        async with self.chat_locks((str(chat_id), message_thread_id)):
+            # Send each chunk as a separate message, in order
+            for i, chunk in enumerate(itertools.chain((first, second), chunks)):
+                self.logger.info(f"Sending message chunk {i + 1}")
+                await self._send_single_message(chat_id, chunk, parse_mode, message_thread_id, telegram_metrics_labels)
 
-    def _send_single_message(self, chat_id: str, text: str, parse_mode: str, message_thread_id: str = None, 
+    async def _send_single_message(self, chat_id: str, text: str, parse_mode: str, message_thread_id: str = None, 
                              telegram_metrics_labels: dict = {}):
         """Send a single message to Telegram"""
-        url = f"https://api.telegram.org/bot{self.token}/sendMessage"
+        url = f"{TG_API_BASE_URL}/bot{self.token}/sendMessage"
         data = {
             "chat_id": chat_id,
             "text": text,
@@ -99,32 +117,58 @@ class TelegramHandlerAPI:
         if message_thread_id:
             data["message_thread_id"] = message_thread_id
 
-        for i in range(self.retries):
-            self.logger.info(
-            f"Calling Telegram API for Chat ID {chat_id} "
-            )
-            response = make_api_call(method="POST", 
-                                    url=url,
-                                    payload=data)
-            if response is not None and response.status_code < 300 and response.status_code >= 200:
-                self.logger.info(f"Successfully sent message for telegram. Status code: {response.status_code}")
-                alertbot_sent_telegram_per_receiver_counter.labels(
-                    **telegram_metrics_labels
-                ).inc()
-            else: # Sth is wrong, we haven't got 2XX status code
-                if response is not None:
-                    self.logger.error(f"Failed to send message {text}. Status code: " +
-                                    f"{response.status_code}, Response text: {response.text}")
-                else:
+        priority = priority_for_severity(telegram_metrics_labels.get("severity"))
+        throttled = 0
+
+        async def attempt():
+            nonlocal throttled
+            while True:
+                await self.rate_limiter.acquire(chat_id, priority)
+                self.logger.info(
+                f"Calling Telegram API for Chat ID {chat_id} "
+                )
+                with time_stage(SEND_ATTEMPT_STAGE):
+                    response = await make_api_call(method="POST", 
+                                            url=url,
+                                            payload=data)
+                if response is not None and response.status_code < 300 and response.status_code >= 200:
+                    return response
+
+                if response is not None and response.status_code == 429 and \
+                   throttled < self.max_throttled_retries:
+                    # Rate limited, wait as long as telegram asks without using up a retry
+                    throttled += 1
+                    await self.rate_limiter.backoff(chat_id, self._retry_after(response))
+                    continue
+
+                # Sth is wrong, we haven't got 2XX status code
+                if response is None:
                     self.logger.error("No response was received!")
-                if i != self.retries - 1:
-                    self.logger.error(f"sleeping for {self.delay} after retry number {i + 1}")
-                    sleep(self.delay)
+                    raise error.NetworkError("No response was received from telegram")
+                self.logger.error(f"Failed to send message {text}. Status code: " +
+                                f"{response.status_code}, Response text: {response.text}")
+                if response.status_code == 403:
+                    raise error.Forbidden(response.text)
+                if response.status_code != 429 and response.status_code < 500:
+                    # The same request would be refused again (bad chat id, broken HTML...)
+                    raise error.BadRequest(response.text)
+                raise error.NetworkError(f"Telegram answered with status code {response.status_code}")
+
+        try:
+            response = await self.retry_policy.run_async(attempt)
+        except Exception as e:
+            alertbot_failed_sent_telegram_per_receiver_counter.labels(
+                **telegram_metrics_labels
+            ).inc()
+            raise error.TelegramError(f"Failed to send message after {self.retries} attempts: {e}") from e
+        self.logger.info(f"Successfully sent message for telegram. Status code: {response.status_code}")
+        alertbot_sent_telegram_per_receiver_counter.labels(
+            **telegram_metrics_labels
+        ).inc()
 
-                else: 
-                    alertbot_failed_sent_telegram_per_receiver_counter.labels(
-                        **telegram_metrics_labels
-                    ).inc()
-                    raise error.TelegramError(f"Failed to send message after {self.retries} attempts")
-                continue
-            break
+    def _retry_after(self, response) -> float:
+        """Reads `parameters.retry_after` of a 429 response, falls back to the retry delay"""
+        try:
+            return float(response.json()["parameters"]["retry_after"])
+        except Exception:
+            return self.delay
@@ -1,8 +1,10 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from prometheus_fastapi_instrumentator import Instrumentator
-from alertbot import env, startup
+from alertbot import env, startup, workers
 from alertbot.prometheus_endpoint import prom
 from alertbot.splunk_endpoint import splunk
+from alertbot.telegram_endpoint import telegram
 from alertbot.test_endpoint import tests
 from utils.logger import setup_logging
 import uvicorn
@@ -10,6 +12,7 @@ import uvicorn
 
 app = FastAPI(
     lifespan=startup.lifespan,
+    default_response_class=ORJSONResponse,
     title="Alertbot",
     description="Sending Alerts to Proper Destinations.",
     version="2.0.0",
@@ -21,6 +24,8 @@ Instrumentator().instrument(app).expose(app)
 
 app.include_router(prom.router)
 app.include_router(splunk.router)
+if env.ACTIVE_TELEGRAM and env.TELEGRAM_MODE.lower() == "bot" and env.TG_WEBHOOK_URL:
+    app.include_router(telegram.router)
 if env.ENVIRONMENT == "STAGING":
     app.include_router(tests.router)
 
@@ -30,4 +35,11 @@ async def root():
 
 if __name__ == "__main__":
     logger = setup_logging()
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None)
\ No newline at end of file
+    if workers.multi_worker():
+        # Workers are separate processes that import the app themselves
+        workers.prepare_runtime_dir()
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, log_config=None, workers=env.WORKERS,
+                    loop=env.UVICORN_LOOP, http=env.UVICORN_HTTP)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None,
+                    loop=env.UVICORN_LOOP, http=env.UVICORN_HTTP)
\ No newline at end of file
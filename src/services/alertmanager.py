@@ -1,6 +1,9 @@
+import base64
 import logging
+import orjson
 from typing import Dict, List, Optional, Union
-from utils import make_api_call
+from utils.make_api_call import make_api_call
+from alertbot.env import ALERTMANAGER_URL, ALERTMANAGER_ALLOWED_URLS, ALERTMANAGER_USERNAME, ALERTMANAGER_PASSWORD
 # Configure logger
 logger = logging.getLogger("alertbot")
 
@@ -19,9 +22,13 @@ class AlertManagerClient:
         """
         self.base_url = f"{base_url.rstrip('/')}/api/{self.API_VERSION}"
         self.auth = (username, password) if username and password else None
+        self.headers = {}
+        if self.auth:
+            credentials = base64.b64encode(f"{username}:{password}".encode()).decode()
+            self.headers["Authorization"] = f"Basic {credentials}"
         logger.info(f"Initialized AlertManagerClient with base URL: {self.base_url}")
 
-    def get_alerts(self, filter_params: Optional[Dict] = None) -> List[Dict]:
+    async def get_alerts(self, filter_params: Optional[Dict] = None) -> List[Dict]:
         """Get all alerts from AlertManager.
 
         Args:
@@ -34,10 +41,10 @@ class AlertManagerClient:
         logger.info(f"Getting alerts with filters: {filter_params}")
         logger.debug(f"Making GET request to {url}")
         
-        response = make_api_call(
+        response = await make_api_call(
             method="GET",
             url=url,
-            headers={"Accept": "application/json"},
+            headers={**self.headers, "Accept": "application/json"},
             params=filter_params,
             retry_count=3
         )
@@ -47,7 +54,7 @@ class AlertManagerClient:
         return alerts
 
 
-    def post_alerts(self, alerts: Union[Dict, List[Dict]]) -> None:
+    async def post_alerts(self, alerts: Union[Dict, List[Dict]]) -> None:
         """Post new alerts to AlertManager.
 
         Args:
@@ -60,19 +67,22 @@ class AlertManagerClient:
         logger.info(f"Posting {len(alerts)} alerts")
         logger.debug(f"Making POST request to {url}")
 
-        response = make_api_call(
+        response = await make_api_call(
             method="POST",
             url=url,
-            headers={"Content-Type": "application/json"},
-            payload=alerts,
+            headers={**self.headers, "Content-Type": "application/json"},
+            payload=orjson.dumps(alerts),
             retry_count=3
         )
         return response.raise_for_status()
 
 
-    def get_silences(self) -> List[Dict]:
+    async def get_silences(self, retry_count: int = 3) -> List[Dict]:
         """Get all silences from AlertManager.
 
+        Args:
+            retry_count (int, optional): Attempts made before giving up
+
         Returns:
             List[Dict]: List of silences
         """
@@ -80,18 +90,18 @@ class AlertManagerClient:
         logger.info("Getting all silences")
         logger.debug(f"Making GET request to {url}")
 
-        response = make_api_call(
+        response = await make_api_call(
             method="GET",
             url=url,
-            headers={"Accept": "application/json"},
-            retry_count=3
+            headers={**self.headers, "Accept": "application/json"},
+            retry_count=retry_count
         )
         response.raise_for_status()
         silences = response.json()
         logger.info(f"Retrieved {len(silences)} silences")
         return silences
 
-    def create_silence(self, silence_data: Dict) -> str:
+    async def create_silence(self, silence_data: Dict) -> str:
         """Create a new silence.
 
         Args:
@@ -104,11 +114,11 @@ class AlertManagerClient:
         logger.info("Creating silence")
         logger.debug(f"Making POST request to {url}")
 
-        response = make_api_call(
+        response = await make_api_call(
             method="POST",
             url=url,
-            headers={"Content-Type": "application/json"},
-            payload=silence_data,
+            headers={**self.headers, "Content-Type": "application/json"},
+            payload=orjson.dumps(silence_data),
             retry_count=3
         )
         response.raise_for_status()
@@ -116,7 +126,7 @@ class AlertManagerClient:
         logger.info(f"Created silence with ID: {silence_id}")
         return silence_id
 
-    def delete_silence(self, silence_id: str) -> None:
+    async def delete_silence(self, silence_id: str) -> None:
         """Delete a silence by ID.
 
         Args:
@@ -126,11 +136,58 @@ class AlertManagerClient:
         logger.info(f"Deleting silence with ID: {silence_id}")
         logger.debug(f"Making DELETE request to {url}")
 
-        response = make_api_call(
+        response = await make_api_call(
             method="DELETE",
             url=url,
-            headers={"Accept": "application/json"},
+            headers={**self.headers, "Accept": "application/json"},
             retry_count=3
         )
         response.raise_for_status()
         logger.info(f"Successfully deleted silence: {silence_id}")
+
+
+def _normalize(url: str) -> str:
+    return (url or "").strip().rstrip("/")
+
+# Alertmanagers alertbot may call. The externalURL of a webhook comes from whoever posted it,
+# so it is only used when it is one of these, otherwise alertbot could be made to call (and
+# send the credentials to) any host.
+CONFIGURED_URL = _normalize(ALERTMANAGER_URL)
+ALLOWED_URLS = frozenset(url for url in map(_normalize, ALERTMANAGER_ALLOWED_URLS.split(",")) if url)
+
+def trusted_alertmanager_url(url: str) -> Optional[str]:
+    """`url` if it is ALERTMANAGER_URL or in ALERTMANAGER_ALLOWED_URLS, else None"""
+    url = _normalize(url)
+    if url and (url == CONFIGURED_URL or url in ALLOWED_URLS):
+        return url
+    return None
+
+def silence_alertmanager_url(external_url: str) -> Optional[str]:
+    """
+    The Alertmanager silences of a webhook are created in: ALERTMANAGER_URL when set, else
+    the externalURL of the webhook if it is allowed. None if there is none.
+    """
+    return CONFIGURED_URL or trusted_alertmanager_url(external_url)
+
+# One client per trusted Alertmanager, shared by every caller of get_alertmanager_client
+_clients = {}
+
+def get_alertmanager_client(base_url: str) -> AlertManagerClient:
+    """
+    Returns the client of the Alertmanager at `base_url`, created on first use. Only the
+    client of ALERTMANAGER_URL sends ALERTMANAGER_USERNAME/PASSWORD.
+
+    Raises:
+        ValueError: If `base_url` is neither ALERTMANAGER_URL nor in ALERTMANAGER_ALLOWED_URLS.
+    """
+    key = trusted_alertmanager_url(base_url)
+    if key is None:
+        raise ValueError(f"{base_url} is not a configured Alertmanager")
+    client = _clients.get(key)
+    if client is None:
+        if key == CONFIGURED_URL:
+            client = AlertManagerClient(key, ALERTMANAGER_USERNAME, ALERTMANAGER_PASSWORD)
+        else:
+            client = AlertManagerClient(key)
+        _clients[key] = client
+    return client
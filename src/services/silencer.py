@@ -0,0 +1,267 @@
+"""
+Alertmanager silences created by the silence button of telegram alerts.
+
+Telegram limits callback data to 64 bytes, so the button only carries a short id. The labels
+to silence and the Alertmanager to ask are kept under that id in the state backend, bounded
+and expiring after SILENCE_CALLBACK_TTL. With redis, any replica can handle the press.
+Only ALERTMANAGER_URL and ALERTMANAGER_ALLOWED_URLS are ever asked, so the indexes and
+clients below are bounded by the configuration.
+
+Presses are collected for SILENCE_BATCH_WINDOW_MS. Presses for the same labels share one
+silence, and the silences of a window are created concurrently. A SilenceIndex per
+Alertmanager keeps its active silences, refreshed every SILENCE_INDEX_REFRESH_SECONDS, so
+pressing the button of an alert that is already silenced doesn't ask Alertmanager again.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from alertbot.env import SILENCE_DURATION_SECONDS, SILENCE_CALLBACK_TTL, \
+    SILENCE_BATCH_WINDOW_MS, SILENCE_INDEX_REFRESH_SECONDS
+from utils.datetime_parser import parse_rfc3339
+from utils.metrics import alertbot_silences_counter
+from utils.state_backend import get_state_backend, StateBackendError
+from .alertmanager import get_alertmanager_client, trusted_alertmanager_url
+import asyncio
+import logging
+import orjson
+import re
+import secrets
+
+logger = logging.getLogger(__name__)
+
+# Callback data of a silence button, followed by the id of its labels in the state backend
+SILENCE_CALLBACK_PREFIX = "silence:"
+SILENCE_KEY_PREFIX = "silence:"
+
+
+@dataclass
+class Silence:
+    """A silence of an Alertmanager, `created` is False if it already existed"""
+    silence_id: str
+    ends_at: datetime
+    created: bool = True
+
+
+def _matcher_matches(matcher: dict, labels: Dict[str, str]) -> bool:
+    value = labels.get(matcher.get("name"), "")
+    if matcher.get("isRegex"):
+        matched = re.fullmatch(matcher.get("value", ""), value) is not None
+    else:
+        matched = value == matcher.get("value", "")
+    return matched == matcher.get("isEqual", True)
+
+
+def silence_matches(silence: dict, labels: Dict[str, str]) -> bool:
+    """True if every matcher of the Alertmanager `silence` matches `labels`"""
+    try:
+        return all(_matcher_matches(matcher, labels) for matcher in silence.get("matchers", []))
+    except re.error:
+        return False
+
+
+class SilenceIndex:
+    """The active silences of one Alertmanager, as of the last refresh"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._silences = []  # (silence dict, ends_at)
+
+    async def refresh(self):
+        silences = await get_alertmanager_client(self.base_url).get_silences(retry_count=1)
+        now = datetime.now(timezone.utc)
+        active = []
+        for silence in silences:
+            if silence.get("status", {}).get("state") != "active":
+                continue
+            ends_at = parse_rfc3339(silence["endsAt"])
+            if ends_at > now:
+                active.append((silence, ends_at))
+        self._silences = active
+        logger.debug(f"Indexed {len(active)} active silences of {self.base_url}")
+
+    def add(self, silence: dict, ends_at: datetime):
+        self._silences.append((silence, ends_at))
+
+    def find(self, labels: Dict[str, str]) -> Optional[Silence]:
+        """The active silence that lasts the longest among those covering `labels`"""
+        now = datetime.now(timezone.utc)
+        found = None
+        for silence, ends_at in self._silences:
+            if ends_at > now and (found is None or ends_at > found.ends_at) and silence_matches(silence, labels):
+                found = Silence(silence_id=silence.get("id", ""), ends_at=ends_at, created=False)
+        return found
+
+    def __len__(self):
+        return len(self._silences)
+
+
+class Silencer:
+    """
+    A Singleton that keeps the labels behind silence buttons and creates their silences.
+    """
+    _instance = None
+
+    def __new__(cls, logger: logging.Logger = logger):
+        if cls._instance is None:
+            cls._instance = super(Silencer, cls).__new__(cls)
+
+            instance = cls._instance
+            instance.logger = logger
+            instance._indexes = {}   # alertmanager url -> SilenceIndex
+            instance._creating = {}  # (alertmanager url, labels) -> asyncio.Future, until the silence exists
+            instance._batch = {}     # (alertmanager url, labels) -> created_by, presses of the current window
+            instance._flush_timer = None
+            instance._refresher = None
+
+        return cls._instance
+
+    def __init__(self, logger: logging.Logger = logger):
+        # No initialization here, it's all handled in __new__
+        # Arguments should be same as __new__ method
+        pass
+
+    async def remember(self, alertmanager_url: str, labels: Dict[str, str]) -> Optional[str]:
+        """
+        Keep the labels of an alert group for its silence button.
+
+        Returns:
+            The callback data of the button, None if the state backend can't be reached.
+        Raises:
+            ValueError: If `alertmanager_url` is not a configured Alertmanager.
+        """
+        if trusted_alertmanager_url(alertmanager_url) is None:
+            raise ValueError(f"{alertmanager_url} is not a configured Alertmanager")
+        callback_id = secrets.token_urlsafe(12)
+        value = orjson.dumps({"url": alertmanager_url, "labels": labels}).decode()
+        try:
+            await get_state_backend().set(SILENCE_KEY_PREFIX + callback_id, value, ttl=SILENCE_CALLBACK_TTL)
+        except StateBackendError as e:
+            self.logger.warning(f"Could not keep the labels of a silence button: {e}")
+            return None
+        self._index(alertmanager_url)
+        return SILENCE_CALLBACK_PREFIX + callback_id
+
+    async def silence_callback(self, callback_data: str, created_by: str) -> Optional[Silence]:
+        """
+        Silence the alert group behind a silence button.
+
+        Returns:
+            The silence, None if the button expired or its Alertmanager is no longer configured.
+        Raises:
+            Exception: If Alertmanager could not create the silence.
+        """
+        callback_id = callback_data[len(SILENCE_CALLBACK_PREFIX):]
+        try:
+            value = await get_state_backend().get(SILENCE_KEY_PREFIX + callback_id)
+        except StateBackendError:
+            alertbot_silences_counter.labels(result="failed").inc()
+            raise
+        if value is None:
+            alertbot_silences_counter.labels(result="expired").inc()
+            return None
+        entry = orjson.loads(value)
+        if trusted_alertmanager_url(entry["url"]) is None:
+            # Kept by a replica, or a run, with other Alertmanagers configured
+            self.logger.warning(f"Not silencing in {entry['url']}, it is not a configured Alertmanager")
+            alertbot_silences_counter.labels(result="expired").inc()
+            return None
+        try:
+            silence = await self.silence(entry["url"], entry["labels"], created_by)
+        except Exception:
+            alertbot_silences_counter.labels(result="failed").inc()
+            raise
+        alertbot_silences_counter.labels(result="created" if silence.created else "already_silenced").inc()
+        return silence
+
+    async def silence(self, alertmanager_url: str, labels: Dict[str, str], created_by: str) -> Silence:
+        """
+        Silence `labels` for SILENCE_DURATION_SECONDS, unless an active silence already covers
+        them. The silence is created with the other presses of the batching window.
+        """
+        index = self._index(alertmanager_url)
+        existing = index.find(labels)
+        if existing is not None:
+            return existing
+
+        key = (alertmanager_url, tuple(sorted(labels.items())))
+        future = self._creating.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._creating[key] = future
+            self._batch[key] = created_by
+            if self._flush_timer is None:
+                self._flush_timer = asyncio.create_task(self._flush_later(SILENCE_BATCH_WINDOW_MS / 1000))
+        # Shield it so a cancelled press does not fail the others waiting for the same silence
+        return await asyncio.shield(future)
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._flush_timer = None
+        batch, self._batch = self._batch, {}
+        self.logger.info(f"Creating {len(batch)} silences")
+        await asyncio.gather(*(self._create(key, created_by) for key, created_by in batch.items()))
+
+    async def _create(self, key: tuple, created_by: str):
+        future = self._creating[key]
+        try:
+            future.set_result(await self._create_silence(key, created_by))
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may wait for it, don't let asyncio complain it was never retrieved
+            future.exception()
+        finally:
+            del self._creating[key]
+
+    async def _create_silence(self, key: tuple, created_by: str) -> Silence:
+        alertmanager_url, labels = key
+        labels = dict(labels)
+        index = self._index(alertmanager_url)
+        # A silence may have appeared since the press, e.g. created by another replica
+        existing = index.find(labels)
+        if existing is not None:
+            return existing
+        starts_at = datetime.now(timezone.utc)
+        ends_at = starts_at + timedelta(seconds=SILENCE_DURATION_SECONDS)
+        silence = {
+            "matchers": [{"name": name, "value": value, "isRegex": False, "isEqual": True}
+                         for name, value in labels.items()],
+            "startsAt": starts_at.isoformat().replace("+00:00", "Z"),
+            "endsAt": ends_at.isoformat().replace("+00:00", "Z"),
+            "createdBy": created_by,
+            "comment": "Silenced from telegram by alertbot",
+        }
+        try:
+            silence["id"] = await get_alertmanager_client(alertmanager_url).create_silence(silence)
+        except Exception as e:
+            self.logger.error(f"Failed to create a silence in {alertmanager_url} for {labels}: {e!r}")
+            raise
+        index.add(silence, ends_at)
+        return Silence(silence_id=silence["id"], ends_at=ends_at)
+
+    def _index(self, alertmanager_url: str) -> SilenceIndex:
+        index = self._indexes.get(alertmanager_url)
+        if index is None:
+            index = SilenceIndex(alertmanager_url)
+            self._indexes[alertmanager_url] = index
+        return index
+
+    def start(self):
+        """Refresh the silence index of every known Alertmanager on the running event loop"""
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_indexes(), name="silence-index")
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+    async def _refresh_indexes(self):
+        while True:
+            for url, index in list(self._indexes.items()):
+                try:
+                    await index.refresh()
+                except Exception as e:
+                    # The index keeps what it had, presses still ask Alertmanager when it misses
+                    self.logger.warning(f"Failed to refresh the silences of {url}: {e!r}")
+            await asyncio.sleep(SILENCE_INDEX_REFRESH_SECONDS)
@@ -0,0 +1,37 @@
+import re
+
+PLACEHOLDER_PATTERN = re.compile(r"##([A-Z_]+)##")
+
+class CompiledTemplate:
+    """
+    A `##PLACEHOLDER##` template split once into literal and placeholder segments, so rendering
+    is a single pass that joins a list instead of a chain of `str.replace` calls.
+
+    Segments are `(name, text)` pairs: `name` is None for a literal, placeholders keep their
+    `##NAME##` text for when there is no value.
+    """
+    __slots__ = ("source", "segments", "placeholders")
+
+    def __init__(self, source: str):
+        self.source = source
+        segments = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            if match.start() > position:
+                segments.append((None, source[position:match.start()]))
+            segments.append((match.group(1), match.group(0)))
+            position = match.end()
+        if position < len(source):
+            segments.append((None, source[position:]))
+        self.segments = tuple(segments)
+        self.placeholders = frozenset(name for name, text in segments if name is not None)
+
+    def render_into(self, parts: list, values: dict):
+        """
+        Append the rendered template to `parts`. Placeholders missing from `values`
+        are kept as they are, like an unmatched `str.replace` would.
+        """
+        parts.extend([text if name is None else values.get(name, text) for name, text in self.segments])
+
+    def render(self, values: dict) -> str:
+        return "".join([text if name is None else values.get(name, text) for name, text in self.segments])
@@ -1,10 +1,31 @@
-from dateutil import parser, tz
+from collections import Counter
+from dateutil import tz
 from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from alertbot.schemas import AlertRequestPrometheus, AlertPrometheus
+from alertbot.env import TIMEZONE
 from utils.metrics import alertbot_templater_sms_alert_counter
+from utils.datetime_parser import parse_rfc3339
 import logging
+from templaters.compiled_template import CompiledTemplate
 from .templates import SMS_ALERT_TEMPLATES
 
+logger = logging.getLogger(__name__)
+
+SMS_ALERTS = [CompiledTemplate(template) for template in SMS_ALERT_TEMPLATES]
+
+try:
+    LOCAL_ZONE = ZoneInfo(TIMEZONE)
+except (ZoneInfoNotFoundError, ValueError):
+    logger.warning(f"Timezone {TIMEZONE} not found, using the system timezone for SMS dates")
+    LOCAL_ZONE = tz.tzlocal()
+
+@lru_cache(maxsize=4096)
+def local_datetime(timestamp: str) -> datetime:
+    """Converts an alert timestamp to TIMEZONE, without the sub-second part"""
+    return parse_rfc3339(timestamp).replace(microsecond=0).astimezone(LOCAL_ZONE)
+
 
 class SMSTemplater:
     def __init__(self, alert_group: AlertRequestPrometheus, template: int = 0):
@@ -13,46 +34,38 @@ class SMSTemplater:
         self.alert_group = alert_group
         self.alert_name = ""
         self.cluster_name = ""
+        alert_names = Counter()
         for alert in alert_group.alerts:
             self._add_alert_to_messages(alert)
+            alert_names[self.alert_name] += 1
+        severity = self.alert_group.commonLabels.get("severity", "unknown").lower()
+        cluster = self.alert_group.commonLabels.get("cluster", "unknown").lower()
+        for alert_name, count in alert_names.items():
             alertbot_templater_sms_alert_counter.labels(
                 status=self.alert_group.status, 
-                alertname=self.alert_name, 
-                severity=self.alert_group.commonLabels.get("severity", "unknown").lower(),
-                cluster=self.alert_group.commonLabels.get("cluster", "unknown").lower()
-            ).inc()
+                alertname=alert_name, 
+                severity=severity,
+                cluster=cluster
+            ).inc(count)
         
     def _add_alert_to_messages(self, alert: AlertPrometheus):
-        message = SMS_ALERT_TEMPLATES[self.template] # self.alert_group.commonLabels.get("cluster", "No Cluster!")
-        message = message.replace("##STATUS##", self.alert_group.status.capitalize())
-
         self.alert_name = alert.labels.get("alertname", "No Alertname")
-        message = message.replace("##ALERTNAME##", self.alert_name)
-
         self.cluster_name = alert.labels.get("cluster", "No Clustername")
-        message = message.replace("##CLUSTER##", self.cluster_name)
-        
-        message = message.replace("##DESCRIPTION##", 
-                alert.annotations.get("description", "NO DESCRIPTION!"))
-        message = self._add_datetime(message, alert)
+        values = {
+            "STATUS": self.alert_group.status.capitalize(),
+            "ALERTNAME": self.alert_name,
+            "CLUSTER": self.cluster_name,
+            "DESCRIPTION": alert.annotations.get("description", "NO DESCRIPTION!")
+        }
+        self._add_datetime(values, alert)
 
-        self.messages.append(message)
+        self.messages.append(SMS_ALERTS[self.template].render(values))
 
-    def _add_datetime(self, message, alert):
+    def _add_datetime(self, values, alert):
         if "firing" in alert.status.lower():
-            UTC = parser.parse(alert.startsAt).strftime("%Y-%m-%d %H:%M:%S")
-            correct_date = self._convert_date_time(UTC)
-            message = message.replace("##DATETIME##", f"Started: {correct_date}")
+            values["DATETIME"] = f"Started: {local_datetime(alert.startsAt)}"
         elif "resolved" in alert.status.lower():
-            UTC = parser.parse(alert.endsAt).strftime("%Y-%m-%d %H:%M:%S")
-            correct_date = self._convert_date_time(UTC)
-            message = message.replace("##DATETIME##", f"Resolved: {correct_date}")
-        return message
-
-    def _convert_date_time(self, UTC):
-        from_zone = tz.tzutc()
-        to_zone = tz.tzlocal()
-        return datetime.strptime(UTC, '%Y-%m-%d %H:%M:%S').replace(tzinfo=from_zone).astimezone(to_zone)
+            values["DATETIME"] = f"Resolved: {local_datetime(alert.endsAt)}"
     
     def get_messages(self):
         return self.messages
@@ -1,6 +1,8 @@
 from alertbot.schemas import AlertRequestPrometheus, \
     AlertPrometheus
 from utils.metrics import alertbot_templater_telegram_alert_counter
+from templaters.compiled_template import CompiledTemplate
+from functools import lru_cache
 from .exceptions import TemplateTelegramError
 from .templates import SIGNS, UNKNOWN_SIGN, \
     FIRING_HEADERS_TEMPLATES, FIRING_BODY_TEMPLATE, \
@@ -8,6 +10,18 @@ from .templates import SIGNS, UNKNOWN_SIGN, \
 import logging
 
 logger = logging.getLogger(__name__) 
+
+# Compiled once, rendering a group is then linear in the size of the message
+FIRING_HEADERS = [CompiledTemplate(template) for template in FIRING_HEADERS_TEMPLATES]
+FIRING_BODIES = [CompiledTemplate(template) for template in FIRING_BODY_TEMPLATE]
+RESOLVED_HEADERS = [CompiledTemplate(template) for template in RESOLVED_HEADERS_TEMPLATES]
+RESOLVED_BODIES = [CompiledTemplate(template) for template in RESOLVED_BODY_TEMPLATE]
+
+@lru_cache(maxsize=1024)
+def render_header(header: CompiledTemplate, sign: str, alertname: str, cluster: str, summary: str) -> str:
+    """The groups of an alert come back every repeat interval, their header is rendered once"""
+    return sign + header.render({"ALERTNAME": alertname, "CLUSTER": cluster, "SUMMARY": summary})
+
 class TelegramTemplater:
     def __init__(self,
                  alert_group: AlertRequestPrometheus,
@@ -17,67 +31,80 @@ class TelegramTemplater:
         self.template = template
         self.severity = self.alert_group.commonLabels["severity"].lower() # without severity we except to face an error!
         self.cluster = self.alert_group.commonLabels.get("cluster", "No Cluster!") # Without cluster we can work!
-        self.message = ""
+        self.status = self.alert_group.status.lower()
+        self.message = None
 
-        self.generate_header()
-        for alert in self.alerts:
-            self.generate_body(alert)
-            alertbot_templater_telegram_alert_counter.labels(
-                status=self.alert_group.status.lower(), 
-                alertname=self.alert_group.commonLabels.get("alertname","unknown").lower(), 
-                severity=self.alert_group.commonLabels.get("severity", "unknown").lower(),
-                cluster=self.alert_group.commonLabels.get("cluster", "unknown").lower()
-            ).inc()
+        self.header = self.generate_header()
+        # Bodies are rendered when the message is read, their templates are picked now so an
+        # alert that can't be rendered fails here
+        self.bodies = [self.body_template(alert) for alert in self.alerts]
+        # Every label comes from the group, count all its alerts at once
+        alertbot_templater_telegram_alert_counter.labels(
+            status=self.status, 
+            alertname=self.alert_group.commonLabels.get("alertname","unknown").lower(), 
+            severity=self.alert_group.commonLabels.get("severity", "unknown").lower(),
+            cluster=self.alert_group.commonLabels.get("cluster", "unknown").lower()
+        ).inc(len(self.alerts))
             
-    def generate_header(self):
-        if "firing" in self.alert_group.status.lower():
-            self.message += SIGNS.get(self.severity, UNKNOWN_SIGN)
-            self.message += FIRING_HEADERS_TEMPLATES[self.template]
+    def generate_header(self) -> str:
+        if "firing" in self.status:
+            sign = SIGNS.get(self.severity, UNKNOWN_SIGN)
+            header = FIRING_HEADERS[self.template]
 
-        elif "resolved" in self.alert_group.status.lower():
-            self.message += SIGNS.get("resolved", UNKNOWN_SIGN)
-            self.message += RESOLVED_HEADERS_TEMPLATES[self.template]
+        elif "resolved" in self.status:
+            sign = SIGNS.get("resolved", UNKNOWN_SIGN)
+            header = RESOLVED_HEADERS[self.template]
         else:
             logger.error(f"{self.alert_group.status} was not recognized among valid alert status!")
             raise TemplateTelegramError()
-        self.message = self.message.replace("##ALERTNAME##", 
-                self.alert_group.commonLabels.get("alertname", "No alertname has been added for this alert!"))
-        
-        self.message = self.message.replace("##CLUSTER##", self.cluster)
-        
-        self.message = self.message.replace("##SUMMARY##", 
-                self.alert_group.commonAnnotations.get("summary", "No summary has been added for this alert!"))
+        return render_header(
+            header, sign,
+            self.alert_group.commonLabels.get("alertname", "No alertname has been added for this alert!"),
+            self.cluster,
+            self.alert_group.commonAnnotations.get("summary", "No summary has been added for this alert!")
+        )
     
-    def add_run_book(self,
-                     alert: AlertPrometheus):
+    def get_run_book(self,
+                     alert: AlertPrometheus) -> str:
         runbook_url = alert.annotations.get("runbook_url", None)
         if runbook_url != None:
-            self.message = self.message.replace("##RUNBOOK_URL##", \
-            f"\n<a href=\"{alert.annotations.get('runbook_url')}\">Document</a>")
+            return f"\n<a href=\"{runbook_url}\">Document</a>"
+        return ""
 
-        else:
-            self.message = self.message.replace("##RUNBOOK_URL##", "")
-
-    def generate_body(self, 
-                      alert: AlertPrometheus):
+    def body_template(self,
+                      alert: AlertPrometheus) -> CompiledTemplate:
         if "firing" in alert.status.lower():
-            self.message += FIRING_BODY_TEMPLATE[self.template]
+            return FIRING_BODIES[self.template]
         elif "resolved" in alert.status.lower():
-            self.message += RESOLVED_BODY_TEMPLATE[self.template]
-        else:
-            logger.error(f"{alert.status} was not recognized among valid alert status!")
-            raise TemplateTelegramError()
-        
-        self.message = self.message.replace("##DESCRIPTION##", 
-                alert.annotations.get("description", "NO DESCRIPTION!"))
-        
-        self.add_run_book(alert)
+            return RESOLVED_BODIES[self.template]
+        logger.error(f"{alert.status} was not recognized among valid alert status!")
+        raise TemplateTelegramError()
+
+    def generate_body(self, 
+                      alert: AlertPrometheus,
+                      template: CompiledTemplate = None) -> str:
+        return (template or self.body_template(alert)).render({
+            "DESCRIPTION": alert.annotations.get("description", "NO DESCRIPTION!"),
+            "RUNBOOK_URL": self.get_run_book(alert)
+        })
+
+    def iter_parts(self):
+        """
+        Yields the header and then every alert of the message, rendered one at a time, so a
+        large group can be sent (see message_splitter.iter_chunks) without building all of it.
+        """
+        yield self.header
+        for alert, template in zip(self.alerts, self.bodies):
+            yield self.generate_body(alert, template)
 
     def get_message(self):
+        if self.message is None:
+            self.message = self.header + "".join([self.generate_body(alert, template)
+                                                  for alert, template in zip(self.alerts, self.bodies)])
         return self.message
     
     def get_cluster(self):
         return self.cluster
 
     def get_severity(self):
-        return self.severity
\ No newline at end of file
+        return self.severity
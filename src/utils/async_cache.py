@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+from .metrics import alertbot_cache_requests_counter, alertbot_cache_load_seconds
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("alertbot")
+
+class AsyncTTLCache:
+    """
+    A bounded cache in front of an async loader.
+
+    - Values younger than `ttl` are served as they are (hit).
+    - Values younger than `ttl + stale_ttl` are served right away while a single
+      background refresh is started (stale).
+    - Older or missing values are loaded before returning (miss).
+
+    Concurrent loads of the same key share one call to `loader`.
+    """
+
+    def __init__(self,
+                 name: str,
+                 loader: Callable[[Hashable], Awaitable[Any]],
+                 ttl: float = 60,
+                 stale_ttl: float = 300,
+                 max_entries: int = 1024):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, loaded_at)
+        self._inflight = {}            # key -> asyncio.Task
+
+    async def get(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age < self.ttl:
+                alertbot_cache_requests_counter.labels(cache=self.name, result="hit").inc()
+                return value
+            if age < self.ttl + self.stale_ttl:
+                alertbot_cache_requests_counter.labels(cache=self.name, result="stale").inc()
+                self._load(key)
+                return value
+
+        result = "coalesced" if key in self._inflight else "miss"
+        alertbot_cache_requests_counter.labels(cache=self.name, result=result).inc()
+        # Shield it so a cancelled caller does not cancel the load other callers wait for
+        return await asyncio.shield(self._load(key))
+
+    def invalidate(self, key: Hashable = None):
+        """Forget one key, or everything if no key is given"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _load(self, key: Hashable) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run_loader(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._loaded(key, done))
+        return task
+
+    async def _run_loader(self, key: Hashable) -> Any:
+        start = time.perf_counter()
+        try:
+            return await self.loader(key)
+        finally:
+            alertbot_cache_load_seconds.labels(cache=self.name).observe(time.perf_counter() - start)
+
+    def _loaded(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            alertbot_cache_requests_counter.labels(cache=self.name, result="load_error").inc()
+            logger.error(f"Loading {key} into {self.name} cache failed: {error!r}")
+            return
+        self._entries[key] = (task.result(), time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
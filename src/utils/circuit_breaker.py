@@ -0,0 +1,135 @@
+from alertbot.env import CIRCUIT_BREAKER_ENABLED, CIRCUIT_BREAKER_FAILURE_THRESHOLD, \
+    CIRCUIT_BREAKER_RECOVERY_TIMEOUT, CIRCUIT_BREAKER_HALF_OPEN_CALLS
+from .metrics import (
+    alertbot_circuit_breaker_state,
+    alertbot_circuit_breaker_transitions_counter,
+    alertbot_circuit_breaker_rejected_counter
+)
+import logging
+import threading
+import time
+
+logger = logging.getLogger("alertbot")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+    retriable = False
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Circuit for {host} is open, not calling it for another {retry_in:.1f} seconds")
+        self.host = host
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after `failure_threshold` consecutive failures.
+
+    While open every call fails right away. After `recovery_timeout` seconds the circuit is
+    half-open and lets `half_open_calls` probes through: a successful probe closes it again,
+    a failed one opens it for another `recovery_timeout`.
+    Calls may come from the event loop and from worker threads.
+    """
+
+    def __init__(self, host: str,
+                 failure_threshold: int = 5,
+                 recovery_timeout: float = 30,
+                 half_open_calls: int = 1):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._half_open_at = 0.0
+        self._lock = threading.Lock()
+        alertbot_circuit_breaker_state.labels(host=host).set(STATE_VALUES[CLOSED])
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"Circuit for {self.host} is now {state} (was {self.state})")
+        self.state = state
+        alertbot_circuit_breaker_state.labels(host=self.host).set(STATE_VALUES[state])
+        alertbot_circuit_breaker_transitions_counter.labels(host=self.host, state=state).inc()
+
+    def before_call(self):
+        """
+        Raises:
+            CircuitOpenError: If the upstream should not be called now.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN:
+                retry_in = self._opened_at + self.recovery_timeout - now
+                if retry_in > 0:
+                    alertbot_circuit_breaker_rejected_counter.labels(host=self.host).inc()
+                    raise CircuitOpenError(self.host, retry_in)
+                self._transition(HALF_OPEN)
+                self._probes = 0
+                self._half_open_at = now
+            elif now - self._half_open_at > self.recovery_timeout:
+                # The probes never reported back (e.g. they were cancelled), let new ones through
+                self._probes = 0
+                self._half_open_at = now
+            if self._probes >= self.half_open_calls:
+                alertbot_circuit_breaker_rejected_counter.labels(host=self.host).inc()
+                raise CircuitOpenError(self.host, 0)
+            self._probes += 1
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(OPEN)
+
+
+class _DisabledCircuitBreaker:
+    """Used for every host when CIRCUIT_BREAKER_ENABLED is off"""
+    state = CLOSED
+
+    def before_call(self):
+        pass
+
+    def record_success(self):
+        pass
+
+    def record_failure(self):
+        pass
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_disabled = _DisabledCircuitBreaker()
+
+def get_circuit_breaker(host: str) -> CircuitBreaker:
+    """Returns the circuit breaker shared by every call to `host`"""
+    if not CIRCUIT_BREAKER_ENABLED:
+        return _disabled
+    breaker = _breakers.get(host)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    host,
+                    failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                    recovery_timeout=CIRCUIT_BREAKER_RECOVERY_TIMEOUT,
+                    half_open_calls=CIRCUIT_BREAKER_HALF_OPEN_CALLS)
+                _breakers[host] = breaker
+    return breaker
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+from dateutil import parser
+import re
+
+# Alertmanager sends startsAt/endsAt as RFC3339, e.g. 2024-05-01T10:04:05.123456789Z
+RFC3339_PATTERN = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?"
+    r"(?:([Zz])|([+-])(\d{2}):(\d{2}))$"
+)
+
+def parse_rfc3339(value: str) -> datetime:
+    """
+    Parses an RFC3339 timestamp into an aware datetime, falling back to dateutil for
+    anything else. Timestamps without an offset are taken as UTC.
+    """
+    match = RFC3339_PATTERN.match(value)
+    if match is None:
+        result = parser.parse(value)
+        return result if result.tzinfo is not None else result.replace(tzinfo=timezone.utc)
+
+    year, month, day, hour, minute, second, fraction, zulu, sign, offset_hours, offset_minutes = match.groups()
+    if zulu:
+        tzinfo = timezone.utc
+    else:
+        offset = timedelta(hours=int(offset_hours), minutes=int(offset_minutes))
+        tzinfo = timezone(-offset if sign == "-" else offset)
+    microsecond = int(fraction[:6].ljust(6, "0")) if fraction else 0
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                    microsecond, tzinfo=tzinfo)
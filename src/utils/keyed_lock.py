@@ -0,0 +1,27 @@
+from contextlib import asynccontextmanager
+from typing import Hashable
+import asyncio
+
+class KeyedLock:
+    """
+    One asyncio.Lock per key, created on first use and dropped once nobody holds
+    or waits for it, so the number of keys (e.g. chats) doesn't grow the memory.
+    """
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, users]
+
+    @asynccontextmanager
+    async def __call__(self, key: Hashable):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
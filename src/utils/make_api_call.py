@@ -1,11 +1,77 @@
 from .metrics import api_call_status_count
-import requests
-import time
+from .retry import RetryPolicy, retriable_status
+from .circuit_breaker import get_circuit_breaker, CircuitOpenError
+from .metric_labels import route_template
+from alertbot.env import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_TOTAL_TIMEOUT, \
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY, \
+    HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_RETRY_DEADLINE
+from urllib.parse import urlsplit
+import asyncio
+import httpx
 import logging
 
 logger = logging.getLogger("alertbot")
 
-def make_api_call(
+# One pooled client per `verify` value, shared by every caller of make_api_call
+_clients = {}
+_host_semaphores = {}
+
+def get_http_client(verify: bool = True) -> httpx.AsyncClient:
+    """
+    Returns the shared AsyncClient for the given `verify` value, creating it on first use.
+    Connections are kept alive and reused between calls.
+    """
+    client = _clients.get(verify)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            verify=verify,
+            timeout=httpx.Timeout(
+                connect=HTTP_CONNECT_TIMEOUT,
+                read=HTTP_READ_TIMEOUT,
+                write=HTTP_READ_TIMEOUT,
+                pool=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+        )
+        _clients[verify] = client
+    return client
+
+async def close_http_clients():
+    "Close every pooled connection, used on application shutdown"
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
+    _host_semaphores.clear()
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+        _host_semaphores[host] = semaphore
+    return semaphore
+
+def _body_arguments(payload) -> dict:
+    # Keep the requests-style `data=payload` behaviour: dicts are form encoded,
+    # strings and bytes are sent as they are.
+    if payload is None:
+        return {}
+    if isinstance(payload, (str, bytes)):
+        return {"content": payload}
+    if isinstance(payload, list):
+        return {"json": payload}
+    return {"data": payload}
+
+def _retry_after_header(response) -> float:
+    """Seconds asked by a `Retry-After` header, None when there is none or it is a date"""
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+async def make_api_call(
         method: str, # GET, POST, etc.
         url: str, 
         headers: dict = {},
@@ -13,28 +79,63 @@ def make_api_call(
         params: dict = {},
         retry_count: int = 1,
         verify: bool = True,
-        retry_interval: float = 0.5):
-    response = None
-    for i in range(retry_count):
+        retry_interval: float = 0.5,
+        deadline: float = HTTP_RETRY_DEADLINE):
+    """
+    Call `url` with the shared client, retrying up to `retry_count` attempts on connection
+    errors, 429 and 5xx responses. Other 4xx responses are returned right away.
+    Connection errors and 5xx responses count against the circuit breaker of the host.
+
+    Returns:
+        The last response, or None if no attempt got one.
+
+    Raises:
+        CircuitOpenError: If the circuit of the host is open.
+    """
+    client = get_http_client(verify)
+    breaker = get_circuit_breaker(urlsplit(url).netloc)
+    # Tokens and API keys in the path (telegram, kavenegar) are kept out of the logs
+    route = route_template(url)
+
+    async def attempt():
+        breaker.before_call()
         try:
-            logger.debug(f"Calling {url} with method {method}")
-            response = requests.request(method, url, headers=headers, data=payload, params=params,
-                                        verify=verify)
+            logger.debug(f"Calling {route} with method {method}")
+            async with _host_semaphore(url):
+                response = await asyncio.wait_for(
+                    client.request(method, url, headers=headers, params=params,
+                                   **_body_arguments(payload)),
+                    timeout=HTTP_TOTAL_TIMEOUT)
         except Exception as e:
-            logger.error(f"Error Happened During calling {url} with method {method}")
-            logger.error(f"{e}")
-            time.sleep(retry_interval)
+            breaker.record_failure()
+            logger.error(f"Error Happened During calling {route} with method {method}")
+            logger.error(f"{e!r}")
+            raise
+        api_call_status_count.labels(
+                destination=route, 
+                status_code=response.status_code, 
+                method=method
+        ).inc()
+        if response.status_code >= 500:
+            breaker.record_failure()
         else:
-            api_call_status_count.labels(
-                    destination=url, 
-                    status_code=response.status_code, 
-                    method=method
-            ).inc()
-            if response.status_code < 400:
-                logger.debug(f"{url} Called Successfuly, Response Status Code: {response.status_code}")
-                break
-            logger.error(f"Got Status error code{response.status_code} during calling {url}")
-
-
-    
-    return response
+            breaker.record_success()
+        if response.status_code < 400:
+            logger.debug(f"{route} Called Successfuly, Response Status Code: {response.status_code}")
+        else:
+            logger.error(f"Got Status error code{response.status_code} during calling {route}")
+        return response
+
+    policy = RetryPolicy(
+        name="http",
+        max_attempts=retry_count,
+        base_delay=retry_interval,
+        deadline=deadline,
+        retry_if_result=lambda response: retriable_status(response.status_code),
+        retry_after=_retry_after_header)
+    try:
+        return await policy.run_async(attempt)
+    except CircuitOpenError:
+        raise
+    except Exception:
+        return None
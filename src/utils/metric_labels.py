@@ -0,0 +1,47 @@
+from functools import lru_cache
+from urllib.parse import urlsplit
+from alertbot.env import SMS_NUMBER_METRIC_MODE, SMS_NUMBER_METRIC_BUCKETS
+import hashlib
+import re
+
+# Path segments that identify a call instead of a route
+BOT_TOKEN_SEGMENT = re.compile(r"^bot\d+:[\w-]+$")
+NUMERIC_SEGMENT = re.compile(r"^-?\d+$")
+UUID_SEGMENT = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+SECRET_SEGMENT = re.compile(r"^(?=.*\d)[\w=-]{20,}$")  # API keys put in the path, e.g. kavenegar
+
+def _segment_template(segment: str) -> str:
+    if BOT_TOKEN_SEGMENT.match(segment):
+        return "bot{token}"
+    if NUMERIC_SEGMENT.match(segment) or UUID_SEGMENT.match(segment):
+        return "{id}"
+    if SECRET_SEGMENT.match(segment):
+        return "{token}"
+    return segment
+
+@lru_cache(maxsize=1024)
+def route_template(url: str) -> str:
+    """
+    Reduce a URL to its route, without the query string and with tokens and ids replaced,
+    e.g. https://api.telegram.org/bot123:abc/sendMessage -> https://api.telegram.org/bot{token}/sendMessage
+    """
+    parts = urlsplit(url)
+    path = "/".join(_segment_template(segment) for segment in parts.path.split("/"))
+    return f"{parts.scheme}://{parts.netloc}{path}"
+
+@lru_cache(maxsize=4096)
+def sms_number_label(number: str) -> str:
+    """
+    The `number` label of alertbot_sent_sms_per_number according to SMS_NUMBER_METRIC_MODE:
+    raw keeps the number, hashed replaces it by a short stable hash and bucketed
+    spreads numbers over SMS_NUMBER_METRIC_BUCKETS series.
+    """
+    if SMS_NUMBER_METRIC_MODE == "hashed":
+        return hashlib.sha256(number.encode()).hexdigest()[:12]
+    if SMS_NUMBER_METRIC_MODE == "bucketed":
+        bucket = int(hashlib.sha256(number.encode()).hexdigest(), 16) % SMS_NUMBER_METRIC_BUCKETS
+        return f"bucket-{bucket}"
+    return number
+
+def sms_number_metric_enabled() -> bool:
+    return SMS_NUMBER_METRIC_MODE != "disabled"
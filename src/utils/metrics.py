@@ -1,54 +1,273 @@
-from prometheus_client  import Counter, Gauge
+from prometheus_client  import Counter, Gauge, Histogram
+from alertbot.env import METRICS_MAX_SERIES
+import threading
 
-alertbot_keycloak_group_members = Gauge(
+# With several workers (PROMETHEUS_MULTIPROC_DIR set), gauges are aggregated across the
+# processes as their `multiprocess_mode` says, it is ignored otherwise
+
+OVERFLOW_LABEL = "__overflow__"
+
+alertbot_metric_series_overflow_counter = Counter(
+    name="alertbot_metric_series_overflow",
+    documentation="Number of observations folded into the overflow series because a metric hit its series cap",
+    labelnames=["metric"]
+)
+
+class LimitedLabels:
+    """
+    Wraps a labelled metric to cache its children and cap how many label sets it creates.
+    Once `max_series` label sets exist, new ones are all recorded under a single series
+    whose labels are OVERFLOW_LABEL. Everything else is passed through to the metric.
+    """
+
+    def __init__(self, metric, max_series: int = METRICS_MAX_SERIES):
+        self._metric = metric
+        self._labelnames = metric._labelnames
+        self.max_series = max_series
+        self._children = {}
+        self._overflow = None
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **labels):
+        if labels:
+            key = tuple(str(labels[name]) for name in self._labelnames)
+        else:
+            key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._create(key)
+        return child
+
+    def _create(self, key: tuple):
+        with self._lock:
+            child = self._children.get(key)
+            if child is not None:
+                return child
+            if len(self._children) >= self.max_series:
+                alertbot_metric_series_overflow_counter.labels(metric=self._metric._name).inc()
+                if self._overflow is None:
+                    self._overflow = self._metric.labels(*([OVERFLOW_LABEL] * len(self._labelnames)))
+                return self._overflow
+            child = self._metric.labels(*key)
+            self._children[key] = child
+            return child
+
+    def __getattr__(self, name):
+        return getattr(self._metric, name)
+
+
+alertbot_keycloak_group_members = LimitedLabels(Gauge(
     name='alertbot_keycloak_group_members',
     documentation='showing the number of member in keycloak groups that alertbot uses',
-    labelnames=['group_name'] 
-)
+    labelnames=['group_name'],
+    multiprocess_mode='mostrecent'
+))
 
-alertbot_sent_sms_per_number_counter = Counter(
+alertbot_sent_sms_per_number_counter = LimitedLabels(Counter(
     name='alertbot_sent_sms_per_number',
     documentation='Number of time alertbot tried to send alert to a number',
     labelnames=['group_name','cluster', 'number']
-)
+))
 
-alertbot_sent_sms_per_cluster_counter = Counter(
+alertbot_sent_sms_per_cluster_counter = LimitedLabels(Counter(
     name='alertbot_sent_sms_per_cluster',
     documentation='Number of time alertbot tried to send alert to the keycloak group',
     labelnames=['group_name','cluster']
-)
+))
 
-alertbot_failed_sent_sms_per_cluster_counter = Counter(
+alertbot_failed_sent_sms_per_cluster_counter = LimitedLabels(Counter(
     name='alertbot_failed_sent_sms_per_cluster',
     documentation='Number of time alertbot failed to send alert to the keycloak group',
     labelnames=['group_name','cluster']
-)
+))
 
-alertbot_sent_telegram_per_receiver_counter = Counter(
+alertbot_sent_telegram_per_receiver_counter = LimitedLabels(Counter(
     name='alertbot_sent_telegram_per_receiver',
     documentation='Number of telegram messages sent by Alertbot',
     labelnames=['cluster', 'severity', 'receiver']
-)
+))
 
-alertbot_failed_sent_telegram_per_receiver_counter = Counter(
+alertbot_failed_sent_telegram_per_receiver_counter = LimitedLabels(Counter(
     name='alertbot_failed_sent_telegram_per_receiver',
     documentation='Number of telegram messages sent by Alertbot',
     labelnames=['cluster', 'severity', 'receiver']
-)
+))
 
-alertbot_templater_sms_alert_counter = Counter(
+alertbot_templater_sms_alert_counter = LimitedLabels(Counter(
     name="alertbot_templater_sms_alert",
     documentation='Number of times each alertname is being used to be sent to sms',
     labelnames=["status", "alertname", "cluster", "severity"]
-)
+))
 
 
-alertbot_templater_telegram_alert_counter = Counter(
+alertbot_templater_telegram_alert_counter = LimitedLabels(Counter(
     name="alertbot_templater_telegram_alert",
     documentation='Number of times each alertname is being used to be sent to telegram',
     labelnames=["status", "alertname", "cluster", "severity"]
-)
+))
 
-api_call_status_count = Counter(name="api_call_status_count",
+# `destination` is the route template of the URL, see utils.metric_labels.route_template
+api_call_status_count = LimitedLabels(Counter(name="api_call_status_count",
                                 documentation="number of times other apis have been called and the status code received",
-                                labelnames=("destination", "status_code", "method"))
\ No newline at end of file
+                                labelnames=("destination", "status_code", "method")))
+
+alertbot_delivery_queue_depth = Gauge(
+    name="alertbot_delivery_queue_depth",
+    documentation="Number of deliveries waiting in the delivery queue",
+    multiprocess_mode="livesum"
+)
+
+alertbot_delivery_queue_wait_seconds = Histogram(
+    name="alertbot_delivery_queue_wait_seconds",
+    documentation="Time a delivery spent in the queue before a worker picked it up",
+    labelnames=["source", "channel"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+alertbot_delivery_workers = Gauge(
+    name="alertbot_delivery_workers",
+    documentation="Number of delivery workers started",
+    multiprocess_mode="livesum"
+)
+
+alertbot_delivery_workers_busy = Gauge(
+    name="alertbot_delivery_workers_busy",
+    documentation="Number of delivery workers currently rendering or sending an alert",
+    multiprocess_mode="livesum"
+)
+
+alertbot_delivery_jobs_counter = Counter(
+    name="alertbot_delivery_jobs",
+    documentation="Number of deliveries processed by the delivery workers and their result",
+    labelnames=["source", "channel", "result"]
+)
+
+alertbot_delivery_rejected_counter = Counter(
+    name="alertbot_delivery_rejected",
+    documentation="Number of deliveries rejected because the delivery queue was full",
+    labelnames=["source"]
+)
+
+
+alertbot_cache_requests_counter = Counter(
+    name="alertbot_cache_requests",
+    documentation="Number of cache lookups by result (hit, stale, miss, coalesced, load_error)",
+    labelnames=["cache", "result"]
+)
+
+alertbot_cache_load_seconds = Histogram(
+    name="alertbot_cache_load_seconds",
+    documentation="Time spent loading a cache entry from its upstream",
+    labelnames=["cache"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+
+alertbot_telegram_rate_limit_wait_seconds = Histogram(
+    name="alertbot_telegram_rate_limit_wait_seconds",
+    documentation="Time a telegram message waited for the rate limiter before being sent",
+    buckets=(0, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+
+alertbot_telegram_rate_limit_waiters = Gauge(
+    name="alertbot_telegram_rate_limit_waiters",
+    documentation="Number of telegram messages waiting for the rate limiter",
+    multiprocess_mode="livesum"
+)
+
+alertbot_telegram_throttled_counter = Counter(
+    name="alertbot_telegram_throttled",
+    documentation="Number of 429 responses received from telegram"
+)
+
+
+alertbot_duplicate_webhooks_suppressed_counter = LimitedLabels(Counter(
+    name="alertbot_duplicate_webhooks_suppressed",
+    documentation="Number of prometheus webhooks dropped because the same alerts were already accepted",
+    labelnames=["receiver"]
+))
+
+alertbot_state_backend_errors_counter = Counter(
+    name="alertbot_state_backend_errors",
+    documentation="Number of calls to the shared state backend (redis) that failed",
+    labelnames=["operation"]
+)
+
+
+alertbot_silences_counter = Counter(
+    name="alertbot_silences",
+    documentation="Number of silence button presses by result: created, already_silenced, expired or failed",
+    labelnames=["result"]
+)
+
+
+alertbot_telegram_batch_size = Histogram(
+    name="alertbot_telegram_batch_size",
+    documentation="Number of alert groups sent together by one telegram batching window",
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100)
+)
+
+
+alertbot_outbox_rows = Gauge(
+    name="alertbot_outbox_rows",
+    documentation="Number of accepted deliveries stored in the outbox and not acknowledged yet",
+    multiprocess_mode="mostrecent"  # the workers share the outbox
+)
+
+alertbot_outbox_commit_seconds = Histogram(
+    name="alertbot_outbox_commit_seconds",
+    documentation="Time spent writing one group commit to the outbox",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+
+alertbot_outbox_commit_batch_size = Histogram(
+    name="alertbot_outbox_commit_batch_size",
+    documentation="Number of appends and acknowledgements written by one outbox commit",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+
+alertbot_outbox_replayed_counter = Counter(
+    name="alertbot_outbox_replayed",
+    documentation="Number of deliveries replayed from the outbox after a restart"
+)
+
+alertbot_outbox_dropped_counter = Counter(
+    name="alertbot_outbox_dropped",
+    documentation="Number of deliveries removed from the outbox without being handled",
+    labelnames=["reason"]
+)
+
+
+alertbot_retries_counter = Counter(
+    name="alertbot_retries",
+    documentation="Retry decisions taken after a failed attempt, by retry policy",
+    labelnames=["policy", "outcome"]
+)
+
+
+alertbot_circuit_breaker_state = Gauge(
+    name="alertbot_circuit_breaker_state",
+    documentation="State of the circuit breaker of an upstream host: 0 closed, 1 half-open, 2 open",
+    labelnames=["host"],
+    multiprocess_mode="livemax"  # every worker has its own breakers, report the worst
+)
+
+alertbot_circuit_breaker_transitions_counter = Counter(
+    name="alertbot_circuit_breaker_transitions",
+    documentation="Number of times the circuit breaker of an upstream host changed to a state",
+    labelnames=["host", "state"]
+)
+
+alertbot_circuit_breaker_rejected_counter = Counter(
+    name="alertbot_circuit_breaker_rejected",
+    documentation="Number of calls failed fast because the circuit of the upstream host was open",
+    labelnames=["host"]
+)
+
+
+alertbot_pipeline_stage_duration_seconds = LimitedLabels(Histogram(
+    name="alertbot_pipeline_stage_duration_seconds",
+    documentation="Time spent in each stage of handling an alert, see utils.pipeline_timing",
+    labelnames=["stage", "channel", "receiver_class"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+))
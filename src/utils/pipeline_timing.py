@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .metrics import alertbot_pipeline_stage_duration_seconds
+import time
+
+# Stages of alertbot_pipeline_stage_duration_seconds
+PARSE_STAGE = "parse"
+ROUTING_STAGE = "routing"
+TEMPLATE_STAGE = "template"
+GET_NUMBERS_STAGE = "get_numbers"
+SEND_ATTEMPT_STAGE = "send_attempt"
+RETRY_SLEEP_STAGE = "retry_sleep"
+
+# (channel, receiver_class) of the delivery being handled, receiver_class being the alert source.
+# Tasks and threads started from a delivery inherit it, so stages deep in the handlers are
+# labelled without passing it around.
+_pipeline_labels = ContextVar("alertbot_pipeline_labels", default=("none", "none"))
+
+def set_pipeline_labels(channel: str, receiver_class: str):
+    """
+    Label the stages timed from now on in this context.
+
+    Args:
+        channel (str): `TELEGRAM_CONFIG_WORD`, `SMS_CONFIG_WORD` or "none" before routing.
+        receiver_class (str): `PROMETHEUS_SOURCE` or `SPLUNK_SOURCE`, the same value the parse
+            and routing stages of the alert use. Receiver and route names are left out so the
+            label stays bounded however many receivers are configured.
+
+    Returns:
+        The token to give to `reset_pipeline_labels`.
+    """
+    return _pipeline_labels.set((channel, receiver_class))
+
+def reset_pipeline_labels(token):
+    _pipeline_labels.reset(token)
+
+@contextmanager
+def time_stage(stage: str, channel: str = None, receiver_class: str = None):
+    """Observe the time spent in the block, including when it raises"""
+    default_channel, default_receiver_class = _pipeline_labels.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        alertbot_pipeline_stage_duration_seconds.labels(
+            stage,
+            channel or default_channel,
+            receiver_class or default_receiver_class
+        ).observe(time.perf_counter() - start)
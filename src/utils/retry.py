@@ -1,19 +1,222 @@
 from functools import wraps
+from typing import Any, Callable, Optional, Tuple, Type
+from alertbot.env import RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND, RETRY_MAX_DELAY
+from .metrics import alertbot_retries_counter
+from .pipeline_timing import time_stage, RETRY_SLEEP_STAGE
+import asyncio
+import inspect
 import logging
+import random
+import threading
 import time
 
 logger = logging.getLogger("alertbot")
 
-def retry_on_failure(max_retries: int = 3, delay: float = 1.0):
+
+def retriable_status(status_code: int) -> bool:
+    """Only throttling and server errors are worth another attempt, other 4xx will fail the same way"""
+    return status_code == 429 or status_code >= 500
+
+
+class RetryBudget:
+    """
+    A process-wide cap on retries. Every first attempt deposits `ratio` tokens and every
+    retry withdraws one, on top of `min_per_second` tokens that trickle in regardless.
+    When an upstream is degraded, retries stop at about `ratio` of the traffic instead of
+    multiplying it.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 5, max_tokens: float = 100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()  # the sync variant runs in worker threads
+
+    def _refill(self, now: float):
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def record_call(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one retry from the budget, returns False if there is none left"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+retry_budget = RetryBudget(ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND)
+
+
+class RetryPolicy:
+    """
+    Retries a callable with exponential backoff and full jitter.
+
+    An exception is retried unless it is one of `non_retriable` or has a `retriable` attribute
+    set to False. A returned value is retried when `retry_if_result` returns True for it, and
+    after the last attempt it is returned as it is. A `retry_after` attribute on the exception,
+    or the value given by `retry_after` for a result, replaces the computed delay.
+
+    Args:
+        name (str): Used in logs and in the `alertbot_retries` metric.
+        max_attempts (int): Attempts including the first one.
+        base_delay (float): Delay before the first retry, doubled (`multiplier`) on every retry.
+        max_delay (float): Upper bound of a single delay.
+        multiplier (float): Growth of the delay between retries.
+        jitter (bool): Pick the delay uniformly between 0 and the computed backoff.
+        deadline (float, optional): Seconds after the first attempt when no retry is started anymore.
+        non_retriable (tuple): Exception types that are raised right away.
+        retry_if_result (Callable, optional): Returns True for results that should be retried.
+        retry_after (Callable, optional): Returns the delay a result asks for, or None.
+        budget (RetryBudget, optional): Budget shared with other policies, None to not use one.
+    """
+
+    def __init__(self, name: str = "default",
+                 max_attempts: int = 3,
+                 base_delay: float = 1.0,
+                 max_delay: float = RETRY_MAX_DELAY,
+                 multiplier: float = 2.0,
+                 jitter: bool = True,
+                 deadline: Optional[float] = None,
+                 non_retriable: Tuple[Type[BaseException], ...] = (),
+                 retry_if_result: Optional[Callable[[Any], bool]] = None,
+                 retry_after: Optional[Callable[[Any], Optional[float]]] = None,
+                 budget: Optional[RetryBudget] = retry_budget):
+        self.name = name
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        self.non_retriable = non_retriable
+        self.retry_if_result = retry_if_result
+        self.retry_after = retry_after
+        self.budget = budget
+
+    def backoff(self, attempt: int) -> float:
+        """Delay after the given (1-based) failed attempt"""
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def is_retriable(self, error: BaseException) -> bool:
+        if isinstance(error, self.non_retriable):
+            return False
+        return getattr(error, "retriable", True)
+
+    def _next_delay(self, attempt: int, started_at: float, error: BaseException = None, result: Any = None) -> Optional[float]:
+        """
+        Decide whether to retry after a failed attempt.
+
+        Returns:
+            Optional[float]: Seconds to sleep before the next attempt, None to give up.
+        """
+        if error is not None and not self.is_retriable(error):
+            alertbot_retries_counter.labels(policy=self.name, outcome="non_retriable").inc()
+            return None
+        if attempt >= self.max_attempts:
+            alertbot_retries_counter.labels(policy=self.name, outcome="exhausted").inc()
+            return None
+
+        hint = getattr(error, "retry_after", None) if error is not None else \
+            (self.retry_after(result) if self.retry_after else None)
+        if hasattr(hint, "total_seconds"):  # timedelta
+            hint = hint.total_seconds()
+        delay = min(float(hint), self.max_delay) if hint is not None else self.backoff(attempt)
+        if self.deadline is not None and time.monotonic() + delay - started_at > self.deadline:
+            alertbot_retries_counter.labels(policy=self.name, outcome="deadline").inc()
+            return None
+        if self.budget is not None and not self.budget.try_spend():
+            logger.warning(f"Retry budget is exhausted, not retrying {self.name}")
+            alertbot_retries_counter.labels(policy=self.name, outcome="budget_exhausted").inc()
+            return None
+        alertbot_retries_counter.labels(policy=self.name, outcome="retried").inc()
+        reason = repr(error) if error is not None else f"result {result!r}"
+        logger.warning(f"{self.name}: attempt {attempt} failed ({reason}), retrying in {delay:.2f} seconds")
+        return delay
+
+    def _failed_result(self, result: Any) -> bool:
+        return self.retry_if_result is not None and self.retry_if_result(result)
+
+    def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Call `func` until it succeeds or the policy gives up, sleeping between attempts"""
+        if self.budget is not None:
+            self.budget.record_call()
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(attempt, started_at, error=e)
+                if delay is None:
+                    raise
+            else:
+                if not self._failed_result(result):
+                    return result
+                delay = self._next_delay(attempt, started_at, result=result)
+                if delay is None:
+                    return result
+            with time_stage(RETRY_SLEEP_STAGE):
+                time.sleep(delay)
+
+    async def run_async(self, func: Callable, *args, **kwargs) -> Any:
+        """Await `func` until it succeeds or the policy gives up, without blocking the event loop"""
+        if self.budget is not None:
+            self.budget.record_call()
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(attempt, started_at, error=e)
+                if delay is None:
+                    raise
+            else:
+                if not self._failed_result(result):
+                    return result
+                delay = self._next_delay(attempt, started_at, result=result)
+                if delay is None:
+                    return result
+            with time_stage(RETRY_SLEEP_STAGE):
+                await asyncio.sleep(delay)
+
+    def __call__(self, func: Callable) -> Callable:
+        """Use the policy as a decorator, coroutine functions get the async variant"""
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                return await self.run_async(func, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.run(func, *args, **kwargs)
+        return wrapper
+
+
+def retry_on_failure(max_retries: int = 3, delay: float = 1.0, **policy_arguments):
     """Decorator to retry failed operations with configurable parameters.
 
-    This decorator will attempt to execute the decorated function multiple times
-    if it fails with an exception. Between retries, it will wait for a specified
-    delay period.
+    The decorated function is attempted up to `max_retries` times, waiting an exponentially
+    growing, jittered delay between attempts. Coroutine functions sleep without blocking
+    the event loop.
 
     Args:
-        max_retries (int, optional): Maximum number of retry attempts. Defaults to 3.
-        delay (float, optional): Time to wait between retries in seconds. Defaults to 1.0.
+        max_retries (int, optional): Maximum number of attempts. Defaults to 3.
+        delay (float, optional): Base delay between attempts in seconds. Defaults to 1.0.
+        **policy_arguments: Any other `RetryPolicy` argument, e.g. `non_retriable`.
 
     Returns:
         function: Decorated function that will retry on failure.
@@ -21,17 +224,4 @@ def retry_on_failure(max_retries: int = 3, delay: float = 1.0):
     Raises:
         Exception: If all retry attempts fail, the last exception is re-raised.
     """
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        raise
-                    logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
-                    time.sleep(delay)
-            return None
-        return wrapper
-    return decorator
\ No newline at end of file
+    return RetryPolicy(max_attempts=max_retries, base_delay=delay, **policy_arguments)
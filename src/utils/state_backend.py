@@ -0,0 +1,207 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+from alertbot.env import STATE_BACKEND, REDIS_URL, REDIS_TIMEOUT, STATE_KEY_PREFIX, STATE_MAX_ENTRIES
+from .metrics import alertbot_state_backend_errors_counter
+import logging
+import time
+
+logger = logging.getLogger("alertbot")
+
+class StateBackendError(Exception):
+    """Raised when the state backend can not be reached, callers decide how to degrade"""
+    pass
+
+
+class StateBackend(ABC):
+    """
+    Small key/value store for state that has to be shared by every alertbot process
+    (dedup keys, rate limit windows, cached lookups). Values are strings, every write
+    can set a ttl in seconds.
+
+    `shared` is False when the state only lives in this process.
+    """
+    shared = False
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float = None):
+        pass
+
+    @abstractmethod
+    async def set_if_absent(self, key: str, value: str = "1", ttl: float = None) -> bool:
+        """Returns True if the key was set, False if it already exists"""
+        pass
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        """Atomically add `amount` and return the new value, `ttl` is only applied when the key is created"""
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    Keeps the state in this process. Keys are grouped by namespace, the part of the key
+    before the first ":" (dedup, silence...), and every namespace is bounded to `max_entries`
+    keys on its own, so a burst of dedup keys can't evict the labels of silence buttons.
+
+    When a namespace is full, its expired keys are dropped first, then the keys written
+    first. Every user writes its keys with the same ttl, so the keys written first are also
+    the first to expire. Only used from the event loop, so no locking is needed.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._namespaces = {}  # namespace -> OrderedDict of key -> (value, expires_at or None)
+
+    @staticmethod
+    def _namespace(key: str) -> str:
+        return key.partition(":")[0]
+
+    def _get(self, key: str, now: float):
+        entries = self._namespaces.get(self._namespace(key))
+        entry = None if entries is None else entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del entries[key]
+            return None
+        return entry
+
+    def _set(self, key: str, value, expires_at: Optional[float], now: float):
+        entries = self._namespaces.setdefault(self._namespace(key), OrderedDict())
+        entries.pop(key, None)
+        entries[key] = (value, expires_at)
+        if len(entries) <= self.max_entries:
+            return
+        while entries:
+            expires = next(iter(entries.values()))[1]
+            if expires is None or expires > now:
+                break
+            entries.popitem(last=False)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    @staticmethod
+    def _expires_at(now: float, ttl: float = None) -> Optional[float]:
+        return None if ttl is None else now + ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._get(key, time.monotonic())
+        return None if entry is None else str(entry[0])
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        now = time.monotonic()
+        self._set(key, value, self._expires_at(now, ttl), now)
+
+    async def set_if_absent(self, key: str, value: str = "1", ttl: float = None) -> bool:
+        now = time.monotonic()
+        if self._get(key, now) is not None:
+            return False
+        self._set(key, value, self._expires_at(now, ttl), now)
+        return True
+
+    async def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        now = time.monotonic()
+        entry = self._get(key, now)
+        if entry is None:
+            self._set(key, amount, self._expires_at(now, ttl), now)
+            return amount
+        value = int(entry[0]) + amount
+        self._namespaces[self._namespace(key)][key] = (value, entry[1])
+        return value
+
+    async def delete(self, key: str):
+        entries = self._namespaces.get(self._namespace(key))
+        if entries is not None:
+            entries.pop(key, None)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._namespaces.values())
+
+
+# INCRBY and PEXPIRE in one step, so a key never lives without its ttl
+INCR_SCRIPT = """
+local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+if value == tonumber(ARGV[1]) and tonumber(ARGV[2]) > 0 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return value
+"""
+
+class RedisStateBackend(StateBackend):
+    """
+    Keeps the state in Redis so every replica and worker shares it. Every key is put
+    under `prefix`. Calls give up after `timeout` seconds and raise StateBackendError.
+    """
+    shared = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = STATE_KEY_PREFIX, timeout: float = REDIS_TIMEOUT):
+        # Only needed with STATE_BACKEND=redis
+        import redis.asyncio as redis
+        self._errors = (redis.RedisError, OSError)
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout,
+                                           decode_responses=True)
+        self._incr = self.client.register_script(INCR_SCRIPT)
+
+    async def _call(self, operation: str, coroutine):
+        try:
+            return await coroutine
+        except self._errors as e:
+            alertbot_state_backend_errors_counter.labels(operation=operation).inc()
+            raise StateBackendError(f"Redis {operation} failed: {e!r}") from e
+
+    @staticmethod
+    def _milliseconds(ttl: float = None) -> Optional[int]:
+        return None if ttl is None else max(1, int(ttl * 1000))
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._call("get", self.client.get(self.prefix + key))
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        await self._call("set", self.client.set(self.prefix + key, value, px=self._milliseconds(ttl)))
+
+    async def set_if_absent(self, key: str, value: str = "1", ttl: float = None) -> bool:
+        result = await self._call("set_if_absent", self.client.set(
+            self.prefix + key, value, px=self._milliseconds(ttl), nx=True))
+        return bool(result)
+
+    async def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        return int(await self._call("incr", self._incr(
+            keys=[self.prefix + key], args=[amount, self._milliseconds(ttl) or 0])))
+
+    async def delete(self, key: str):
+        await self._call("delete", self.client.delete(self.prefix + key))
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_backend = None
+
+def get_state_backend() -> StateBackend:
+    """The backend chosen by STATE_BACKEND, created on first use"""
+    global _backend
+    if _backend is None:
+        if STATE_BACKEND == "redis":
+            logger.info(f"Keeping shared state in redis ({STATE_KEY_PREFIX}*)")
+            _backend = RedisStateBackend()
+        else:
+            _backend = MemoryStateBackend(max_entries=STATE_MAX_ENTRIES)
+    return _backend
+
+async def close_state_backend():
+    "Used on application shutdown"
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from alertbot.schemas import AlertRequestPrometheus
+from services import alertmanager
+from services.alertmanager import get_alertmanager_client, silence_alertmanager_url
+
+CONFIGURED = "https://alertmanager.example.com"
+ALLOWED = "https://alertmanager-2.example.com/prefix"
+
+
+@pytest.fixture(autouse=True)
+def configured(monkeypatch):
+    monkeypatch.setattr(alertmanager, "CONFIGURED_URL", CONFIGURED)
+    monkeypatch.setattr(alertmanager, "ALLOWED_URLS", frozenset([ALLOWED]))
+    monkeypatch.setattr(alertmanager, "ALERTMANAGER_USERNAME", "alertbot")
+    monkeypatch.setattr(alertmanager, "ALERTMANAGER_PASSWORD", "secret")
+    monkeypatch.setattr(alertmanager, "_clients", {})
+
+
+def test_configured_alertmanager_wins_over_the_external_url(monkeypatch):
+    assert silence_alertmanager_url("https://evil.example.com") == CONFIGURED
+    monkeypatch.setattr(alertmanager, "CONFIGURED_URL", "")
+    assert silence_alertmanager_url(ALLOWED + "/") == ALLOWED
+    assert silence_alertmanager_url("https://evil.example.com") is None
+    assert silence_alertmanager_url(None) is None
+
+
+def test_credentials_only_go_to_the_configured_alertmanager():
+    assert "Authorization" in get_alertmanager_client(CONFIGURED + "/").headers
+    assert "Authorization" not in get_alertmanager_client(ALLOWED).headers
+    with pytest.raises(ValueError):
+        get_alertmanager_client("https://evil.example.com")
+    assert set(alertmanager._clients) == {CONFIGURED, ALLOWED}
+
+
+def test_no_silence_target_for_an_unknown_external_url(monkeypatch):
+    pytest.importorskip("telegram")
+    from alertbot.prometheus_endpoint.prom_telegram_functions import silence_target
+
+    monkeypatch.setattr(alertmanager, "CONFIGURED_URL", "")
+    alert = AlertRequestPrometheus.model_validate({
+        "receiver": "team", "status": "firing", "alerts": [],
+        "groupLabels": {"alertname": "NodeDown"}, "commonLabels": {"alertname": "NodeDown"},
+        "commonAnnotations": {}, "externalURL": "https://evil.example.com",
+        "version": "4", "groupKey": "{}", "truncatedAlerts": 0})
+    assert silence_target(alert) == (None, None)
+    alert.externalURL = ALLOWED
+    assert silence_target(alert) == ({"alertname": "NodeDown"}, ALLOWED)
+
+
+def test_silencer_refuses_unknown_alertmanagers():
+    from services.silencer import Silencer
+
+    with pytest.raises(ValueError):
+        asyncio.run(Silencer().remember("https://evil.example.com", {"alertname": "NodeDown"}))
+    assert "https://evil.example.com" not in Silencer()._indexes
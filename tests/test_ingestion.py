@@ -0,0 +1,42 @@
+import glob
+import os
+
+import pytest
+from fastapi.exceptions import RequestValidationError
+
+from alertbot.ingestion import AlertStreamParser, parse_prometheus
+
+SAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                        "samples", "prometheus-*.json")))
+
+
+def parse_stream(body: bytes, chunk_size: int):
+    parser = AlertStreamParser()
+    text = body.decode()
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+    parser.feed("", final=True)
+    return parser.result()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+@pytest.mark.parametrize("path", SAMPLES, ids=os.path.basename)
+def test_samples_parse_the_same_both_ways(path, chunk_size):
+    with open(path, "rb") as file:
+        body = file.read()
+    assert parse_stream(body, chunk_size) == parse_prometheus(body)
+
+
+@pytest.mark.parametrize("body", [
+    b'{"alerts": [1,]}',
+    b'{"alerts": [{"status": "firing"},]}',
+    b'{"alerts": [], "status": "firing",}',
+    b'{"alerts": [',
+    b'{"status": "firing"} []',
+    b'[1, 2]',
+])
+def test_malformed_bodies_are_refused_both_ways(body):
+    with pytest.raises(RequestValidationError):
+        parse_prometheus(body)
+    with pytest.raises(RequestValidationError):
+        parse_stream(body, 3)
@@ -0,0 +1,26 @@
+from handlers.telegram_handler.message_splitter import iter_chunks, split_message
+
+
+def test_less_than_sign_followed_by_a_space_is_text():
+    text = "load < b > idle and <b>bold</b> " + "word " * 30
+    chunks = split_message(text, 60)
+    assert "".join(chunks).replace("</b>", "").replace("<b>", "").split() == \
+        text.replace("</b>", "").replace("<b>", "").split()
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    # "< b >" opened nothing, so no chunk closes a tag that isn't open
+    assert all(chunk.count("</b>") <= chunk.count("<b>") for chunk in chunks)
+
+
+def test_open_tags_are_carried_over_a_cut():
+    chunks = split_message("<b>" + "word " * 40 + "</b>", 50)
+    assert len(chunks) > 1
+    assert all(chunk.startswith("<b>") and chunk.endswith("</b>") for chunk in chunks)
+
+
+def test_parts_are_cut_between_alerts():
+    parts = ["<b>header</b>\n"] + [f"alert {index}\n" + "line\n" * 20 for index in range(6)]
+    chunks = list(iter_chunks(parts, 300))
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    # Every chunk after the first starts with an alert instead of the middle of one
+    assert all(chunk.startswith("alert ") for chunk in chunks[1:])
+    assert "".join(chunks).count("line") == 6 * 20
@@ -0,0 +1,176 @@
+import asyncio
+import fcntl
+import time
+
+import pytest
+
+from alertbot.delivery.outbox import Outbox
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def rows(outbox: Outbox) -> list:
+    return await outbox._run(lambda: outbox._connection.execute(
+        "SELECT id, job, owner, replays FROM deliveries ORDER BY id").fetchall())
+
+
+async def die(outbox: Outbox):
+    """Leave the outbox the way a killed worker does: rows and lock file stay, the lock is gone"""
+    await outbox._run(outbox._connection.close)
+    outbox._executor.shutdown(wait=True)
+    fcntl.flock(outbox._owner_lock, fcntl.LOCK_UN)
+    outbox._owner_lock.close()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "outbox.db")
+
+
+def test_ack_removes_the_row(path):
+    async def scenario():
+        outbox = Outbox(path, commit_interval_ms=1)
+        await outbox.open()
+        ids = await outbox.append(["a", "b"])
+        outbox.ack(ids[0])
+        await outbox._flush_task
+        left = await rows(outbox)
+        await outbox.close()
+        return ids, left
+
+    ids, left = run(scenario())
+    assert [row[:2] for row in left] == [(ids[1], "b")]
+
+
+def test_failed_write_keeps_its_acks(path):
+    async def scenario():
+        outbox = Outbox(path, commit_interval_ms=1)
+        await outbox.open()
+        ids = await outbox.append(["a", "b"])
+        write = outbox._write
+        failures = [RuntimeError("disk full")]
+
+        def failing_once(jobs, acks):
+            if failures:
+                raise failures.pop()
+            return write(jobs, acks)
+
+        outbox._write = failing_once
+        outbox.ack(ids[0])
+        await outbox._flush_task
+        after_failure = (list(outbox._acks), len(await rows(outbox)))
+        outbox.ack(ids[1])
+        await outbox._flush_task
+        after_retry = (list(outbox._acks), len(await rows(outbox)))
+        await outbox.close()
+        return ids, after_failure, after_retry
+
+    ids, after_failure, after_retry = run(scenario())
+    assert after_failure == ([ids[0]], 2)
+    assert after_retry == ([], 0)
+
+
+def test_rows_of_a_dead_owner_are_replayed_not_those_of_a_live_one(path):
+    async def scenario():
+        live, dead, survivor = Outbox(path), Outbox(path), Outbox(path)
+        for outbox in (live, dead, survivor):
+            await outbox.open()
+        await live.append(["live"])
+        await dead.append(["dead"])
+        await die(dead)
+        claimed = await survivor.pending()
+        again = await survivor.pending()
+        owners = {job: owner for _, job, owner, _ in await rows(survivor)}
+        await live.close()
+        await survivor.close()
+        return claimed, again, owners, survivor.owner, live.owner
+
+    claimed, again, owners, survivor_owner, live_owner = run(scenario())
+    assert [job for _, job in claimed] == ["dead"]
+    assert again == []
+    assert owners == {"live": live_owner, "dead": survivor_owner}
+
+
+def test_rows_replayed_max_replays_times_are_dropped(path):
+    async def scenario():
+        first = Outbox(path, max_replays=1)
+        await first.open()
+        await first.append(["crashes the process"])
+        await die(first)
+        second = Outbox(path, max_replays=1)
+        await second.open()
+        replayed = await second.pending()
+        await die(second)
+        third = Outbox(path, max_replays=1)
+        await third.open()
+        dropped = await third.pending()
+        left = await rows(third)
+        await third.close()
+        return replayed, dropped, left
+
+    replayed, dropped, left = run(scenario())
+    assert [job for _, job in replayed] == ["crashes the process"]
+    assert dropped == [] and left == []
+
+
+def test_compact_applies_retention_and_max_rows(path):
+    async def scenario():
+        outbox = Outbox(path, max_rows=2, retention_seconds=3600)
+        await outbox.open()
+        await outbox.append(["old"])
+        await outbox._run(lambda: outbox._connection.execute(
+            "UPDATE deliveries SET created_at = ?", (time.time() - 7200,)))
+        await outbox.append(["1", "2", "3"])
+        await outbox.compact()
+        left = [job for _, job, _, _ in await rows(outbox)]
+        await outbox.close()
+        return left
+
+    assert run(scenario()) == ["2", "3"]
+
+
+def test_queue_replays_and_acks_the_jobs_of_a_dead_worker(path, monkeypatch):
+    pytest.importorskip("telegram")
+    from alertbot.delivery import delivery_queue
+    from alertbot.delivery.delivery_queue import DeliveryJob, DeliveryQueue
+
+    delivered, forgotten = [], []
+
+    async def deliver(job):
+        delivered.append(job.receiver)
+        if job.receiver == "failing":
+            raise RuntimeError("telegram is down")
+
+    async def forget(key):
+        forgotten.append(key)
+
+    monkeypatch.setattr(delivery_queue, "deliver", deliver)
+    monkeypatch.setattr(delivery_queue, "forget", forget)
+    monkeypatch.setattr(DeliveryQueue, "_instance", None)
+
+    async def scenario():
+        dead = Outbox(path)
+        await dead.open()
+        await dead.append([DeliveryJob(source="splunk", channel="telegram", target={}, payload={},
+                                       receiver=receiver, dedup_key=f"key-{receiver}").dumps()
+                           for receiver in ("working", "failing")])
+        await die(dead)
+        outbox = Outbox(path, commit_interval_ms=1)
+        await outbox.open()
+        queue = DeliveryQueue(workers=1, max_size=10, outbox=outbox)
+        queue.start()
+        await queue.replay()
+        await queue._queue.join()
+        await outbox._flush_task
+        left = await rows(outbox)
+        # Closes the outbox too
+        await queue.stop()
+        return left
+
+    left = run(scenario())
+    assert sorted(delivered) == ["failing", "working"]
+    # The failed job went through its retries, it is acked and its dedup key released
+    assert forgotten == ["key-failing"]
+    assert left == []
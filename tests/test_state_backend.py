@@ -0,0 +1,131 @@
+import asyncio
+import uuid
+
+import pytest
+
+from conftest import free_port
+from utils import state_backend
+from utils.state_backend import MemoryStateBackend, RedisStateBackend, StateBackend, StateBackendError
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_memory_namespaces_are_bounded_separately():
+    async def scenario():
+        backend = MemoryStateBackend(max_entries=3)
+        await backend.set("silence:button", "labels", ttl=600)
+        for index in range(10):
+            await backend.set_if_absent(f"dedup:{index}", ttl=60)
+        return backend, await backend.get("silence:button"), [await backend.get(f"dedup:{index}") for index in range(10)]
+
+    backend, silence, dedup = run(scenario())
+    assert silence == "labels"
+    assert dedup == [None] * 7 + ["1"] * 3
+    assert len(backend) == 4
+
+
+def test_memory_drops_expired_keys_before_live_ones(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(state_backend.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        backend = MemoryStateBackend(max_entries=2)
+        await backend.set("dedup:old", "1", ttl=10)
+        await backend.set("dedup:live", "1", ttl=100)
+        now[0] += 50
+        await backend.set("dedup:new", "1", ttl=100)
+        return [await backend.get(key) for key in ("dedup:old", "dedup:live", "dedup:new")]
+
+    assert run(scenario()) == [None, "1", "1"]
+
+
+def test_memory_incr_keeps_the_ttl_of_the_first_write(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(state_backend.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        backend = MemoryStateBackend()
+        values = [await backend.incr("rate:chat", ttl=1) for _ in range(3)]
+        now[0] += 1
+        values.append(await backend.incr("rate:chat", ttl=1))
+        return values
+
+    assert run(scenario()) == [1, 2, 3, 1]
+
+
+@pytest.fixture
+def redis_backend(redis_url):
+    # Every test gets its own prefix, the server is shared by the session
+    return lambda: RedisStateBackend(url=redis_url, prefix=f"alertbot-test-{uuid.uuid4().hex}:", timeout=2)
+
+
+def test_redis_incr_script_sets_the_ttl_once(redis_backend):
+    async def scenario():
+        backend = redis_backend()
+        try:
+            values = [await backend.incr("rate:chat", ttl=60) for _ in range(3)]
+            values.append(await backend.incr("rate:chat", amount=5, ttl=1))
+            ttl = await backend.client.pttl(backend.prefix + "rate:chat")
+            await backend.incr("counter")
+            no_ttl = await backend.client.pttl(backend.prefix + "counter")
+            return values, ttl, no_ttl
+        finally:
+            await backend.close()
+
+    values, ttl, no_ttl = run(scenario())
+    assert values == [1, 2, 3, 8]
+    # Set by the first INCR only, the later ttl=1 did not shorten it
+    assert 1000 < ttl <= 60000
+    assert no_ttl == -1
+
+
+def test_redis_keys_expire(redis_backend):
+    async def scenario():
+        backend = redis_backend()
+        try:
+            await backend.set("silence:button", "labels", ttl=0.2)
+            first = await backend.set_if_absent("dedup:key", ttl=0.2)
+            second = await backend.set_if_absent("dedup:key", ttl=0.2)
+            await backend.incr("rate:chat", ttl=0.2)
+            before = await backend.get("silence:button")
+            await asyncio.sleep(0.4)
+            after = [await backend.get(key) for key in ("silence:button", "dedup:key", "rate:chat")]
+            again = await backend.set_if_absent("dedup:key", ttl=0.2)
+            incremented = await backend.incr("rate:chat", ttl=0.2)
+            return first, second, before, after, again, incremented
+        finally:
+            await backend.close()
+
+    assert run(scenario()) == (True, False, "labels", [None, None, None], True, 1)
+
+
+def test_redis_delete(redis_backend):
+    async def scenario():
+        backend = redis_backend()
+        try:
+            await backend.set_if_absent("dedup:key", ttl=60)
+            await backend.delete("dedup:key")
+            return await backend.set_if_absent("dedup:key", ttl=60)
+        finally:
+            await backend.close()
+
+    assert run(scenario()) is True
+
+
+def test_redis_unreachable_raises_state_backend_error():
+    async def scenario():
+        backend = RedisStateBackend(url=f"redis://127.0.0.1:{free_port()}/0", timeout=0.5)
+        try:
+            with pytest.raises(StateBackendError):
+                await backend.incr("rate:chat", ttl=1)
+        finally:
+            await backend.close()
+
+    run(scenario())
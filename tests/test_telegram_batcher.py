@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from handlers.telegram_handler import telegram_batcher  # noqa: E402
+from handlers.telegram_handler.telegram_batcher import TelegramBatcher  # noqa: E402
+
+LABELS = {"receiver": "team", "cluster": "main", "severity": "critical"}
+
+
+class FakeAPI:
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.sent = []
+
+    async def send_message(self, chat_id, text, message_thread_id=None, telegram_metrics_labels=None):
+        self.sent.append((chat_id, text))
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def api(monkeypatch):
+    def install(error: Exception = None):
+        fake = FakeAPI(error)
+        monkeypatch.setattr(telegram_batcher, "TelegramHandlerAPI", lambda: fake)
+        return fake
+    monkeypatch.setattr(TelegramBatcher, "_instance", None)
+    return install
+
+
+def test_groups_of_a_window_are_sent_together_and_resolved(api):
+    fake = api()
+
+    async def scenario():
+        batcher = TelegramBatcher()
+        futures = [batcher.add("1", f"group {index}\n", window_ms=10, telegram_metrics_labels=LABELS)
+                   for index in range(3)]
+        assert not any(future.done() for future in futures)
+        return await asyncio.gather(*futures)
+
+    assert asyncio.run(scenario()) == [None, None, None]
+    assert fake.sent == [("1", "group 0\ngroup 1\ngroup 2\n")]
+
+
+def test_a_failed_batch_fails_every_group_in_it(api):
+    api(RuntimeError("telegram is down"))
+
+    async def scenario():
+        batcher = TelegramBatcher()
+        futures = [batcher.add("1", f"group {index}\n", window_ms=10, telegram_metrics_labels=LABELS)
+                   for index in range(2)]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [str(result) for result in results] == ["telegram is down"] * 2
+
+
+def test_flush_all_sends_what_is_waiting(api):
+    fake = api()
+
+    async def scenario():
+        batcher = TelegramBatcher()
+        future = batcher.add("1", "group\n", window_ms=60000, telegram_metrics_labels=LABELS)
+        await batcher.flush_all()
+        return future.done()
+
+    assert asyncio.run(scenario()) is True
+    assert fake.sent == [("1", "group\n")]
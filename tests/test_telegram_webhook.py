@@ -0,0 +1,149 @@
+"""
+The Telegram webhook route against the fake Bot API and Alertmanager of benchmarks/loadtest/fakes.py.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from conftest import free_port, wait_for_port
+
+pytest.importorskip("telegram")
+
+from alertbot.telegram_endpoint import telegram as telegram_endpoint  # noqa: E402
+from handlers.telegram_handler import telegram_handler  # noqa: E402
+from handlers.telegram_handler.telegram_handler import TelegramHandler  # noqa: E402
+from services import alertmanager  # noqa: E402
+from services.silencer import Silencer  # noqa: E402
+
+FAKES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     "benchmarks", "loadtest", "fakes.py")
+SECRET = "test-secret"
+CHAT_ID = -100200300
+
+
+@pytest.fixture(scope="module")
+def fakes_url():
+    port = free_port()
+    process = subprocess.Popen([sys.executable, FAKES, "--port", str(port),
+                                "--tg-latency-ms", "0", "--am-latency-ms", "0"])
+    try:
+        if not wait_for_port(port, process):
+            pytest.fail("the fake services did not start")
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@pytest.fixture
+def webhook(fakes_url, monkeypatch):
+    """Posts updates to the webhook route, with the handler talking to the fakes"""
+    monkeypatch.setattr(telegram_endpoint, "TG_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(telegram_handler, "TG_API_BASE_URL", fakes_url)
+    monkeypatch.setattr(TelegramHandler, "_instance", None)
+    monkeypatch.setattr(Silencer, "_instance", None)
+    monkeypatch.setattr(alertmanager, "CONFIGURED_URL", fakes_url)
+    monkeypatch.setattr(alertmanager, "_clients", {})
+    httpx.post(f"{fakes_url}/reset")
+    app = FastAPI()
+    app.include_router(telegram_endpoint.router)
+
+    async def post(update, secret: str = SECRET):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://alertbot") as client:
+            headers = {} if secret is None else {telegram_endpoint.SECRET_TOKEN_HEADER: secret}
+            return await client.post("/api/v2/telegram/webhook", json=update, headers=headers)
+
+    TelegramHandler(token="123456:test")
+    return post
+
+
+def callback_update(update_id: int, callback_data: str, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": 1, "is_bot": False, "first_name": "Test", "username": "oncall"},
+            "chat_instance": "test",
+            "data": callback_data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": CHAT_ID, "type": "supergroup", "title": "test"},
+                "text": text,
+            },
+        },
+    }
+
+
+def stats(fakes_url: str) -> dict:
+    return httpx.get(f"{fakes_url}/stats").json()
+
+
+@pytest.mark.parametrize("secret", [None, "", "wrong"])
+def test_updates_without_the_secret_are_refused(webhook, fakes_url, secret):
+    response = asyncio.run(webhook(callback_update(1, "alert_confirm", "[lt-1-] Node is down"), secret=secret))
+    assert response.status_code == 401
+    assert stats(fakes_url) == {}
+
+
+def test_updates_are_refused_when_no_secret_is_configured(webhook, fakes_url, monkeypatch):
+    monkeypatch.setattr(telegram_endpoint, "TG_WEBHOOK_SECRET", "")
+    response = asyncio.run(webhook(callback_update(1, "alert_confirm", "[lt-1-] Node is down"), secret=""))
+    assert response.status_code == 401
+    assert stats(fakes_url) == {}
+
+
+def test_body_must_be_a_json_object(webhook):
+    assert asyncio.run(webhook([1, 2])).status_code == 400
+
+
+def test_confirm_button_marks_the_message(webhook, fakes_url):
+    response = asyncio.run(webhook(callback_update(2, "alert_confirm", "[lt-2-] Node is down")))
+    assert response.status_code == 204
+    result = stats(fakes_url)
+    assert result["telegram_callbacks"]["requests"] == 1
+    assert list(result["telegram_edits"]["first_seen"]) == ["2"]
+    assert "alertmanager" not in result
+
+
+def test_silence_button_creates_the_silence(webhook, fakes_url):
+    labels = {"alertname": "NodeDown", "instance": "node-3:9100"}
+
+    async def scenario():
+        callback_data = await Silencer().remember(fakes_url, labels)
+        first = await webhook(callback_update(3, callback_data, "[lt-3-] Node is down"))
+        # A second press finds the silence in the index instead of creating another one
+        second = await webhook(callback_update(4, callback_data, "[lt-3-] Node is down"))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert (first.status_code, second.status_code) == (204, 204)
+    silences = httpx.get(f"{fakes_url}/api/v2/silences").json()
+    assert len(silences) == 1
+    assert {(matcher["name"], matcher["value"]) for matcher in silences[0]["matchers"]} == set(labels.items())
+    assert silences[0]["createdBy"] == "@oncall (alertbot)"
+    result = stats(fakes_url)
+    assert result["telegram_callbacks"]["requests"] == 2
+    assert result["telegram_edits"]["requests"] == 2
+
+
+def test_expired_silence_button_is_only_answered(webhook, fakes_url):
+    response = asyncio.run(webhook(callback_update(5, "silence:unknown", "[lt-5-] Node is down")))
+    assert response.status_code == 204
+    result = stats(fakes_url)
+    assert result["telegram_callbacks"]["requests"] == 1
+    assert "telegram_edits" not in result
+    assert "alertmanager" not in result
+
+
+def test_other_updates_are_ignored(webhook, fakes_url):
+    response = asyncio.run(webhook({"update_id": 6, "message": {
+        "message_id": 6, "date": int(time.time()), "chat": {"id": CHAT_ID, "type": "supergroup"}, "text": "hi"}}))
+    assert response.status_code == 204
+    assert stats(fakes_url) == {}